@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Long running WSGI alternative to index.py, for when the status page is served dynamically
+
+Holds one read-only connection to the db and renders the page at most once per status, caching it
+against the status generation, which changes with every publish. Pages are sent with a strong ETag,
+so browsers sitting on the page's meta refresh get a 304 back without anything being rendered, and
+are told they can cache it until the next check is due.
+
+Run it under any WSGI server, e.g. gunicorn --chdir html app:application, or directly for testing.
+Either way the howfuckedistheinternet package needs to be installed"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+
+from howfuckedistheinternet import config, db
+from howfuckedistheinternet.api import etag_matches
+from jinja2 import Environment, FileSystemLoader
+
+sqlitedb = "howfucked.db"
+index_template = "index.j2"
+root = "/var/www/howfuckedistheinternet.com/html/"
+default_max_age = 60    # Seconds to cache the page for if we don't know when the next check is
+
+
+class StatusPage:
+    """WSGI app serving the status page from the db in root"""
+
+    def __init__(self, root, sqlitedb=sqlitedb, template=index_template, clock=time.time):
+        self.path = root + sqlitedb
+        self.environment = Environment(loader=FileSystemLoader(root))
+        self.template = template
+        self.clock = clock
+        self._connection = None
+        self._lock = threading.Lock()
+        self._cached = None     # (generation, body, etag)
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._connection.row_factory = sqlite3.Row
+        return self._connection
+
+    def _page(self):
+        """The rendered page for the latest status as (body, etag), and when the next check is due"""
+
+        with self._lock:
+            with db.snapshot(self._connect()) as connection:
+                row = connection.execute("SELECT status, timestamp, duration, next, generation FROM status").fetchone()
+                status, timestamp, duration, next_check, generation = row if row else (None, None, None, None, None)
+
+                if self._cached is None or self._cached[0] != generation:
+                    reasons = connection.execute("SELECT * FROM reasons ORDER BY weight DESC").fetchall()
+                    metrics = connection.execute("SELECT * FROM metrics ORDER BY weight DESC").fetchall()
+                    sparklines = db.sparklines(connection, self.clock(), config.sparkline_windows)
+                    body = self.environment.get_template(self.template).render(
+                        timestamp=timestamp,
+                        duration=duration,
+                        status=status,
+                        reasons=[tuple(reason) for reason in reasons],
+                        metrics=[dict(metric) for metric in metrics],
+                        sparklines=sparklines,
+                    ).encode()
+                    etag = f'"{hashlib.sha1(body).hexdigest()[:20]}"'
+                    self._cached = (generation, body, etag)
+
+            _, body, etag = self._cached
+            return body, etag, next_check
+
+    def __call__(self, environ, start_response):
+        if environ.get("REQUEST_METHOD", "GET") not in ("GET", "HEAD"):
+            start_response("405 Method Not Allowed", [("Allow", "GET, HEAD"), ("Content-Length", "0")])
+            return [b""]
+
+        try:
+            body, etag, next_check = self._page()
+        except sqlite3.Error as e:
+            message = f"Failed to read sqlite3 db {self.path}: {e}".encode()
+            start_response(
+                "503 Service Unavailable",
+                [("Content-Type", "text/plain;charset=utf-8"), ("Content-Length", str(len(message))), ("Retry-After", "60")],
+            )
+            return [message]
+
+        if next_check is None:
+            max_age = default_max_age
+        else:
+            max_age = max(0, int(next_check - self.clock()))
+        headers = [("ETag", etag), ("Cache-Control", f"public, max-age={max_age}")]
+
+        if etag_matches(environ.get("HTTP_IF_NONE_MATCH", ""), etag):
+            start_response("304 Not Modified", headers)
+            return [b""]
+
+        headers += [("Content-Type", "text/html;charset=utf-8"), ("Content-Length", str(len(body)))]
+        start_response("200 OK", headers)
+        return [b""] if environ.get("REQUEST_METHOD") == "HEAD" else [body]
+
+
+application = StatusPage(root)
+
+
+if __name__ == "__main__":
+    from wsgiref.simple_server import make_server
+
+    with make_server("", 8000, application) as server:
+        server.serve_forever()
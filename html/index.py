@@ -1,11 +1,18 @@
 #!/usr/bin/env python3
+# Fallback for when the checker isn't rendering index.html itself (see render_enabled in config.py).
+# Have the web server try index.html first, e.g. DirectoryIndex index.html index.py
+# Reads the db with the howfuckedistheinternet package, which needs to be installed
 import cgitb
+import os
 import sqlite3
+import time
 
+from howfuckedistheinternet import config, db
 from jinja2 import Environment, FileSystemLoader
 
 sqlitedb = "howfucked.db"
 index_template = "index.j2"
+index_html = "index.html"
 root = "/var/www/howfuckedistheinternet.com/html/"
 
 cgitb.enable()
@@ -13,6 +20,14 @@ print("Content-Type: text/html;charset=utf-8\r\n\r\n")
 
 
 def main():
+    # Serve the page the checker rendered, if it has
+    try:
+        with open(os.path.join(root, index_html)) as f:
+            print(f.read())
+        return
+    except OSError:
+        pass
+
     environment = Environment(loader=FileSystemLoader(root))
     template = environment.get_template(index_template)
 
@@ -23,25 +38,31 @@ def main():
         print(f"Failed to open sqlite3 db {root + sqlitedb}")
         exit(1)
 
-    try:
-        status, timestamp, duration = cursor.execute("SELECT * FROM status").fetchone()
-    except:
-        status, timestamp, duration = None, None, None
+    with db.snapshot(connection):
+        try:
+            status, timestamp, duration = cursor.execute("SELECT status, timestamp, duration FROM status").fetchone()
+        except:
+            status, timestamp, duration = None, None, None
 
-    try:
-        reasons = cursor.execute(
-            "SELECT * FROM reasons ORDER BY weight DESC"
-        ).fetchall()
-    except:
-        reasons = None
+        try:
+            reasons = cursor.execute(
+                "SELECT * FROM reasons ORDER BY weight DESC"
+            ).fetchall()
+        except:
+            reasons = None
 
-    try:
-        connection.row_factory = sqlite3.Row
-        cursor = connection.cursor()
-        c = cursor.execute("SELECT * FROM metrics ORDER BY weight DESC")
-        metrics = [dict(row) for row in c.fetchall()]
-    except:
-        metrics = None
+        try:
+            connection.row_factory = sqlite3.Row
+            cursor = connection.cursor()
+            c = cursor.execute("SELECT * FROM metrics ORDER BY weight DESC")
+            metrics = [dict(row) for row in c.fetchall()]
+        except:
+            metrics = None
+
+        try:
+            sparklines = db.sparklines(connection, time.time(), config.sparkline_windows)
+        except:
+            sparklines = None
 
     html = template.render(
         timestamp=timestamp,
@@ -49,6 +70,7 @@ def main():
         status=status,
         reasons=reasons,
         metrics=metrics,
+        sparklines=sparklines,
     )
     print(html)
 
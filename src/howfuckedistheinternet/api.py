@@ -0,0 +1,286 @@
+"""JSON API for the status and its history
+
+Serves two documents from the db the checker publishes to:
+
+    /status     the status, score, when it was checked and is next due, every metric with the outcome of
+                its latest check, and each reason with its tag, plain text and links pulled out of its HTML
+    /history    ?series=score.weighted&start=<unix time>&end=<unix time>&resolution=hourly
+                (timestamp, mean, min, max) of a series recorded by the checker, see db.query(). Without
+                an end it runs up to the latest sample, and without a start it covers the last day
+
+Responses are only built when the status changes. Until then every request is served from a snapshot
+of the encoded JSON, its gzipped twin and their strong ETags, so polling it costs next to nothing.
+
+Run it under any WSGI server, e.g. gunicorn howfuckedistheinternet.api:application"""
+
+import collections
+import gzip
+import hashlib
+import html
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import typing
+import urllib.parse
+sys.path.append(os.path.dirname(__file__))
+import config
+import db
+import ujson
+
+_TAG = re.compile(r"^\[([^\]]+)\]\s*")
+_LINK = re.compile(r"<a href=(['\"])(.*?)\1>(.*?)</a>")
+_STALE = re.compile(r" \(stale, from (\d+) mins ago\)$")
+
+_HISTORY_CACHE_SIZE = 256   # Distinct history queries to keep snapshots of
+_DEFAULT_MAX_AGE = 60       # Seconds to let clients cache for if we don't know when the next check is
+
+
+def parse_reason(reason: str, metric: str, weight: float) -> dict[str, typing.Any]:
+    """Splits a reason like "[Slack] <a href='...'>Incident</a> - ..." into its tag, its text without the
+    HTML, and its links. Reasons served from stale results also say how many minutes old they are"""
+
+    tag = None
+    body = reason
+    if match := _TAG.match(body):
+        tag = match.group(1)
+        body = body[match.end():]
+
+    stale = None
+    if match := _STALE.search(body):
+        stale = int(match.group(1))
+        body = body[:match.start()]
+
+    links = [{"text": html.unescape(text), "url": html.unescape(url)} for _, url, text in _LINK.findall(body)]
+    text = html.unescape(_LINK.sub(lambda match: match.group(3), body))
+
+    return {
+        "metric": metric,
+        "weight": weight,
+        "tag": tag,
+        "text": text,
+        "links": links,
+        "stale_mins": stale,
+        "html": reason,
+    }
+
+
+def status_document(
+    status: typing.Optional[str],
+    timestamp: typing.Optional[str],
+    duration: typing.Optional[str],
+    next_check: typing.Optional[int],
+    score: typing.Optional[float],
+    reasons: typing.Iterable[tuple[str, str, float]],
+    metrics: typing.Iterable[dict[str, typing.Any]],
+) -> dict[str, typing.Any]:
+    """The /status document, with metrics and their reasons heaviest first"""
+
+    metrics = sorted(metrics, key=lambda metric: metric["weight"] or 0, reverse=True)
+    by_metric: dict[str, list[dict[str, typing.Any]]] = {metric["metric"]: [] for metric in metrics}
+    for reason, metric, weight in sorted(reasons, key=lambda reason: reason[2] or 0, reverse=True):
+        by_metric.setdefault(metric, []).append(parse_reason(reason, metric, weight))
+
+    return {
+        "status": status,
+        "score": score,
+        "timestamp": timestamp,
+        "duration": int(duration) if duration else None,
+        "next": next_check,
+        "metrics": [
+            {
+                "metric": metric["metric"],
+                "description": metric["description"],
+                "weight": metric["weight"],
+                "frequency": metric["frequency"],
+                "last": metric["last"],
+                "reasons": by_metric[metric["metric"]],
+            }
+            for metric in metrics
+        ],
+    }
+
+
+class Snapshot:
+    """An encoded response, gzipped ahead of time, each with its own strong ETag"""
+
+    __slots__ = ("body", "gzip_body", "etag", "gzip_etag")
+
+    def __init__(self, document: typing.Any) -> None:
+        self.body = ujson.dumps(document).encode()
+        self.gzip_body = gzip.compress(self.body, mtime=0)
+        digest = hashlib.sha1(self.body).hexdigest()[:20]
+        self.etag = f'"{digest}"'
+        self.gzip_etag = f'"{digest}-gzip"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Whether an If-None-Match header matches etag, using the weak comparison it calls for"""
+
+    if if_none_match.strip() == "*":
+        return True
+    tags = (tag.strip() for tag in if_none_match.split(","))
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.partition(";")
+        if name.strip().lower() == "gzip":
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
+class BadRequest(Exception):
+    pass
+
+
+HistoryKey = tuple[str, int, typing.Optional[int], typing.Optional[str]]    # (series, start, end, resolution)
+
+
+class API:
+    """WSGI app serving the JSON API from the db at path, over one read-only connection"""
+
+    def __init__(self, path: str, clock: typing.Callable[[], float] = time.time) -> None:
+        self.path = path
+        self.clock = clock
+        self._connection: typing.Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._generation: typing.Optional[int] = None
+        self._next_check: typing.Optional[int] = None
+        self._status: typing.Optional[Snapshot] = None
+        self._history: collections.OrderedDict[HistoryKey, Snapshot] = (
+            collections.OrderedDict()
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        return self._connection
+
+    def _refresh(self, connection: sqlite3.Connection) -> None:
+        """Rebuilds the status snapshot and forgets the history ones, if the status has changed since"""
+
+        row = connection.execute("SELECT status, timestamp, duration, next, score, generation FROM status").fetchone()
+        status, timestamp, duration, next_check, score, generation = row if row else (None,) * 6
+        # Timestamps are to the second, which several publishes can share
+        if self._status is not None and generation == self._generation:
+            return
+
+        reasons = connection.execute("SELECT reason, metric, weight FROM reasons").fetchall()
+        metrics = [
+            {"metric": metric, "description": description, "weight": weight, "frequency": frequency, "last": last}
+            for metric, description, weight, frequency, last in connection.execute(
+                "SELECT metric, description, weight, frequency, last FROM metrics"
+            )
+        ]
+        self._status = Snapshot(status_document(status, timestamp, duration, next_check, score, reasons, metrics))
+        self._generation = generation
+        self._next_check = next_check
+        # New samples will have been recorded with the new status
+        self._history.clear()
+
+    def _snapshot(self, path: str, query: str) -> tuple[Snapshot, typing.Optional[int]]:
+        """The snapshot for a request, and when the next check is due"""
+
+        key = self._history_key(query) if path == "/history" else None
+
+        with self._lock, db.snapshot(self._connect()) as connection:
+            self._refresh(connection)
+            if key is None:
+                assert self._status is not None
+                return self._status, self._next_check
+
+            if key in self._history:
+                self._history.move_to_end(key)
+            else:
+                series, start, end, resolution = key
+                rows = db.query(connection, series, start, sys.maxsize if end is None else end, resolution)
+                self._history[key] = Snapshot({
+                    "series": series,
+                    "start": start,
+                    "end": end,
+                    "resolution": resolution or "raw",
+                    "points": rows,
+                })
+                if len(self._history) > _HISTORY_CACHE_SIZE:
+                    self._history.popitem(last=False)
+            return self._history[key], self._next_check
+
+    def _history_key(self, query: str) -> HistoryKey:
+        params = urllib.parse.parse_qs(query)
+        series = params.get("series", [""])[-1]
+        if not series:
+            raise BadRequest("series is required")
+        resolution = params.get("resolution", ["raw"])[-1]
+        if resolution not in ("raw", "hourly", "daily"):
+            raise BadRequest("resolution must be raw, hourly or daily")
+        try:
+            end = int(params["end"][-1]) if "end" in params else None
+            if "start" in params:
+                start = int(params["start"][-1])
+            else:
+                # To the minute, so clients polling the last day share a snapshot
+                start = (int(self.clock() if end is None else end) - 86400) // 60 * 60
+        except ValueError:
+            raise BadRequest("start and end must be unix timestamps")
+        return series, start, end, None if resolution == "raw" else resolution
+
+    def __call__(self, environ: dict[str, typing.Any], start_response: typing.Callable[..., typing.Any]) -> list[bytes]:
+        method = environ.get("REQUEST_METHOD", "GET")
+        if method not in ("GET", "HEAD"):
+            return self._error(
+                start_response, "405 Method Not Allowed", "Only GET and HEAD are supported", [("Allow", "GET, HEAD")]
+            )
+        path = environ.get("PATH_INFO", "/")
+        if path not in ("/status", "/history"):
+            return self._error(start_response, "404 Not Found", f"No such endpoint {path}, try /status or /history")
+
+        try:
+            snapshot, next_check = self._snapshot(path, environ.get("QUERY_STRING", ""))
+        except BadRequest as e:
+            return self._error(start_response, "400 Bad Request", str(e))
+        except sqlite3.Error as e:
+            if config.debug:
+                print(f"Failed to read sqlite3 db {self.path}: {e}")
+            return self._error(start_response, "503 Service Unavailable", "Status unavailable", [("Retry-After", "60")])
+
+        if next_check is None:
+            max_age = _DEFAULT_MAX_AGE
+        else:
+            max_age = max(0, int(next_check - self.clock()))
+
+        if accepts_gzip(environ.get("HTTP_ACCEPT_ENCODING", "")):
+            body, etag = snapshot.gzip_body, snapshot.gzip_etag
+            encoding = [("Content-Encoding", "gzip")]
+        else:
+            body, etag = snapshot.body, snapshot.etag
+            encoding = []
+        headers = [("ETag", etag), ("Cache-Control", f"public, max-age={max_age}"), ("Vary", "Accept-Encoding")]
+
+        if etag_matches(environ.get("HTTP_IF_NONE_MATCH", ""), etag):
+            start_response("304 Not Modified", headers)
+            return [b""]
+
+        headers += encoding + [("Content-Type", "application/json"), ("Content-Length", str(len(body)))]
+        start_response("200 OK", headers)
+        return [b""] if method == "HEAD" else [body]
+
+    @staticmethod
+    def _error(
+        start_response: typing.Callable[..., typing.Any],
+        status: str,
+        message: str,
+        headers: typing.Optional[list[tuple[str, str]]] = None,
+    ) -> list[bytes]:
+        body = ujson.dumps({"error": message}).encode()
+        start_response(
+            status,
+            [("Content-Type", "application/json"), ("Content-Length", str(len(body)))] + (headers or []),
+        )
+        return [body]
+
+
+application = API(config.html_root + config.sqlitedb)
@@ -0,0 +1,147 @@
+"""Per upstream host circuit breakers, so a dead or rate limiting source isn't waited on over and over
+
+A host's breaker opens after config.breaker_failures consecutive failed requests, or straight away
+on a 429. While it's open, requests to that host fail fast with SourceUnavailable instead of sitting
+out a timeout. Once the backoff is up it goes half-open and lets a single trial request through: if
+that works it closes again, otherwise it reopens for twice as long, up to config.breaker_max_backoff.
+A Retry-After header on a 429 or 503 is honoured if it asks for longer than that."""
+
+import email.utils
+import os
+import sys
+import threading
+import time
+import typing
+import urllib.parse
+sys.path.append(os.path.dirname(__file__))
+import config
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class SourceUnavailable(Exception):
+    """Raised instead of requesting anything from a host whose breaker is open"""
+
+    # Reported as the outcome of the job that needed it, rather than a failure
+    outcome = "source unavailable"
+
+    def __init__(self, host: str, retry_at: float) -> None:
+        super().__init__(f"{host} is unavailable for another {max(0, round(retry_at - time.time()))}s")
+        self.host = host
+        self.retry_at = retry_at
+
+
+def parse_retry_after(value: typing.Optional[str]) -> typing.Optional[float]:
+    """Seconds to wait from a Retry-After header, given as either delay-seconds or an HTTP date"""
+
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Breaker:
+    def __init__(self, host: str, clock: typing.Callable[[], float] = time.time) -> None:
+        self.host = host
+        self.clock = clock
+        self.failures = 0       # consecutive failed requests
+        self.trips = 0          # consecutive times opened, for the backoff
+        self.retry_at = 0.0     # when an open breaker goes half-open
+        self._open = False
+        self._trial = False     # a half-open trial request is in flight
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if not self._open:
+            return CLOSED
+        return OPEN if self.clock() < self.retry_at or self._trial else HALF_OPEN
+
+    def available(self) -> bool:
+        """Whether a request might be let through, without using up a half-open trial"""
+
+        return self.state != OPEN
+
+    def allow(self) -> bool:
+        """Whether a request can be made now. In the half-open state only the first caller gets to"""
+
+        with self._lock:
+            state = self.state
+            if state == HALF_OPEN:
+                self._trial = True
+            return state != OPEN
+
+    def success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.trips = 0
+            self._open = False
+            self._trial = False
+
+    def failure(self, retry_after: typing.Optional[float] = None) -> None:
+        """Records a failed request, opening the breaker if it's had enough of them, or if told to retry later.
+        Once it's open only a failed half-open trial backs it off any further"""
+
+        with self._lock:
+            self.failures += 1
+            trial = self._trial
+            self._trial = False
+            if self._open and not trial:
+                # A request that was already in flight when it opened, which says nothing new about the host
+                if retry_after is not None:
+                    self.retry_at = max(self.retry_at, self.clock() + retry_after)
+                return
+            if trial or retry_after is not None or self.failures >= config.breaker_failures:
+                backoff = min(config.breaker_backoff * 2 ** self.trips, config.breaker_max_backoff)
+                self.retry_at = self.clock() + max(backoff, retry_after or 0)
+                self.trips += 1
+                self._open = True
+
+
+_breakers: dict[str, Breaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def for_url(url: str) -> Breaker:
+    host = urllib.parse.urlsplit(url).netloc
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = Breaker(host)
+        return _breakers[host]
+
+
+def check(url: str) -> None:
+    """Raises SourceUnavailable if url's host can't be requested right now"""
+
+    b = for_url(url)
+    if not b.allow():
+        raise SourceUnavailable(b.host, b.retry_at)
+
+
+def record(url: str, status: typing.Optional[int] = None, retry_after: typing.Optional[str] = None) -> None:
+    """Records the outcome of a request to url: its HTTP status, or None if it didn't get a response at all.
+    Server errors and rate limiting count as failures, anything else means the host is up"""
+
+    b = for_url(url)
+    if status == 429:
+        # Rate limited, so back off straight away whether or not it says for how long
+        b.failure(parse_retry_after(retry_after) or 0.0)
+    elif status is None or status >= 500:
+        b.failure(parse_retry_after(retry_after) if status == 503 else None)
+    else:
+        b.success()
+
+
+def states() -> dict[str, str]:
+    """Current state of every host that's been requested"""
+
+    with _breakers_lock:
+        return {host: b.state for host, b in _breakers.items()}
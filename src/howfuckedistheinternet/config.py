@@ -1,14 +1,66 @@
 max_history = 4             # 2hrs at regular 30min updates
-update_frequency = 1800     # 30 mins
+history_evict_after = 48    # Forget prefixes, ASNs and repos that have been gone for 24hrs at regular 30min updates
+http_cache_dir = "cache/"   # Cached upstream responses, for conditional requests. None to always fetch in full
+history_dir = "history/"    # Persisted history, so restarts don't have to warm up again. None to keep it in memory only
+update_frequency = 1800     # 30 mins. How often the history based metrics are checked, for describing how long history covers
 write_sql_enabled = True
 debug = True
 
 headers = {"User-Agent": "howfuckedistheinternet.com"}
 
+http_timeout = 60           # Seconds allowed for each upstream request, unless it asks for something else
+http_connect_timeout = 10   # Seconds allowed to connect to an upstream host
+http_retries = 2            # Times to retry connecting to an upstream host before giving up on a request
+http_max_connections = 32   # Max connections from the shared HTTP client, across all hosts
+
+breaker_failures = 3        # Consecutive failed requests to a host before giving it a rest
+breaker_backoff = 60        # Seconds to give a failing host before trying it again, doubling each time it fails again
+breaker_max_backoff = 3600  # Most seconds to give a failing host, unless it sends a longer Retry-After
+
+stale_max_age = 3600        # Seconds to keep using a source's last good results while it's failing
+stale_retry = 120           # Seconds until retrying a source whose stale results are being used
+
+job_workers = 8             # Max jobs (see main) running at once
+job_timeout = 300           # Seconds a job is allowed before it's recorded as timed out and its results are ignored
+job_timeouts = {            # Per job overrides of job_timeout
+    "bgp": 900,
+}
+
+atlas_concurrency = 16      # Max RIPE Atlas measurements fetched at once, over one pooled client
+atlas_deadline = 60         # Seconds allowed for each RIPE Atlas measurement fetch
+
+tls_cache_size = 1000       # Max distinct cert chain validation results to remember
+tls_cache_max_age = 86400   # Seconds to trust a cached cert chain validation result, if the chain doesn't expire sooner
+tls_workers = None          # Processes to validate cert chains across. None for one per core
+tls_batch_size = 8          # Cert chains sent to a validation process at a time
+
+aws_concurrency = 64        # Max AWS connectivity checks in flight at once
+aws_connect_timeout = 5     # Seconds allowed to connect to each AWS checkpoint
+aws_read_timeout = 10       # Seconds allowed for each AWS checkpoint to respond once connected
+# A region's sample is grown until a clean one can rule out the threshold (35 checkpoints at 10%, 95%), so sampling
+# only saves requests on regions with more checkpoints than that, and mostly when they're down
+aws_sample_size = None      # AWS checkpoints sampled per region, before probing the rest if that's inconclusive. None to probe all
+aws_sample_z = 1.96         # z-score of the confidence interval for sampled AWS failure rates, 95%
+
 aws_v4_file = "aws_ec2_checkpoints.json"
 aws_v6_file = "aws_ec2_checkpointsv6.json"
 html_root = "/var/www/howfuckedistheinternet.com/html/"
 sqlitedb = "howfucked.db"
+render_enabled = True       # Render the status page to static files in html_root, rather than leaving it to the CGI
+index_template = "index.j2"
+index_html = "index.html"
+index_json = "index.json"
+
+samples_raw_retention = 7 * 86400           # Seconds to keep every sample recorded to the db, before rolling them up hourly
+samples_hourly_retention = 90 * 86400       # Seconds to keep hourly sample aggregates, before rolling them up daily
+samples_daily_retention = 5 * 365 * 86400   # Seconds to keep daily sample aggregates
+rollup_freq = 3600                          # Seconds between rolling up and expiring old samples
+sparkline_series = ("score.weighted", "dfz.v4", "dfz.v6", "roa.total")     # Samples charted on the status page
+sparkline_windows = {                       # Chart windows, as (seconds per point, points)
+    "24h": (1800, 48),
+    "7d": (4 * 3600, 42),
+    "30d": (12 * 3600, 60),
+}
 
 # Adjust metric weighting based on importance
 # threshold unit for literal measurements is %; measurements using historic averages have no thresholds
@@ -91,6 +143,13 @@ metrics = {
         "freq": 1800,
         "descr": "AWS connectivity checks",
     },
+    "aws_latency": {
+        "enabled": True,
+        "weight": 1,
+        "threshold": 50,
+        "freq": 1800,
+        "descr": "Increase in AWS connectivity check latency",
+    },
     "gcp": {
         "enabled": True,
         "weight": 1,
@@ -109,21 +168,21 @@ metrics = {
         "enabled": True,
         "weight": 2,
         "threshold": None,
-        "freq": 1800,
+        "freq": 60,
         "descr": "Open Cloudflare incidents"
     },
     "slack": {
         "enabled": True,
         "weight": 1,
         "threshold": None,
-        "freq": 1800,
+        "freq": 60,
         "descr": "Open Slack incidents"
     },
     "discord": {
         "enabled": True,
         "weight": 1,
         "threshold": None,
-        "freq": 1800,
+        "freq": 60,
         "descr": "Open Discord incidents"
     },
 }
\ No newline at end of file
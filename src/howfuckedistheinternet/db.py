@@ -0,0 +1,252 @@
+"""SQLite database the status page is rendered from
+
+The database is kept in WAL mode, so the page can read a consistent snapshot while the checker
+is writing, without either of them waiting on the other. Each publish replaces the status and
+reasons and updates the metric outcomes in one transaction, so readers only ever see the previous
+status or the next one, never a half written mix of the two.
+
+Alongside the latest status, every publish appends the samples recorded since the last one (the
+score, each metric's reasons, and raw values like the DFZ size) to the samples table, which is
+only ever appended to and indexed by time. roll_up() periodically folds old samples into hourly
+and then daily aggregates and expires the oldest of those, so the db stays bounded in size and
+queries over months only have to read a few rows per day.
+
+Samples of the series charted on the status page are also folded into the sparklines table as they're
+published. Each chart window is a fixed ring of slots, each averaging a fixed period, so every sample
+updates one row per window whatever the history, and drawing a chart reads one small series."""
+
+import contextlib
+import sqlite3
+import threading
+import time
+import typing
+
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS metrics (metric TEXT PRIMARY KEY, description TEXT,
+                              weight REAL, frequency INTEGER, last TEXT)""",
+    """CREATE TABLE IF NOT EXISTS status (status TEXT, timestamp TEXT, duration TEXT, next INTEGER, score REAL,
+                              generation INTEGER)""",
+    """CREATE TABLE IF NOT EXISTS reasons (reason TEXT, metric TEXT, weight REAL,
+                              FOREIGN KEY(metric) REFERENCES metrics(metric))""",
+    "CREATE TABLE IF NOT EXISTS samples (ts INTEGER NOT NULL, series TEXT NOT NULL, value REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS samples_ts ON samples (ts)",
+    "CREATE INDEX IF NOT EXISTS samples_series_ts ON samples (series, ts)",
+) + tuple(
+    statement
+    for table in ("samples_hourly", "samples_daily")
+    for statement in (
+        f"""CREATE TABLE IF NOT EXISTS {table} (ts INTEGER NOT NULL, series TEXT NOT NULL, count INTEGER NOT NULL,
+                              total REAL NOT NULL, low REAL NOT NULL, high REAL NOT NULL,
+                              PRIMARY KEY (series, ts)) WITHOUT ROWID""",
+        f"CREATE INDEX IF NOT EXISTS {table}_ts ON {table} (ts)",
+    )
+) + (
+    """CREATE TABLE IF NOT EXISTS sparklines (series TEXT NOT NULL, window TEXT NOT NULL, slot INTEGER NOT NULL,
+                              ts INTEGER NOT NULL, span INTEGER NOT NULL, count INTEGER NOT NULL, total REAL NOT NULL,
+                              PRIMARY KEY (series, window, slot)) WITHOUT ROWID""",
+)
+
+# Aggregate tables, with the seconds each of their rows covers
+_ROLLUPS = {"hourly": ("samples_hourly", 3600), "daily": ("samples_daily", 86400)}
+
+# Columns added since the tables were first created, added to older dbs by connect()
+_ADDED_COLUMNS = (
+    ("status", "next", "INTEGER"),     # Unix time the next check is due, so readers know how long to cache the status for
+    ("status", "score", "REAL"),       # Weighted number of reasons the status is based on
+    ("status", "generation", "INTEGER"),  # Counts publishes, so readers can tell two in the same second apart
+)
+
+Sample = tuple[int, str, float]     # (unix timestamp, series, value)
+
+
+class Sparklines:
+    """Which series to keep sparklines of, over which windows of (seconds per point, points)"""
+
+    def __init__(self, series: typing.Iterable[str], windows: typing.Mapping[str, tuple[int, int]]) -> None:
+        self.series = frozenset(series)
+        self.windows = dict(windows)
+
+    def rows(self, samples: typing.Iterable[Sample]) -> typing.Iterator[tuple[str, str, int, int, int, float]]:
+        """(series, window, slot, slot ts, span, value) for each window of each sample of a charted series"""
+
+        for ts, series, value in samples:
+            if series in self.series:
+                for window, (period, points) in self.windows.items():
+                    slot_ts = ts // period * period
+                    yield series, window, slot_ts // period % points, slot_ts, period * points, value
+
+
+class Samples:
+    """Thread safe buffer of samples, so jobs can record them as they go and they're all written in one go"""
+
+    def __init__(self, clock: typing.Callable[[], float] = time.time) -> None:
+        self.clock = clock
+        self._samples: list[Sample] = []
+        self._lock = threading.Lock()
+
+    def add(self, series: str, value: float) -> None:
+        with self._lock:
+            self._samples.append((int(self.clock()), series, value))
+
+    def drain(self) -> list[Sample]:
+        """Returns and forgets every sample added so far"""
+
+        with self._lock:
+            samples, self._samples = self._samples, []
+        return samples
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """Opens the database for writing, switching it to WAL mode and creating any missing tables.
+    Raises sqlite3.OperationalError if it can't be opened"""
+
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    # A crash can lose the last publish, but can't corrupt the database
+    connection.execute("PRAGMA synchronous=NORMAL")
+    with connection:
+        for statement in _SCHEMA:
+            connection.execute(statement)
+        _migrate(connection)
+    return connection
+
+
+@contextlib.contextmanager
+def snapshot(connection: sqlite3.Connection) -> typing.Iterator[sqlite3.Connection]:
+    """Reads everything in the block from the same snapshot, in case the checker publishes part way through"""
+
+    connection.execute("BEGIN")
+    try:
+        yield connection
+    finally:
+        connection.rollback()
+
+
+def _migrate(connection: sqlite3.Connection) -> None:
+    """Brings tables created by older versions up to date"""
+
+    for table, column, column_type in _ADDED_COLUMNS:
+        columns = [row[1] for row in connection.execute(f"PRAGMA table_info({table})")]
+        if column not in columns:
+            connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+
+def init_metrics(connection: sqlite3.Connection, metrics: typing.Iterable[tuple[typing.Any, ...]]) -> None:
+    """Replaces the metrics table with (metric, description, weight, frequency, last) rows"""
+
+    with connection:
+        connection.execute("DELETE FROM metrics")
+        connection.executemany("INSERT INTO metrics VALUES (?, ?, ?, ?, ?)", metrics)
+
+
+def publish(
+    connection: sqlite3.Connection,
+    status: tuple[str, str, str, typing.Optional[int], typing.Optional[float]],
+    reasons: typing.Iterable[tuple[str, str, float]],
+    outcomes: typing.Iterable[tuple[typing.Optional[str], str]],
+    samples: typing.Iterable[Sample] = (),
+    sparklines: typing.Optional[Sparklines] = None,
+) -> None:
+    """Atomically replaces the (status, timestamp, duration, next, score) and (reason, metric, weight) rows,
+    sets the (last, metric) outcome of each metric, appends the samples, and adds them to any sparklines.
+    Rolls back and raises sqlite3.Error on failure"""
+
+    with connection:
+        (generation,) = connection.execute("SELECT coalesce(max(generation), 0) + 1 FROM status").fetchone()
+        connection.execute("DELETE FROM status")
+        connection.execute(
+            "INSERT INTO status (status, timestamp, duration, next, score, generation) VALUES (?, ?, ?, ?, ?, ?)",
+            (*status, generation),
+        )
+        connection.execute("DELETE FROM reasons")
+        connection.executemany("INSERT INTO reasons VALUES (?, ?, ?)", reasons)
+        connection.executemany("UPDATE metrics SET last = ? WHERE metric = ?", outcomes)
+        samples = list(samples)
+        connection.executemany("INSERT INTO samples VALUES (?, ?, ?)", samples)
+        if sparklines:
+            # A slot still holding a previous lap of the ring is started afresh
+            connection.executemany(
+                """INSERT INTO sparklines VALUES (?, ?, ?, ?, ?, 1, ?)
+                   ON CONFLICT (series, window, slot) DO UPDATE SET
+                       count = CASE WHEN ts = excluded.ts THEN count + 1 ELSE 1 END,
+                       total = CASE WHEN ts = excluded.ts THEN total + excluded.total ELSE excluded.total END,
+                       ts = excluded.ts,
+                       span = excluded.span
+                   WHERE excluded.ts >= ts""",
+                sparklines.rows(samples),
+            )
+
+
+def _merge(source: str, table: str, period: int, before: int, aggregates: str) -> tuple[str, str]:
+    """SQL to merge the rows of source older than `before` into table's `period` second rows, and to then delete them"""
+
+    return (
+        f"""INSERT INTO {table} (ts, series, count, total, low, high)
+            SELECT ts / {period} * {period} AS period_ts, series, {aggregates} FROM {source}
+            WHERE ts < {before} GROUP BY series, period_ts
+            ON CONFLICT (series, ts) DO UPDATE SET
+                count = {table}.count + excluded.count,
+                total = {table}.total + excluded.total,
+                low = min({table}.low, excluded.low),
+                high = max({table}.high, excluded.high)""",
+        f"DELETE FROM {source} WHERE ts < {before}",
+    )
+
+
+def roll_up(
+    connection: sqlite3.Connection,
+    now: float,
+    raw_retention: float,
+    hourly_retention: float,
+    daily_retention: float,
+) -> None:
+    """Folds samples older than raw_retention into hourly aggregates, hourly aggregates older than
+    hourly_retention into daily ones, and drops daily aggregates older than daily_retention.
+    Only whole hours and days are folded, so a partly rolled up one is never split across two rows"""
+
+    hourly_table, hour = _ROLLUPS["hourly"]
+    daily_table, day = _ROLLUPS["daily"]
+    hourly_before = int(now - raw_retention) // hour * hour
+    daily_before = int(now - hourly_retention) // day * day
+
+    with connection:
+        for statement in _merge("samples", hourly_table, hour, hourly_before, "count(*), sum(value), min(value), max(value)"):
+            connection.execute(statement)
+        for statement in _merge(hourly_table, daily_table, day, daily_before, "sum(count), sum(total), min(low), max(high)"):
+            connection.execute(statement)
+        connection.execute(f"DELETE FROM {daily_table} WHERE ts < ?", (int(now - daily_retention),))
+
+
+def sparklines(
+    connection: sqlite3.Connection, now: float, windows: typing.Optional[typing.Iterable[str]] = None
+) -> dict[str, dict[str, list[float]]]:
+    """series -> window -> the average of each slot still within the window, oldest first.
+    The windows are in the order given, leaving out any others, or else shortest first"""
+
+    charts: dict[str, dict[str, list[float]]] = {}
+    for series, window, value in connection.execute(
+        "SELECT series, window, total / count FROM sparklines WHERE ts > ? - span ORDER BY series, span, window, ts", (int(now),)
+    ):
+        charts.setdefault(series, {}).setdefault(window, []).append(value)
+    if windows is not None:
+        windows = list(windows)
+        charts = {series: {window: lines[window] for window in windows if window in lines} for series, lines in charts.items()}
+    return charts
+
+
+def query(
+    connection: sqlite3.Connection,
+    series: str,
+    start: float,
+    end: float,
+    resolution: typing.Optional[str] = None,
+) -> list[tuple[int, float, float, float]]:
+    """(timestamp, mean, min, max) of series between start and end, in time order.
+    resolution is None for the samples as recorded, or "hourly" or "daily" for their aggregates"""
+
+    if resolution is None:
+        sql = "SELECT ts, value, value, value FROM samples WHERE series = ? AND ts >= ? AND ts < ? ORDER BY ts"
+    else:
+        table, _ = _ROLLUPS[resolution]
+        sql = f"SELECT ts, total / count, low, high FROM {table} WHERE series = ? AND ts >= ? AND ts < ? ORDER BY ts"
+    return connection.execute(sql, (series, int(start), int(end))).fetchall()
@@ -2,11 +2,15 @@
 
 import dataclasses
 import logging
+import os
+import sys
 import typing
 
-import httpx
 import ordered_enum
 
+sys.path.append(os.path.dirname(__file__))
+import httpclient  # noqa: E402
+
 _DEFAULT_URL = "https://status.cloud.google.com/incidents.json"
 
 GCPServiceName = str
@@ -33,7 +37,7 @@ async def fetch_gcp_incidents(
 ) -> typing.Any:
     """Grabs the latest published incidents for GCP"""
 
-    async with httpx.AsyncClient() as client:
+    async with httpclient.async_client() as client:
         logging.debug("Fetching gcp incidents from: {}", url)
         response = await client.request(url=url, method="GET")
         logging.debug("Response from google was {}", response.text)
@@ -0,0 +1,298 @@
+"""Bounded per-key history of integer samples, optionally persisted to a memory mapped file"""
+
+import logging
+import mmap
+import os
+import struct
+import typing
+
+HistoryKey = typing.Union[str, int]
+
+_MAGIC = b"HFITHIST"
+_VERSION = 2
+_HEADER = struct.Struct("<8sIIIIqq")    # magic, version, width, key_size, reserved, capacity, cycle
+_HEADER_SIZE = 64
+_INITIAL_CAPACITY = 1024
+
+_KEY_FREE = 0
+_KEY_STR = 1
+_KEY_INT = 2
+
+# Record fields following the key, in units of 8 bytes
+_HEAD = 0       # position of the latest sample
+_COUNT = 1      # number of samples held, up to width
+_SUM = 2        # sum of the samples held
+_RETIRED = 3    # cycle the key was retired in, or -1
+_RUN = 4        # number of consecutive samples, up to the latest, with the same value
+_VALUES = 5
+
+
+class HistoryStore:
+    """Keeps the last `width` samples for every key in fixed width ring buffers.
+
+    Every key gets a fixed size record holding its key, ring buffer head, sample count, running
+    sum, retirement cycle and the ring buffer itself, indexed by a key -> slot map. Appending a
+    sample and computing a mean are both O(1).
+
+    Given a path, the records live in a memory mapped file behind a versioned header, so a
+    restart picks up where it left off rather than averaging over a single sample. Each append
+    only touches its own record in place. The file is reset if its version, width or key size
+    don't match, e.g. after max_history is changed.
+
+    Keys that drop out of a measurement are retired rather than forgotten, so a prefix or ASN that
+    flaps keeps its history. Retired keys that haven't come back within `evict_after` cycles are
+    evicted and their slots reused, so memory stays bounded no matter how long we run for.
+
+    A key is settled once its whole ring buffer holds the same value. Appending that value again
+    changes nothing, so callers that know which keys changed only need to append to those and to
+    the `unsettled` keys.
+    """
+
+    def __init__(self, width: int, evict_after: int, path: typing.Optional[str] = None, key_size: int = 48) -> None:
+        if key_size % 8:
+            raise ValueError("key_size must be a multiple of 8")
+
+        self.width = width
+        self.evict_after = evict_after
+        self.path = path
+        self.key_size = key_size
+        self.record_size = key_size + 8 * (_VALUES + width)
+        self._stride = self.record_size // 8
+        self.cycle = 0
+        self.capacity = 0
+
+        self._slots: dict[HistoryKey, int] = {}
+        self._keys: list[typing.Optional[HistoryKey]] = []    # slot -> key, None when free
+        self._free: list[int] = []
+        self._retired: dict[HistoryKey, int] = {}             # key -> cycle it was retired in
+        self.unsettled: set[HistoryKey] = set()                # present keys with differing samples
+
+        self._file: typing.Optional[typing.BinaryIO] = None
+        self._buf: typing.Union[bytearray, mmap.mmap]
+        self._q: memoryview
+        if path:
+            self._open(path)
+        else:
+            self._buf = bytearray(_HEADER_SIZE)
+            self._q = memoryview(self._buf).cast("q")
+            self._init_header()
+
+    def _init_header(self) -> None:
+        self.cycle = 0
+        self.capacity = 0
+        self._write_header()
+
+    def _write_header(self) -> None:
+        _HEADER.pack_into(
+            self._buf, 0, _MAGIC, _VERSION, self.width, self.key_size, 0, self.capacity, self.cycle
+        )
+
+    def _open(self, path: str) -> None:
+        self._file = open(path, "r+b" if os.path.exists(path) else "w+b")
+        size = os.fstat(self._file.fileno()).st_size
+
+        if size >= _HEADER_SIZE:
+            magic, version, width, key_size, _, capacity, cycle = _HEADER.unpack(self._file.read(_HEADER.size))
+            if (
+                (magic, version, width, key_size) == (_MAGIC, _VERSION, self.width, self.key_size)
+                and size == _HEADER_SIZE + capacity * self.record_size
+            ):
+                self._buf = mmap.mmap(self._file.fileno(), size)
+                self._q = memoryview(self._buf).cast("q")
+                self.capacity = capacity
+                self.cycle = cycle
+                self._load()
+                return
+            logging.warning("Discarding incompatible history file %s", path)
+
+        self._file.truncate(_HEADER_SIZE)
+        self._buf = mmap.mmap(self._file.fileno(), _HEADER_SIZE)
+        self._q = memoryview(self._buf).cast("q")
+        self._init_header()
+
+    def _load(self) -> None:
+        """Rebuilds the in-memory key index from the records on disk"""
+
+        # Keys are unpacked in C and every other field is read for all records at once with a strided
+        # slice, so the only per-record Python work is decoding the key and indexing it
+        record = struct.Struct(f"<BB{self.key_size - 2}s{8 * (_VALUES + self.width)}x")
+        with memoryview(self._buf)[_HEADER_SIZE:] as records:
+            keys: list[typing.Optional[HistoryKey]] = [
+                None if tag == _KEY_FREE else int(raw[:length]) if tag == _KEY_INT else raw[:length].decode()
+                for tag, length, raw in record.iter_unpack(records)
+            ]
+        self._keys = keys
+        self._slots = {key: slot for slot, key in enumerate(keys) if key is not None}
+
+        retired = self._column(_RETIRED)
+        runs = self._column(_RUN)
+        width = self.width
+        self._retired = {key: cycle for key, cycle in zip(keys, retired) if cycle >= 0 and key is not None}
+        self.unsettled = {key for key, run, cycle in zip(keys, runs, retired) if run < width and cycle < 0 and key is not None}
+        self._free = [slot for slot in reversed(range(self.capacity)) if keys[slot] is None]
+
+    def _column(self, field: int) -> list[int]:
+        """field of every slot's record, read in one go"""
+
+        start = self._base(0) + field
+        return self._q[start:start + self.capacity * self._stride:self._stride].tolist()
+
+    def _grow(self) -> None:
+        capacity = max(_INITIAL_CAPACITY, self.capacity * 2)
+        size = _HEADER_SIZE + capacity * self.record_size
+
+        self._q.release()
+        if isinstance(self._buf, mmap.mmap):
+            assert self._file is not None
+            self._buf.close()
+            self._file.truncate(size)
+            self._buf = mmap.mmap(self._file.fileno(), size)
+        else:
+            self._buf.extend(bytes(size - len(self._buf)))
+        self._q = memoryview(self._buf).cast("q")
+
+        self._keys.extend([None] * (capacity - self.capacity))
+        self._free = list(reversed(range(self.capacity, capacity))) + self._free
+        self.capacity = capacity
+        self._write_header()
+
+    def _base(self, slot: int) -> int:
+        """Index into self._q of the first field after slot's key"""
+
+        return (_HEADER_SIZE + slot * self.record_size + self.key_size) // 8
+
+    def _encode_key(self, key: HistoryKey) -> bytes:
+        raw = str(key).encode()
+        if len(raw) > self.key_size - 2:
+            raise ValueError(f"History key {key!r} is longer than {self.key_size - 2} bytes")
+        tag = _KEY_INT if isinstance(key, int) else _KEY_STR
+        return bytes((tag, len(raw))) + raw.ljust(self.key_size - 2, b"\0")
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, key: HistoryKey) -> bool:
+        return key in self._slots
+
+    def keys(self) -> typing.KeysView[HistoryKey]:
+        return self._slots.keys()
+
+    def _allocate(self, key: HistoryKey) -> int:
+        encoded = self._encode_key(key)
+        if not self._free:
+            self._grow()
+        slot = self._free.pop()
+
+        offset = _HEADER_SIZE + slot * self.record_size
+        self._buf[offset:offset + self.key_size] = encoded
+        base = self._base(slot)
+        self._q[base + _HEAD] = self.width - 1
+        self._q[base + _COUNT] = 0
+        self._q[base + _SUM] = 0
+        self._q[base + _RETIRED] = -1
+        self._q[base + _RUN] = 0
+
+        self._keys[slot] = key
+        self._slots[key] = slot
+        return slot
+
+    def append(self, key: HistoryKey, value: int) -> None:
+        """Records the latest sample for key, un-retiring it if it had dropped out"""
+
+        try:
+            slot = self._slots[key]
+        except KeyError:
+            slot = self._allocate(key)
+        q = self._q
+        base = self._base(slot)
+        if self._retired.pop(key, None) is not None:
+            q[base + _RETIRED] = -1
+
+        head = (q[base + _HEAD] + 1) % self.width
+        i = base + _VALUES + head
+        if q[base + _COUNT] and q[base + _VALUES + q[base + _HEAD]] == value:
+            q[base + _RUN] = min(q[base + _RUN] + 1, self.width)
+        else:
+            q[base + _RUN] = 1
+        if q[base + _COUNT] == self.width:
+            q[base + _SUM] -= q[i]
+        else:
+            q[base + _COUNT] += 1
+        q[i] = value
+        q[base + _SUM] += value
+        q[base + _HEAD] = head
+
+        if q[base + _RUN] < self.width:
+            self.unsettled.add(key)
+        else:
+            self.unsettled.discard(key)
+
+    def retire(self, key: HistoryKey) -> None:
+        """Marks key as no longer present. Its history is kept until it's evicted"""
+
+        if key in self._slots and key not in self._retired:
+            self._retired[key] = self.cycle
+            self.unsettled.discard(key)
+            self._q[self._base(self._slots[key]) + _RETIRED] = self.cycle
+
+    def retire_missing(self, present: typing.Container[HistoryKey]) -> None:
+        """Retires every key not in present"""
+
+        for key in self._slots:
+            if key not in present:
+                self.retire(key)
+
+    def end_cycle(self) -> int:
+        """Advances the cycle counter and evicts keys that have been retired for evict_after cycles,
+        then flushes to disk if persistent. Returns the number of keys evicted"""
+
+        self.cycle += 1
+        expired = [key for key, retired in self._retired.items() if self.cycle - retired >= self.evict_after]
+        for key in expired:
+            del self._retired[key]
+            slot = self._slots.pop(key)
+            self._keys[slot] = None
+            self._buf[_HEADER_SIZE + slot * self.record_size] = _KEY_FREE
+            self._free.append(slot)
+
+        self._write_header()
+        if isinstance(self._buf, mmap.mmap):
+            self._buf.flush()
+
+        return len(expired)
+
+    def close(self) -> None:
+        self._q.release()
+        if isinstance(self._buf, mmap.mmap):
+            self._buf.close()
+        if self._file:
+            self._file.close()
+
+    def latest(self, key: HistoryKey) -> int:
+        base = self._base(self._slots[key])
+        return self._q[base + _VALUES + self._q[base + _HEAD]]
+
+    def mean(self, key: HistoryKey) -> float:
+        base = self._base(self._slots[key])
+        return self._q[base + _SUM] / self._q[base + _COUNT]
+
+    def samples(self, key: HistoryKey) -> list[int]:
+        """All the samples held for key, latest first"""
+
+        base = self._base(self._slots[key])
+        head = self._q[base + _HEAD]
+        return [self._q[base + _VALUES + (head - i) % self.width] for i in range(self._q[base + _COUNT])]
+
+    def items(self) -> typing.Iterator[tuple[HistoryKey, int, float]]:
+        """Yields (key, latest sample, mean) for every key that's still present, as of the first one"""
+
+        # One strided slice per field rather than a handful of memoryview lookups per key
+        heads = self._column(_HEAD)
+        sums = self._column(_SUM)
+        counts = self._column(_COUNT)
+        values = [self._column(_VALUES + i) for i in range(self.width)]
+        retired = self._retired
+        for slot, key in enumerate(self._keys):
+            if key is None or key in retired:
+                continue
+            yield key, values[heads[slot]][slot], sums[slot] / counts[slot]
@@ -0,0 +1,183 @@
+"""On-disk conditional request cache for upstream sources
+
+Responses carrying an ETag or Last-Modified are kept gzipped on disk, keyed on URL, and
+revalidated with If-None-Match / If-Modified-Since on the next fetch. On a 304 the already
+parsed result is handed straight back, or re-read from disk after a restart."""
+
+import gzip
+import hashlib
+import os
+import sys
+import tempfile
+import typing
+sys.path.append(os.path.dirname(__file__))
+import config
+import httpclient
+import httpx
+import ujson
+
+# url -> (validator, parsed result) of the last response parsed this process
+_parsed: dict[str, tuple[tuple[typing.Optional[str], typing.Optional[str]], typing.Any]] = {}
+
+
+def _paths(url):
+    name = hashlib.sha256(url.encode()).hexdigest()
+    return os.path.join(config.http_cache_dir, name + ".json"), os.path.join(config.http_cache_dir, name + ".gz")
+
+
+def _load_meta(url):
+    if not config.http_cache_dir:
+        return None
+    meta_path, body_path = _paths(url)
+    try:
+        with open(meta_path, "r") as f:
+            meta = ujson.loads(f.read())
+    except (OSError, ValueError):
+        return None
+    if meta.get("url") != url or not os.path.exists(body_path):
+        return None
+    return meta
+
+
+def _validator(meta):
+    return meta.get("etag"), meta.get("last_modified")
+
+
+def conditional_headers(url):
+    """Returns the request headers for url, including validators for any cached copy.
+    Also returns the cached metadata, or None if there isn't a usable cached copy"""
+
+    headers = dict(config.headers)
+    meta = _load_meta(url)
+    if meta:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    return headers, meta
+
+
+def _new_meta(url, response_headers):
+    etag = response_headers.get("ETag")
+    last_modified = response_headers.get("Last-Modified")
+    if not config.http_cache_dir or not (etag or last_modified):
+        return None
+    return {"url": url, "etag": etag, "last_modified": last_modified}
+
+
+def _write_meta(url, meta):
+    meta_path, _ = _paths(url)
+    with tempfile.NamedTemporaryFile("w", dir=config.http_cache_dir, delete=False) as f:
+        f.write(ujson.dumps(meta))
+    os.replace(f.name, meta_path)
+
+
+def store(url, response_headers, body):
+    """Caches a successful response body, if it can be revalidated later"""
+
+    meta = _new_meta(url, response_headers)
+    if not meta:
+        return
+    _, body_path = _paths(url)
+    os.makedirs(config.http_cache_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile("wb", dir=config.http_cache_dir, delete=False) as f:
+        f.write(gzip.compress(body, compresslevel=6))
+    os.replace(f.name, body_path)
+    _write_meta(url, meta)
+
+
+def remember(url, response_headers, parsed):
+    """Keeps the parsed result of a cacheable response, to hand back on a 304"""
+
+    if meta := _new_meta(url, response_headers):
+        _parsed[url] = (_validator(meta), parsed)
+
+
+def recall(url, meta, parse):
+    """Returns the parsed result for a 304, re-parsing the cached body only if this process hasn't already"""
+
+    cached = _parsed.get(url)
+    if cached and cached[0] == _validator(meta):
+        return cached[1]
+
+    _, body_path = _paths(url)
+    with gzip.open(body_path, "rb") as f:
+        parsed = parse(f.read())
+    _parsed[url] = (_validator(meta), parsed)
+    return parsed
+
+
+def get_json(url, timeout=60):
+    """Fetches and parses JSON from url with a conditional request.
+    Raises httpx.HTTPError or ujson.JSONDecodeError on failure,
+    or breaker.SourceUnavailable without trying if the host has been failing"""
+
+    headers, meta = conditional_headers(url)
+    response = httpclient.get(url, headers=headers, timeout=timeout)
+    if response.status_code == 304 and meta:
+        if config.debug:
+            print(f"{url} not modified, using cached copy")
+        return recall(url, meta, ujson.loads)
+    response.raise_for_status()
+
+    parsed = ujson.loads(response.content)
+    store(url, response.headers, response.content)
+    remember(url, response.headers, parsed)
+    return parsed
+
+
+def stream_lines(url, timeout=60, chunk_size=1024 * 1024):
+    """Streams url line by line with a conditional request, teeing the lines into the cache as they arrive.
+    Returns (fresh, lines). fresh is False when the server said 304, in which case lines come from the cache.
+    Raises httpx.HTTPError on failure, including part way through the lines,
+    or breaker.SourceUnavailable without trying if the host has been failing"""
+
+    headers, meta = conditional_headers(url)
+    response = httpclient.stream(url, headers=headers, timeout=timeout)
+    if response.status_code == 304 and meta:
+        response.close()
+        if config.debug:
+            print(f"{url} not modified, using cached copy")
+        return False, _cached_lines(url)
+    try:
+        response.raise_for_status()
+    except httpx.HTTPError:
+        response.close()
+        raise
+
+    return True, _tee_lines(url, response, chunk_size)
+
+
+def _cached_lines(url):
+    _, body_path = _paths(url)
+    with gzip.open(body_path, "rb") as f:
+        for line in f:
+            yield line.rstrip(b"\n")
+
+
+def _tee_lines(url, response, chunk_size):
+    try:
+        meta = _new_meta(url, response.headers)
+        if not meta:
+            yield from httpclient.iter_lines(response, chunk_size)
+            return
+
+        _, body_path = _paths(url)
+        os.makedirs(config.http_cache_dir, exist_ok=True)
+        tmp = tempfile.NamedTemporaryFile("wb", dir=config.http_cache_dir, delete=False)
+        try:
+            with gzip.GzipFile(fileobj=tmp, mode="wb", compresslevel=1) as body:
+                for line in httpclient.iter_lines(response, chunk_size):
+                    body.write(line + b"\n")
+                    yield line
+            tmp.close()
+            os.replace(tmp.name, body_path)
+            _write_meta(url, meta)
+        finally:
+            # Only a complete body is worth keeping
+            if not tmp.closed:
+                tmp.close()
+            if os.path.exists(tmp.name):
+                os.unlink(tmp.name)
+    finally:
+        response.close()
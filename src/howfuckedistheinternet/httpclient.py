@@ -0,0 +1,208 @@
+"""Shared HTTP client for every upstream source
+
+One pooled, thread safe httpx.Client is shared by all the synchronous fetches, so connections to
+each host are kept alive between requests and checks, negotiating HTTP/2 where the server supports
+it and gzip or brotli compression. The async fetches, which need a client per event loop, get one
+from async_client() set up the same way. Either way, every request goes through the host's circuit
+breaker, retries failed connections, and adds to per-host request, connection and latency stats,
+which the checker records as http.<host>.<stat> samples."""
+
+import os
+import sys
+import threading
+import time
+import typing
+sys.path.append(os.path.dirname(__file__))
+import breaker
+import config
+import httpx
+
+
+class HostStats:
+    """Running totals for requests to one host"""
+
+    __slots__ = ("requests", "errors", "connections", "total_ms", "max_ms")
+
+    def __init__(self) -> None:
+        self.requests = 0       # requests that got a response
+        self.errors = 0         # requests that didn't
+        self.connections = 0    # new connections made, the rest were reused
+        self.total_ms = 0.0     # time to response headers, summed over requests
+        self.max_ms = 0.0
+
+    def as_dict(self) -> dict[str, typing.Union[int, float]]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "connections": self.connections,
+            "mean_ms": round(self.total_ms / self.requests, 1) if self.requests else 0.0,
+            "max_ms": round(self.max_ms, 1),
+        }
+
+
+_stats: dict[str, HostStats] = {}
+_stats_lock = threading.Lock()
+
+
+def _host_stats(host: str) -> HostStats:
+    with _stats_lock:
+        if host not in _stats:
+            _stats[host] = HostStats()
+        return _stats[host]
+
+
+def stats() -> dict[str, dict[str, typing.Union[int, float]]]:
+    """Request, connection and latency stats for every host requested so far"""
+
+    with _stats_lock:
+        return {host: s.as_dict() for host, s in _stats.items()}
+
+
+def _count_connections(inner: typing.Optional[typing.Callable[..., None]], stats: HostStats) -> typing.Callable[..., None]:
+    def trace(event: str, info: dict[str, typing.Any]) -> None:
+        if event == "connection.connect_tcp.complete":
+            with _stats_lock:
+                stats.connections += 1
+        if inner:
+            inner(event, info)
+
+    return trace
+
+
+def _count_connections_async(
+    inner: typing.Optional[typing.Callable[..., typing.Awaitable[None]]], stats: HostStats
+) -> typing.Callable[..., typing.Awaitable[None]]:
+    async def trace(event: str, info: dict[str, typing.Any]) -> None:
+        if event == "connection.connect_tcp.complete":
+            with _stats_lock:
+                stats.connections += 1
+        if inner:
+            await inner(event, info)
+
+    return trace
+
+
+class _Tracked:
+    """Breaker check, connection counting and stats for one request, shared by both transports:
+
+        with _Tracked(request, _count_connections) as tracked:
+            tracked.response = send(request)
+
+    Raises breaker.SourceUnavailable without sending it if the host has been failing"""
+
+    def __init__(self, request: httpx.Request, count_connections: typing.Callable[..., typing.Any]) -> None:
+        self.request = request
+        self.response: typing.Optional[httpx.Response] = None
+        breaker.check(str(request.url))
+        self.stats = _host_stats(request.url.netloc.decode())
+        request.extensions = {**request.extensions, "trace": count_connections(request.extensions.get("trace"), self.stats)}
+
+    def __enter__(self) -> "_Tracked":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: typing.Any) -> None:
+        # Without a response it failed, including being cancelled, e.g. by a deadline, so a half-open trial
+        # isn't left in flight forever
+        url = str(self.request.url)
+        response = self.response
+        with _stats_lock:
+            if response is None:
+                self.stats.errors += 1
+            else:
+                elapsed = (time.perf_counter() - self.started) * 1000
+                self.stats.requests += 1
+                self.stats.total_ms += elapsed
+                self.stats.max_ms = max(self.stats.max_ms, elapsed)
+        if response is None:
+            breaker.record(url)
+        else:
+            breaker.record(url, response.status_code, response.headers.get("Retry-After"))
+
+
+class _Transport(httpx.HTTPTransport):
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        with _Tracked(request, _count_connections) as tracked:
+            tracked.response = super().handle_request(request)
+        return tracked.response
+
+
+class _AsyncTransport(httpx.AsyncHTTPTransport):
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        with _Tracked(request, _count_connections_async) as tracked:
+            tracked.response = await super().handle_async_request(request)
+        return tracked.response
+
+
+def _timeout(timeout: typing.Optional[float], connect: typing.Optional[float]) -> httpx.Timeout:
+    """Timeouts from config, unless the request asked for its own"""
+
+    return httpx.Timeout(
+        config.http_timeout if timeout is None else timeout,
+        connect=config.http_connect_timeout if connect is None else connect,
+    )
+
+
+def _limits(max_connections: typing.Optional[int]) -> httpx.Limits:
+    return httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+
+
+_client: typing.Optional[httpx.Client] = None
+_client_lock = threading.Lock()
+
+
+def client() -> httpx.Client:
+    """The shared synchronous client"""
+
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = httpx.Client(
+                http2=True,
+                headers=config.headers,
+                timeout=_timeout(None, None),
+                transport=_Transport(http2=True, retries=config.http_retries, limits=_limits(config.http_max_connections)),
+            )
+        return _client
+
+
+def async_client(
+    max_connections: typing.Optional[int] = None,
+    timeout: typing.Optional[float] = None,
+    connect_timeout: typing.Optional[float] = None,
+) -> httpx.AsyncClient:
+    """A new async client for the current event loop, to be used as an async context manager"""
+
+    max_connections = max_connections or config.http_max_connections
+    return httpx.AsyncClient(
+        http2=True,
+        headers=config.headers,
+        timeout=_timeout(timeout, connect_timeout),
+        transport=_AsyncTransport(http2=True, retries=config.http_retries, limits=_limits(max_connections)),
+    )
+
+
+def get(url: str, headers: typing.Optional[dict[str, str]] = None, timeout: typing.Optional[float] = None) -> httpx.Response:
+    """GETs url with the shared client.
+    Raises httpx.HTTPError on failure, or breaker.SourceUnavailable without trying if the host has been failing"""
+
+    return client().get(url, headers=headers, timeout=_timeout(timeout, None))
+
+
+def stream(url: str, headers: typing.Optional[dict[str, str]] = None, timeout: typing.Optional[float] = None) -> httpx.Response:
+    """GETs url with the shared client without reading the body, which the caller must then read or close"""
+
+    request = client().build_request("GET", url, headers=headers, timeout=_timeout(timeout, None))
+    return client().send(request, stream=True)
+
+
+def iter_lines(response: httpx.Response, chunk_size: int = 1024 * 1024) -> typing.Iterator[bytes]:
+    """Splits a streamed response body into lines, as bytes without the newline"""
+
+    pending = b""
+    for chunk in response.iter_bytes(chunk_size):
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        yield from lines
+    if pending:
+        yield pending
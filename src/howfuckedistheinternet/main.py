@@ -1,38 +1,53 @@
 #!/usr/bin/env python3
 import services
 import config
+import db
+import history
+import httpclient
+import render
+import resultcache
+import scheduler
+import os
 import sqlite3
 import time
+from contextlib import closing
 from datetime import datetime, timezone
 
 
 def main():
 
-    # Initialise dicts for the metrics we want to keep history of
-    num_dfz_routes_history = {"v6": [], "v4": []}
-    num_origins_history = {}
-    num_prefixes_history = {}
-    rpki_invalid_roa_history = {}
-    rpki_total_roa_history = {}
+    # Initialise history stores for the metrics we want to keep history of
+    if config.history_dir:
+        os.makedirs(config.history_dir, exist_ok=True)
+
+    def history_store(name, key_size=48):
+        path = os.path.join(config.history_dir, f"{name}.hist") if config.history_dir else None
+        return history.HistoryStore(config.max_history, config.history_evict_after, path, key_size)
+
+    num_dfz_routes_history = history_store("dfz")
+    num_origins_history = history_store("origins")
+    num_prefixes_history = history_store("prefixes")
+    # RPKI repos are keyed on their URI
+    rpki_invalid_roa_history = history_store("rpki_invalid_roa", key_size=256)
+    rpki_total_roa_history = history_store("rpki_total_roa", key_size=256)
+    aws_latency_history = history_store("aws_latency")
+    previous_bgp_table = None
+
+    # Last good result of each job's fetch, to fall back on while its source is failing
+    results = resultcache.ResultCache(config.stale_max_age)
+
+    # Samples recorded by the jobs, written to the db with the next status
+    samples = db.Samples()
+    sparklines = db.Sparklines(config.sparkline_series, config.sparkline_windows)
 
     if config.write_sql_enabled:
         try:
-            connection = sqlite3.connect(config.html_root + config.sqlitedb)
-            cursor = connection.cursor()
+            connection = db.connect(config.html_root + config.sqlitedb)
         except sqlite3.OperationalError:
             print(f"Error: Can't open sqlite db file")
             exit(1)
 
-        # Create and populate the metrics table
-        try:
-            cursor.execute(
-                """CREATE TABLE metrics (metric TEXT PRIMARY KEY, description TEXT,
-                              weight REAL, frequency INTEGER, last TEXT)"""
-            )
-        except sqlite3.OperationalError:
-            cursor.execute("DELETE FROM metrics")
-            connection.commit()
-
+        # Populate the metrics table
         metrics_list = []
         for metric, attrs in config.metrics.items():
             metrics_list.append(
@@ -45,169 +60,219 @@ def main():
                 )
             )
         try:
-            cursor.executemany(
-                "INSERT INTO metrics VALUES (?, ?, ?, ?, ?)", metrics_list
-            )
-            connection.commit()
-        except sqlite3.InterfaceError:
-            print(f"Failed to insert into status table: {metrics_list}")
+            db.init_metrics(connection, metrics_list)
+        except sqlite3.Error as e:
+            print(f"Failed to insert into metrics table: {e}: {metrics_list}")
 
+    # Static status page, so the web server doesn't have to run the CGI for every view
+    renderer = None
+    if config.render_enabled:
         try:
-            cursor.execute(
-                "CREATE TABLE status (status TEXT, timestamp TEXT, duration TEXT)"
-            )
-        except sqlite3.OperationalError:
-            pass
-        try:
-            cursor.execute(
-                """CREATE TABLE reasons (reason TEXT, metric TEXT, weight REAL,
-                              FOREIGN KEY(metric) REFERENCES metrics(metric))"""
-            )
-        except sqlite3.OperationalError:
-            pass
+            renderer = render.Renderer(config.html_root, config.index_template, config.index_html, config.index_json)
+        except Exception as e:
+            print(f"Error: Can't load the status page template, leaving it to the CGI: {e}")
+
+    def bgp_job():
+        bgp_table = results.fetch("bgp", services.fetch_bgp_table, previous_bgp_table, good=len)
+        if results.age("bgp") is not None:
+            # Nothing new to diff
+            bgp_table.diff = services.BGPDiff()
+
+        # A stale table has already been added to the histories, so isn't checked again
+        return dict(results.check("bgp", check_bgp, bgp_table))
 
-    while True:
-        # Reset reasons and duration timer
+    def check_bgp(bgp_table):
+        nonlocal previous_bgp_table
         fucked_reasons = {}
-        for metric in config.metrics:
-            fucked_reasons[metric] = []
 
-        before = datetime.now()
-
-        if (
-            config.metrics["origins"].get("enabled")
-            or config.metrics["bogonASNs"].get("enabled")
-            or config.metrics["prefixes"].get("enabled")
-            or config.metrics["dfz"].get("enabled")
-        ):
-            table_asn_key, table_pfx_key = services.fetch_bgp_table()
-            if config.metrics["origins"].get("enabled"):
-                fucked_reasons["origins"], num_origins_history = services.check_bgp_origins(
-                    table_pfx_key, num_origins_history
-                )
-            if config.metrics["bogonASNs"].get("enabled"):
-                fucked_reasons["bogonASNs"] = services.check_bogon_asns(table_pfx_key)
-            if config.metrics["prefixes"].get("enabled"):
-                fucked_reasons["prefixes"], num_prefixes_history = services.check_bgp_prefixes(
-                    table_asn_key, num_prefixes_history
-                )
-            if config.metrics["dfz"].get("enabled"):
-                fucked_reasons["dfz"], num_dfz_routes_history = services.check_dfz(
-                    table_pfx_key, num_dfz_routes_history
-                )
-            del table_asn_key, table_pfx_key
+        if config.metrics["origins"].get("enabled"):
+            fucked_reasons["origins"], _ = services.check_bgp_origins(bgp_table, num_origins_history)
+        if config.metrics["bogonASNs"].get("enabled"):
+            fucked_reasons["bogonASNs"] = services.check_bogon_asns(bgp_table)
+        if config.metrics["prefixes"].get("enabled"):
+            fucked_reasons["prefixes"], _ = services.check_bgp_prefixes(bgp_table, num_prefixes_history)
+        if config.metrics["dfz"].get("enabled"):
+            fucked_reasons["dfz"], _ = services.check_dfz(bgp_table, num_dfz_routes_history)
+        samples.add("dfz.v6", bgp_table.v6_dfz_count)
+        samples.add("dfz.v4", bgp_table.v4_dfz_count)
+        # Keep this table around to diff the next one against
+        previous_bgp_table = bgp_table
+
+        return fucked_reasons
+
+    def rpki_job():
+        invalid_roa, total_roa = results.fetch("rpki", services.fetch_rpki_roa, good=lambda result: any(result))
+        # Stale ROA counts have already been added to the histories, so aren't checked again
+        return dict(results.check("rpki", check_rpki, invalid_roa, total_roa))
+
+    def check_rpki(invalid_roa, total_roa):
+        fucked_reasons = {}
 
-        if config.metrics["invalid_roa"].get("enabled") or config.metrics["total_roa"].get("enabled"):
-            invalid_roa, total_roa = services.fetch_rpki_roa()
-            if config.metrics["invalid_roa"].get("enabled"):
-                (
-                    fucked_reasons["invalid_roa"],
-                    rpki_invalid_roa_history,
-                ) = services.check_rpki_invalids(invalid_roa, rpki_invalid_roa_history)
-            if config.metrics["total_roa"].get("enabled"):
-                fucked_reasons["total_roa"], rpki_total_roa_history = services.check_rpki_totals(
-                    total_roa, rpki_total_roa_history
-                )
-            del invalid_roa, total_roa
+        if config.metrics["invalid_roa"].get("enabled"):
+            fucked_reasons["invalid_roa"], _ = services.check_rpki_invalids(invalid_roa, rpki_invalid_roa_history)
+        if config.metrics["total_roa"].get("enabled"):
+            fucked_reasons["total_roa"], _ = services.check_rpki_totals(total_roa, rpki_total_roa_history)
+        if total_roa:
+            samples.add("roa.total", sum(total_roa.values()))
+            samples.add("roa.invalid", sum(invalid_roa.values()))
+
+        return fucked_reasons
+
+    def atlas_job():
+        fucked_reasons = {}
+
+        # Fetch every RIPE Atlas measurement the enabled metrics need at once
+        atlas_measurements = results.fetch(
+            "atlas",
+            services.fetch_atlas_measurements,
+            services.atlas_measurement_ids(),
+            good=lambda result: any(msm is not None for msm in result.values()),
+        )
 
         if config.metrics["ntp"].get("enabled"):
-            ntp_pool_status = services.fetch_ntp_pool_status()
+            ntp_pool_status = services.fetch_ntp_pool_status(atlas_measurements)
             if ntp_pool_status:
                 fucked_reasons["ntp"] = services.check_ntp(ntp_pool_status)
 
         if config.metrics["dns_root"].get("enabled"):
-            v6_roots_failed, v4_roots_failed = services.fetch_root_dns()
+            v6_roots_failed, v4_roots_failed = services.fetch_root_dns(atlas_measurements)
             if v6_roots_failed or v4_roots_failed:
                 fucked_reasons["dns_root"] = services.check_dns_roots(
                     v6_roots_failed, v4_roots_failed
                 )
-            del v6_roots_failed, v4_roots_failed
 
         if config.metrics["atlas_connected"].get("enabled"):
-            probe_status = services.fetch_ripe_atlas_status()
+            probe_status = services.fetch_ripe_atlas_status(atlas_measurements)
             if probe_status:
                 fucked_reasons["atlas_connected"] = services.check_ripe_atlas_status(probe_status)
-            del probe_status
 
         if config.metrics["public_dns"].get("enabled"):
-            public_dns_status = services.fetch_public_dns_status()
+            public_dns_status = services.fetch_public_dns_status(atlas_measurements)
             if public_dns_status:
                 fucked_reasons["public_dns"] = services.check_public_dns(public_dns_status)
 
-        if config.metrics["aws"].get("enabled"):
-            aws_v6_results = services.fetch_aws(config.aws_v6_file)
-            if aws_v6_results:
-                fucked_reasons["aws"] = services.check_aws(aws_v6_results, 6)
-            aws_v4_results = services.fetch_aws(config.aws_v4_file)
-            if aws_v4_results:
-                fucked_reasons["aws"] = services.check_aws(aws_v4_results, 4)
-
-        if config.metrics["gcp"].get("enabled"):
-            gcp_results = services.fetch_gcp()
-            if gcp_results:
-                fucked_reasons["gcp"] = services.check_gcp(gcp_results)
-
         if config.metrics["tls"].get("enabled"):
-            v6_https, v4_https = services.fetch_tls_certs()
+            v6_https, v4_https = services.fetch_tls_certs(atlas_measurements)
             if v6_https:
                 fucked_reasons["tls"] = services.check_tls_certs(v6_https, 6)
             if v4_https:
                 fucked_reasons["tls"] = services.check_tls_certs(v4_https, 4)
 
-        if config.metrics["cloudflare"].get("enabled"):
-            cloudflare_incs = services.fetch_cloudflare()
-            if cloudflare_incs:
-                fucked_reasons["cloudflare"] = services.check_cloudflare(cloudflare_incs)
-
-        if config.metrics["slack"].get("enabled"):
-            slack_incs = services.fetch_slack()
-            if slack_incs:
-                fucked_reasons["slack"] = services.check_slack(slack_incs)
-
-        if config.metrics["discord"].get("enabled"):
-            discord_incs = services.fetch_discord()
-            if discord_incs:
-                fucked_reasons["discord"] = services.check_discord(discord_incs)
-
-        weighted_reasons = 0
-        for metric, reasons in fucked_reasons.items():
-            try:
-                weighted_reasons = weighted_reasons + (
-                    len(reasons) * config.metrics[metric]["adjusted_weight"]
-                )
-            except KeyError:
-                weighted_reasons = weighted_reasons + (
-                    len(reasons) * config.metrics[metric].get("weight")
-                )
-        unweighted_reasons = sum(map(lambda x: len(x), fucked_reasons.values()))
-
-        if weighted_reasons > 200:
-            status = "The Internet is totally, utterly, and completely fucked"
-        elif weighted_reasons > 100:
-            status = "The Internet is completely fucked"
-        elif weighted_reasons > 60:
-            status = "The Internet is utterly fucked"
-        elif weighted_reasons > 50:
-            status = "The Internet is totally fucked"
-        elif weighted_reasons > 40:
-            status = "The Internet is really fucked"
-        elif weighted_reasons > 30:
-            status = "The Internet is rather fucked"
-        elif weighted_reasons > 20:
-            status = "The Internet is quite fucked"
-        elif weighted_reasons > 15:
-            status = "The Internet is pretty fucked"
-        elif weighted_reasons > 10:
-            status = "The Internet is merely somewhat fucked"
-        elif weighted_reasons > 5:
-            status = "The Internet is only partially fucked"
-        elif weighted_reasons > 0:
-            status = "The Internet is just a little bit fucked"
-        else:
-            status = "The Internet is fucked no more than usual"
-
-        after = datetime.now()
-        duration = after - before
+        return fucked_reasons
+
+    def aws_job():
+        fucked_reasons = {}
+
+        aws_v6_results, aws_v6_stats = services.fetch_aws(config.aws_v6_file)
+        aws_v4_results, aws_v4_stats = services.fetch_aws(config.aws_v4_file)
+        if config.metrics["aws"].get("enabled"):
+            fucked_reasons["aws"] = []
+            if aws_v6_results:
+                fucked_reasons["aws"] += services.check_aws(aws_v6_results, 6, aws_v6_stats)
+            if aws_v4_results:
+                fucked_reasons["aws"] += services.check_aws(aws_v4_results, 4, aws_v4_stats)
+        for af, aws_results in (("v6", aws_v6_results), ("v4", aws_v4_results)):
+            checks = [result for region_results in aws_results.values() for result in region_results]
+            if checks:
+                samples.add(f"aws.{af}.failed_pct", round(checks.count(False) / len(checks) * 100, 1))
+        if config.metrics["aws_latency"].get("enabled"):
+            fucked_reasons["aws_latency"], _ = services.check_aws_latency(
+                aws_v6_stats, aws_v4_stats, aws_latency_history
+            )
+
+        return fucked_reasons
+
+    def rollup_job():
+        # Runs on a worker thread, so gets its own connection
+        with closing(db.connect(config.html_root + config.sqlitedb)) as rollup_connection:
+            db.roll_up(
+                rollup_connection,
+                time.time(),
+                config.samples_raw_retention,
+                config.samples_hourly_retention,
+                config.samples_daily_retention,
+            )
+        # Running totals of requests, connections and latency to each upstream host, for the API's /history
+        for host, host_stats in httpclient.stats().items():
+            for stat, value in host_stats.items():
+                samples.add(f"http.{host}.{stat}", value)
+        return {}
+
+    def gcp_job():
+        gcp_results = results.fetch("gcp", services.fetch_gcp)
+        if gcp_results:
+            return {"gcp": services.check_gcp(gcp_results)}
+        return {}
+
+    def cloudflare_job():
+        cloudflare_incs = results.fetch("cloudflare", services.fetch_cloudflare)
+        if cloudflare_incs:
+            return {"cloudflare": services.check_cloudflare(cloudflare_incs)}
+        return {}
+
+    def slack_job():
+        slack_incs = results.fetch("slack", services.fetch_slack)
+        if slack_incs:
+            return {"slack": services.check_slack(slack_incs)}
+        return {}
+
+    def discord_job():
+        discord_incs = results.fetch("discord", services.fetch_discord)
+        if discord_incs:
+            return {"discord": services.check_discord(discord_incs)}
+        return {}
+
+    # Each job runs as often as the most frequent of its enabled metrics
+    schedule = scheduler.Scheduler()
+    for name, metrics, run in (
+        ("bgp", ("origins", "bogonASNs", "prefixes", "dfz"), bgp_job),
+        ("rpki", ("invalid_roa", "total_roa"), rpki_job),
+        ("atlas", ("ntp", "dns_root", "atlas_connected", "public_dns", "tls"), atlas_job),
+        ("aws", ("aws", "aws_latency"), aws_job),
+        ("gcp", ("gcp",), gcp_job),
+        ("cloudflare", ("cloudflare",), cloudflare_job),
+        ("slack", ("slack",), slack_job),
+        ("discord", ("discord",), discord_job),
+    ):
+        enabled = [metric for metric in metrics if config.metrics[metric].get("enabled")]
+        if enabled:
+            freq = min(config.metrics[metric].get("freq") for metric in enabled)
+            timeout = config.job_timeouts.get(name, config.job_timeout)
+            schedule.add(scheduler.Job(name, enabled, reset_weights(enabled, run), freq, timeout))
+    if config.write_sql_enabled:
+        schedule.add(scheduler.Job("rollup", (), rollup_job, config.rollup_freq))
+
+    # Latest reasons and outcome for every metric, kept between jobs so the status always covers all of them
+    fucked_reasons = {}
+    outcomes = {}
+    for metric in config.metrics:
+        fucked_reasons[metric] = []
+        outcomes[metric] = None
+
+    def on_complete(job, outcome, reasons, duration):
+        if not job.metrics:
+            # Housekeeping, nothing to publish
+            if config.debug:
+                print(f"{job.name} {outcome}")
+            return
+
+        # Flag results that were served from before the source started failing, and try it again sooner
+        if outcome == scheduler.OK and (age := results.age(job.name)) is not None:
+            outcome = "stale"
+            reasons = {
+                metric: [f"{reason} (stale, from {round(age / 60)} mins ago)" for reason in metric_reasons]
+                for metric, metric_reasons in reasons.items()
+            }
+            schedule.retry(job, config.stale_retry)
+
+        for metric in job.metrics:
+            fucked_reasons[metric] = []
+            outcomes[metric] = outcome
+        fucked_reasons.update(reasons)
+
+        # Recompute the status from the latest results of every metric
+        status, weighted_reasons, unweighted_reasons = score(fucked_reasons)
+
         timestamp = (
             datetime.now(timezone.utc)
             .isoformat(timespec="seconds", sep=" ")
@@ -215,55 +280,160 @@ def main():
         )
 
         if config.debug:
+            print(f"{job.name} checks {outcome}")
             print(status)
-            print(f"It took {duration.seconds} seconds to check for fuckedness")
+            print(f"It took {int(duration)} seconds to check for fuckedness")
             print(f"Weighted: {weighted_reasons} - Unweighted: {unweighted_reasons}")
 
+        # Score, and the reasons for each metric the job checked, over time
+        samples.add("score.weighted", weighted_reasons)
+        samples.add("score.unweighted", unweighted_reasons)
+        for metric in job.metrics:
+            samples.add(f"reasons.{metric}", len(fucked_reasons[metric]))
+            samples.add(f"weighted.{metric}", len(fucked_reasons[metric]) * weight(metric))
+        recorded = samples.drain()
+
+        # When the next job is due to finish, and the status might change again
+        next_check = int(time.time() + max(0, schedule.next_due() - schedule.clock()))
+
         if config.write_sql_enabled:
-            status_tuple = (status, timestamp, str(duration.seconds))
-            try:
-                cursor.execute("DELETE FROM status")
-                connection.commit()
-                cursor.execute("INSERT INTO status VALUES (?, ?, ?)", status_tuple)
-                connection.commit()
-            except sqlite3.InterfaceError:
-                print(f"Failed to insert into status table: {status_tuple}")
-
-            reasons_list = []
-
-            for metric, reasons in fucked_reasons.items():
-                if reasons:
-                    for reason in sorted(reasons):
-                        try:
-                            adjusted_weight = config.metrics[metric]["adjusted_weight"]
-                        except KeyError:
-                            adjusted_weight = config.metrics[metric].get("weight")
-
-                        reasons_list.append(
-                            (reason, metric, adjusted_weight)
-                        )
-
-                # Reset any previously adjusted weightings
-                try:
-                    del config.metrics[metric]["adjusted_weight"]
-                except KeyError:
-                    pass
-
-            try:
-                cursor.execute("DELETE FROM reasons")
-                connection.commit()
-                if reasons_list:
-                    cursor.executemany(
-                        "INSERT INTO reasons VALUES (?, ?, ?)", reasons_list
-                    )
-                    connection.commit()
-            except sqlite3.InterfaceError:
-                print(f"Failed to insert into reasons table: {reasons_list}")
-
-        if duration.seconds < config.update_frequency:
-            time.sleep(config.update_frequency - duration.seconds)
-        else:
-            pass  # We've taken long enough
+            publish(
+                connection, status, timestamp, int(duration), next_check, weighted_reasons,
+                fucked_reasons, outcomes, recorded, sparklines
+            )
+        if renderer:
+            charts = read_sparklines(connection) if config.write_sql_enabled else None
+            render_page(
+                renderer, status, timestamp, int(duration), next_check, weighted_reasons, fucked_reasons, outcomes, charts
+            )
+
+    runner = scheduler.Runner(schedule, config.job_workers, on_complete)
+    try:
+        while runner.step():
+            pass
+        print("Error: No checks are enabled")
+    finally:
+        runner.shutdown()
+        services.shutdown_tls_pool()
+
+
+def reset_weights(metrics, run):
+    """Wraps a job to reset any previously adjusted weightings for its metrics before it checks them again"""
+
+    def reset_and_run():
+        for metric in metrics:
+            config.metrics[metric].pop("adjusted_weight", None)
+        return run()
+
+    return reset_and_run
+
+
+def weight(metric):
+    """The weighting of each of a metric's reasons, as adjusted by its latest check"""
+
+    try:
+        return config.metrics[metric]["adjusted_weight"]
+    except KeyError:
+        return config.metrics[metric].get("weight")
+
+
+def score(fucked_reasons):
+    """Works out the status from the weighted number of reasons across all metrics"""
+
+    weighted_reasons = 0
+    for metric, reasons in fucked_reasons.items():
+        weighted_reasons = weighted_reasons + len(reasons) * weight(metric)
+    unweighted_reasons = sum(map(lambda x: len(x), fucked_reasons.values()))
+
+    if weighted_reasons > 200:
+        status = "The Internet is totally, utterly, and completely fucked"
+    elif weighted_reasons > 100:
+        status = "The Internet is completely fucked"
+    elif weighted_reasons > 60:
+        status = "The Internet is utterly fucked"
+    elif weighted_reasons > 50:
+        status = "The Internet is totally fucked"
+    elif weighted_reasons > 40:
+        status = "The Internet is really fucked"
+    elif weighted_reasons > 30:
+        status = "The Internet is rather fucked"
+    elif weighted_reasons > 20:
+        status = "The Internet is quite fucked"
+    elif weighted_reasons > 15:
+        status = "The Internet is pretty fucked"
+    elif weighted_reasons > 10:
+        status = "The Internet is merely somewhat fucked"
+    elif weighted_reasons > 5:
+        status = "The Internet is only partially fucked"
+    elif weighted_reasons > 0:
+        status = "The Internet is just a little bit fucked"
+    else:
+        status = "The Internet is fucked no more than usual"
+
+    return status, weighted_reasons, unweighted_reasons
+
+
+def weighted_reasons_list(fucked_reasons):
+    """(reason, metric, weight) for every reason"""
+
+    reasons_list = []
+    for metric, reasons in fucked_reasons.items():
+        if reasons:
+            for reason in sorted(reasons):
+                reasons_list.append(
+                    (reason, metric, weight(metric))
+                )
+    return reasons_list
+
+
+def publish(
+    connection, status, timestamp, duration, next_check, weighted_score, fucked_reasons, outcomes, samples=(), sparklines=None
+):
+    """Writes the status, reasons, metric outcomes and recorded samples to the database in one go"""
+
+    status_tuple = (status, timestamp, str(duration), next_check, weighted_score)
+    reasons_list = weighted_reasons_list(fucked_reasons)
+
+    # Outcome of the latest run of each metric
+    outcomes_list = [(outcome, metric) for metric, outcome in outcomes.items()]
+
+    try:
+        db.publish(connection, status_tuple, reasons_list, outcomes_list, samples, sparklines)
+    except sqlite3.Error as e:
+        print(f"Failed to publish {status_tuple} with {len(reasons_list)} reasons: {e}")
+
+
+def read_sparklines(connection):
+    """The sparklines for the status page, or None if they can't be read"""
+
+    try:
+        return db.sparklines(connection, time.time(), config.sparkline_windows)
+    except sqlite3.Error as e:
+        print(f"Failed to read sparklines: {e}")
+        return None
+
+
+def render_page(renderer, status, timestamp, duration, next_check, weighted_score, fucked_reasons, outcomes, sparklines=None):
+    """Renders the static status page from the same status, reasons and outcomes as were published"""
+
+    metrics_list = [
+        {
+            "metric": metric,
+            "description": attrs.get("descr"),
+            "weight": attrs.get("weight"),
+            "frequency": attrs.get("freq"),
+            "last": outcomes.get(metric),
+        }
+        for metric, attrs in config.metrics.items()
+    ]
+
+    try:
+        renderer.render(
+            status, timestamp, str(duration), weighted_reasons_list(fucked_reasons), metrics_list, next_check, weighted_score,
+            sparklines,
+        )
+    except Exception as e:
+        print(f"Failed to render the status page: {e}")
 
 
 if __name__ == "__main__":
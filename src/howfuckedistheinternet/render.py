@@ -0,0 +1,79 @@
+"""Static status page, rendered by the checker whenever the status changes
+
+Rendering index.html (and index.json, the same document as the API's /status) once per publish
+means the web server only has to serve static files, however many people are looking. Each file is
+written to a temporary file alongside it and renamed into place, so nobody ever gets a half written page."""
+
+import os
+import sys
+import tempfile
+import typing
+sys.path.append(os.path.dirname(__file__))
+import api
+import ujson
+from jinja2 import Environment, FileSystemLoader
+
+Reason = tuple[str, str, float]     # (reason, metric, weight)
+
+
+def write_atomic(path: str, data: typing.Union[str, bytes]) -> None:
+    """Replaces the file at path with data in one go, so readers see either the old file or the new one"""
+
+    if isinstance(data, str):
+        data = data.encode()
+
+    directory, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{name}.", dir=directory or ".")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp files are only readable by us, but the web server needs to read it too
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+class Renderer:
+    """Renders the status page template from `root` to index.html and index.json in `root`"""
+
+    def __init__(self, root: str, template: str = "index.j2", html: str = "index.html", json: str = "index.json") -> None:
+        self.html_path = os.path.join(root, html)
+        self.json_path = os.path.join(root, json)
+        self.template = Environment(loader=FileSystemLoader(root)).get_template(template)
+
+    def render(
+        self,
+        status: str,
+        timestamp: str,
+        duration: str,
+        reasons: list[Reason],
+        metrics: list[dict[str, typing.Any]],
+        next_check: typing.Optional[int] = None,
+        score: typing.Optional[float] = None,
+        sparklines: typing.Optional[dict[str, dict[str, list[float]]]] = None,
+    ) -> None:
+        """Writes the page and its JSON twin, with the heaviest weighted reasons and metrics first,
+        as the CGI does. Raises OSError or a jinja2 error on failure, leaving the previous files in place"""
+
+        reasons = sorted(reasons, key=lambda reason: reason[2], reverse=True)
+        metrics = sorted(metrics, key=lambda metric: metric["weight"], reverse=True)
+
+        html = self.template.render(
+            timestamp=timestamp,
+            duration=duration,
+            status=status,
+            reasons=reasons,
+            metrics=metrics,
+            sparklines=sparklines,
+        )
+        document = api.status_document(status, timestamp, duration, next_check, score, reasons, metrics)
+
+        write_atomic(self.json_path, ujson.dumps(document))
+        write_atomic(self.html_path, html)
@@ -0,0 +1,103 @@
+"""Last good result of each source, to fall back on while it's failing"""
+
+import os
+import sys
+import threading
+import time
+import typing
+sys.path.append(os.path.dirname(__file__))
+import breaker
+import config
+
+
+class FetchFailed(Exception):
+    """Raised when a fetch fails and there's no good result recent enough to serve instead"""
+
+    # Reported as the outcome of the job that needed it, as a failed fetch isn't a clean bill of health
+    outcome = "failed"
+
+    def __init__(self, name: str) -> None:
+        super().__init__(f"{name} fetch failed, with no recent results to fall back on")
+        self.name = name
+
+
+class ResultCache:
+    """Keeps the last good result of each fetch, with when it was fetched.
+
+    When a fetch fails, or its source is unavailable, the last good result is served instead for up to
+    `max_age` seconds, so a blip upstream doesn't make a metric drop out of the status. `age(name)` says
+    whether the latest fetch was served stale, and how stale, so the caller can flag it and retry sooner.
+
+    Checks that add each result to a history shouldn't see a stale result again, or every retry would add
+    another copy of it. Running them through `check(name, ...)` gives back what they found when the result
+    was fresh instead.
+    """
+
+    def __init__(self, max_age: float, clock: typing.Callable[[], float] = time.time) -> None:
+        self.max_age = max_age
+        self.clock = clock
+        self._results: dict[str, tuple[float, typing.Any]] = {}    # name -> (fetched at, result)
+        self._ages: dict[str, typing.Optional[float]] = {}          # name -> age of the latest result served
+        self._checked: dict[str, typing.Any] = {}                   # name -> what check() returned for it when fresh
+        self._lock = threading.Lock()
+
+    def fetch(
+        self,
+        name: str,
+        fetch: typing.Callable[..., typing.Any],
+        *args: typing.Any,
+        good: typing.Callable[[typing.Any], typing.Any] = lambda result: result is not None,
+    ) -> typing.Any:
+        """Calls fetch(*args), returning its result if good() says it is, otherwise the last good result
+        if there is one recent enough. Otherwise raises FetchFailed, or re-raises SourceUnavailable"""
+
+        try:
+            result = fetch(*args)
+        except breaker.SourceUnavailable:
+            if (cached := self._stale(name)) is None:
+                raise
+            return cached
+        now = self.clock()
+
+        if good(result):
+            with self._lock:
+                self._results[name] = (now, result)
+                self._ages[name] = None
+            return result
+
+        if (cached := self._stale(name)) is None:
+            raise FetchFailed(name)
+        return cached
+
+    def _stale(self, name: str) -> typing.Any:
+        now = self.clock()
+        with self._lock:
+            self._ages[name] = None
+            if name not in self._results:
+                return None
+            fetched_at, result = self._results[name]
+            if now - fetched_at > self.max_age:
+                return None
+            self._ages[name] = now - fetched_at
+        if config.debug:
+            print(f"Using {name} results from {int(now - fetched_at)}s ago")
+        return result
+
+    def check(self, name: str, check: typing.Callable[..., typing.Any], *args: typing.Any) -> typing.Any:
+        """Returns check(*args) if the latest result served for name was fresh, and remembers it.
+        If it was stale, returns what check returned when it was fresh without calling it again"""
+
+        with self._lock:
+            stale = self._ages.get(name) is not None and name in self._checked
+            if stale:
+                return self._checked[name]
+        checked = check(*args)
+        with self._lock:
+            self._checked[name] = checked
+        return checked
+
+    def age(self, name: str) -> typing.Optional[float]:
+        """Seconds old the result last served for name was, or None if it was fresh"""
+
+        with self._lock:
+            return self._ages.get(name)
@@ -0,0 +1,187 @@
+"""Runs each job on its own schedule, in order of when it's next due"""
+
+import heapq
+import itertools
+import logging
+import time
+import typing
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+Reasons = dict[str, list[str]]
+
+
+class Job:
+    """A fetch and the checks that use it, covering one or more metrics and run every `freq` seconds.
+    `run` returns the reasons for each of the metrics it checked, and should take no longer than `timeout` seconds"""
+
+    def __init__(
+        self,
+        name: str,
+        metrics: typing.Sequence[str],
+        run: typing.Callable[[], Reasons],
+        freq: float,
+        timeout: typing.Optional[float] = None,
+    ) -> None:
+        self.name = name
+        self.metrics = tuple(metrics)
+        self.run = run
+        self.freq = freq
+        self.timeout = timeout
+        self.due = 0.0
+
+    def __repr__(self) -> str:
+        return f"Job({self.name!r}, freq={self.freq})"
+
+
+class Scheduler:
+    """Priority queue of jobs ordered by when they're next due.
+
+    A job is rescheduled relative to when it was due rather than when it finished, so it doesn't
+    drift, but never into the past, so one that overran doesn't then run several times back to back.
+    """
+
+    def __init__(
+        self,
+        clock: typing.Callable[[], float] = time.monotonic,
+        sleep: typing.Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.clock = clock
+        self.sleep = sleep
+        self._queue: list[tuple[float, int, Job]] = []
+        self._seq = itertools.count()   # tie breaker, so jobs due at the same time run in the order added
+
+    def __len__(self) -> int:
+        return sum(1 for due, _, job in self._queue if due == job.due)
+
+    def _prune(self) -> None:
+        # Entries left behind when a job was brought forward by retry()
+        while self._queue and self._queue[0][0] != self._queue[0][2].due:
+            heapq.heappop(self._queue)
+
+    def add(self, job: Job, due: typing.Optional[float] = None) -> None:
+        """Queues job to run at due, or straight away"""
+
+        job.due = self.clock() if due is None else due
+        heapq.heappush(self._queue, (job.due, next(self._seq), job))
+
+    def next_due(self) -> float:
+        self._prune()
+        return self._queue[0][0]
+
+    def pop_due(self) -> list[Job]:
+        """Removes and returns every job that's due, soonest first"""
+
+        now = self.clock()
+        due = []
+        self._prune()
+        while self._queue and self._queue[0][0] <= now:
+            due.append(heapq.heappop(self._queue)[2])
+            self._prune()
+        return due
+
+    def reschedule(self, job: Job) -> None:
+        self.add(job, max(job.due + job.freq, self.clock()))
+
+    def retry(self, job: Job, delay: float) -> None:
+        """Brings job forward to run again in delay seconds, if it isn't already due sooner"""
+
+        if self.clock() + delay < job.due:
+            self.add(job, self.clock() + delay)
+
+    def wait(self) -> None:
+        """Sleeps until the next job is due"""
+
+        delay = self.next_due() - self.clock()
+        if delay > 0:
+            self.sleep(delay)
+
+
+# Job outcomes
+OK = "ok"
+FAILED = "failed"
+TIMED_OUT = "timed out"
+
+
+class Runner:
+    """Runs due jobs concurrently in a thread pool, each within its own time budget.
+
+    Threads can't be interrupted, so a job that overruns its timeout is abandoned: it's recorded as timed out
+    and whatever it eventually returns is thrown away. It isn't started again until it has finished, so a hung
+    fetch ties up at most one worker. `on_complete(job, outcome, reasons, duration)` is called from the
+    calling thread whenever a job finishes or times out, with how long it ran for.
+    """
+
+    def __init__(
+        self,
+        schedule: Scheduler,
+        workers: typing.Optional[int],
+        on_complete: typing.Callable[[Job, str, Reasons, float], None],
+    ) -> None:
+        self.schedule = schedule
+        self.on_complete = on_complete
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._running: dict[Future[Reasons], tuple[Job, float]] = {}     # future -> (job, started)
+        self._abandoned: dict[Future[Reasons], Job] = {}
+
+    def busy(self, job: Job) -> bool:
+        return any(running is job for running, _ in self._running.values()) or job in self._abandoned.values()
+
+    def _submit_due(self) -> None:
+        now = self.schedule.clock()
+        for job in self.schedule.pop_due():
+            self.schedule.reschedule(job)
+            if self.busy(job):
+                logging.warning("Skipping %s checks, the last run hasn't finished yet", job.name)
+                continue
+            self._running[self._executor.submit(job.run)] = (job, now)
+
+    def _next_wakeup(self) -> typing.Optional[float]:
+        wakeups = [started + job.timeout for job, started in self._running.values() if job.timeout is not None]
+        if len(self.schedule):
+            wakeups.append(self.schedule.next_due())
+        return min(wakeups) if wakeups else None
+
+    def step(self) -> bool:
+        """Starts any jobs that are due, then waits for one to finish, time out or for more to become due.
+        Returns False without waiting if there's nothing running or scheduled, as nothing ever will be"""
+
+        self._submit_due()
+
+        pending = list(self._running) + list(self._abandoned)
+        wakeup = self._next_wakeup()
+        if not pending:
+            if wakeup is None:
+                return False
+            self.schedule.sleep(max(0.0, wakeup - self.schedule.clock()))
+            return True
+        timeout = None if wakeup is None else max(0.0, wakeup - self.schedule.clock())
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+        now = self.schedule.clock()
+        for future in done:
+            if self._abandoned.pop(future, None):
+                continue
+            job, started = self._running.pop(future)
+            try:
+                reasons, outcome = future.result(), OK
+            except Exception as e:
+                # Exceptions can say what the outcome was, e.g. that a source was unavailable, and need no traceback
+                reasons = {}
+                if hasattr(e, "outcome"):
+                    outcome = e.outcome
+                    logging.warning("%s checks %s: %s", job.name, outcome, e)
+                else:
+                    outcome = FAILED
+                    logging.exception("%s checks failed", job.name)
+            self.on_complete(job, outcome, reasons, now - started)
+
+        for future, (job, started) in list(self._running.items()):
+            if job.timeout is not None and now - started >= job.timeout:
+                del self._running[future]
+                if not future.cancel():
+                    self._abandoned[future] = job
+                self.on_complete(job, TIMED_OUT, {}, now - started)
+        return True
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -4,161 +4,336 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 import config
-import requests
+import breaker
+import httpcache
+import httpclient
+import asyncio
+import hashlib
+import httpx
+import multiprocessing
+import time
 import ujson
+from asn1crypto import pem, x509
 from certvalidator import CertificateValidator, errors
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 base_url = "https://atlas.ripe.net/api/v2/measurements/"
 
-
-def fetch_atlas_results(url):
-    """ Generic function to fetch results from RIPE Atlas API """
+# RIPE Atlas measurement IDs for root server DNSoUDP checks. QueryType SOA
+dns_roots = {
+    "a.root-servers.net": {"v6": 10509, "v4": 10009},
+    "b.root-servers.net": {"v6": 10510, "v4": 10010},
+    "c.root-servers.net": {"v6": 10511, "v4": 10011},
+    "d.root-servers.net": {"v6": 10512, "v4": 10012},
+    "e.root-servers.net": {"v6": 10513, "v4": 10013},
+    "f.root-servers.net": {"v6": 10504, "v4": 10004},
+    "g.root-servers.net": {"v6": 10514, "v4": 10014},
+    "h.root-servers.net": {"v6": 10515, "v4": 10015},
+    "i.root-servers.net": {"v6": 10505, "v4": 10005},
+    "j.root-servers.net": {"v6": 10516, "v4": 10016},
+    "k.root-servers.net": {"v6": 10501, "v4": 10001},
+    "l.root-servers.net": {"v6": 10510, "v4": 10008},
+    "m.root-servers.net": {"v6": 10506, "v4": 10009},
+}
+
+# RIPE Atlas Measurement IDs for Public DNS server measurements.
+dns_servers = {
+    "8.8.8.8": 43869257,
+    "8.8.4.4": None,
+    "1.1.1.1": 12001626,
+    "1.0.0.1": 62471673,
+    "208.67.222.123": 56955213,
+    "208.67.220.123": 56955214,
+    "2001:4860:4860::8888": 62469965,
+    "2001:4860:4860::8844": 62470008,
+    "2606:4700:4700::1111": 62469962,
+    "2606:4700:4700::1001": 62469963,
+    "2620:119:35::35": 62469959,
+    "2620:119:53::53": 62469961
+}
+
+# RIPE Atlas Measurement IDs for NTP.
+# Apparently NTP Pool Project are still dragging their IPv6 heels
+ntp_pools = {
+    "africa.pool.ntp.org": {"v4": 58750160},
+    "asia.pool.ntp.org": {"v4": 58750162},
+    "europe.pool.ntp.org": {"v4": 58750164},
+    "north-america.pool.ntp.org": {"v4": 58750166},
+    "oceania.pool.ntp.org": {"v4": 58750168},
+    "south-america.pool.ntp.org": {"v4": 58750170},
+    "2.africa.pool.ntp.org": {"v6": 58749906},
+    "2.asia.pool.ntp.org": {"v6": 58749908},
+    "2.europe.pool.ntp.org": {"v6": 58749909},
+    "2.north-america.pool.ntp.org": {"v6": 58749919},
+    "2.oceania.pool.ntp.org": {"v6": 58749922},
+    "2.south-america.pool.ntp.org": {"v6": 58749923},
+}
+
+# RIPE Atlas Measurement IDs for the TLS certs presented by popular sites
+https_measurements = {
+    "www.youtube.com": {"v6": 62517823, "v4": 62517825},
+    "www.netflix.com": {"v6": 62517770, "v4": 62517771},
+    "www.amazon.com": {"v6": 62517772, "v4": 62517773},
+    "www.ebay.com": {"v6": None, "v4": 62517853},
+    "www.paypal.com": {"v6": None, "v4": 62517854},
+    "www.tiktok.com": {"v6": None, "v4": 62696644},
+    "www.aliexpress.com": {"v6": None, "v4": 62696649}
+}
+
+# RIPE Atlas built-in connection measurement
+probe_status_measurement = 7000
+
+
+def atlas_measurement_ids(metrics=None):
+    """All the measurement IDs needed by the given (or all enabled) metrics, so they can be fetched in one go"""
+
+    if metrics is None:
+        metrics = [metric for metric, attrs in config.metrics.items() if attrs.get("enabled")]
+
+    ids = set()
+    if "dns_root" in metrics:
+        ids.update(msm for afs in dns_roots.values() for msm in afs.values())
+    if "public_dns" in metrics:
+        ids.update(dns_servers.values())
+    if "ntp" in metrics:
+        ids.update(msm for afs in ntp_pools.values() for msm in afs.values())
+    if "tls" in metrics:
+        ids.update(msm for afs in https_measurements.values() for msm in afs.values())
+    if "atlas_connected" in metrics:
+        ids.add(probe_status_measurement)
+    ids.discard(None)
+
+    return sorted(ids)
+
+
+async def _fetch_atlas_result(client, semaphore, msm_id):
+    url = base_url + str(msm_id) + "/latest/"
+    headers, meta = httpcache.conditional_headers(url)
     try:
-        results = ujson.loads(
-            requests.get(url, headers=config.headers, timeout=60).text
-        )
-
-    except requests.exceptions.RequestException as e:
+        async with semaphore:
+            response = await asyncio.wait_for(client.get(url, headers=headers), config.atlas_deadline)
+        if response.status_code == 304 and meta:
+            return httpcache.recall(url, meta, ujson.loads)
+        response.raise_for_status()
+        results = ujson.loads(response.content)
+    except (httpx.HTTPError, asyncio.TimeoutError, breaker.SourceUnavailable) as e:
         if config.debug:
-            print(e)
+            print(f"failed to fetch RIPE Atlas results from {url}: {e!r}")
         return None
-    except (AttributeError, ujson.JSONDecodeError):
+    except ujson.JSONDecodeError:
         if config.debug:
             print(f"failed to parse RIPE Atlas results from {url}")
         return None
 
+    httpcache.store(url, response.headers, response.content)
+    httpcache.remember(url, response.headers, results)
     return results
 
 
-def fetch_tls_certs():
-    """ Gets x509 cert chains from RIPE Atlas probe's perspective, and does local validation. """
-    https_measurements = {
-        "www.youtube.com": {"v6": 62517823, "v4": 62517825},
-        "www.netflix.com": {"v6": 62517770, "v4": 62517771},
-        "www.amazon.com": {"v6": 62517772, "v4": 62517773},
-        "www.ebay.com": {"v6": None, "v4": 62517853},
-        "www.paypal.com": {"v6": None, "v4": 62517854},
-        "www.tiktok.com": {"v6": None, "v4": 62696644},
-        "www.aliexpress.com": {"v6": None, "v4": 62696649}
-    }
+async def _fetch_atlas_measurements(msm_ids):
+    semaphore = asyncio.Semaphore(config.atlas_concurrency)
+
+    # One pooled client, so every request shares the same keep-alive (or HTTP/2, where negotiated) connections
+    async with httpclient.async_client(max_connections=config.atlas_concurrency, timeout=config.atlas_deadline) as client:
+        results = await asyncio.gather(*(_fetch_atlas_result(client, semaphore, msm_id) for msm_id in msm_ids))
+
+    return dict(zip(msm_ids, results))
+
+
+def fetch_atlas_measurements(msm_ids):
+    """Fetches the latest results for all the given measurement IDs concurrently from the RIPE Atlas API.
+    Returns a dict keyed on measurement ID, with None for any that couldn't be fetched.
+    Raises breaker.SourceUnavailable without trying if the API has been failing"""
+
+    api = breaker.for_url(base_url)
+    if not api.available():
+        raise breaker.SourceUnavailable(api.host, api.retry_at)
+
+    msm_ids = sorted(set(msm_ids))
+    return asyncio.run(_fetch_atlas_measurements(msm_ids))
+
+
+# (hostname, chain hash) -> (passed, error class name, expiry timestamp), least recently used first
+_tls_validation_cache: OrderedDict[tuple[str, str], tuple[bool, str | None, float]] = OrderedDict()
+_tls_pool = None
+
+
+def _chain_expiry(chain, now):
+    """Works out how long a validation result for chain can be trusted: until the first cert in it expires,
+    and no longer than config.tls_cache_max_age. Returns None if the chain can't be parsed"""
+
+    expiry = now + config.tls_cache_max_age
+    try:
+        for cert in chain:
+            if pem.detect(cert):
+                _, _, cert = pem.unarmor(cert)
+            expiry = min(expiry, x509.Certificate.load(cert).not_valid_after.timestamp())
+    except (ValueError, TypeError):
+        return None
+    return expiry
+
+
+def _validate_chain(server, chain):
+    """Does the actual, CPU heavy, path building and validation of one chain.
+    Returns (passed, error class name, expiry). passed is None if validation blew up in some unexpected way"""
+
+    now = time.time()
+
+    # end cert MUST always come first: rfc8446#section-4.4.2
+    # But sometimes we'll also have intermediate cert(s)
+    try:
+        validator = CertificateValidator(chain[0], chain[1:] or None)
+        validator.validate_tls(server)
+        passed, error = True, None
+    except (errors.InvalidCertificateError,
+            errors.PathValidationError,
+            errors.PathBuildingError) as e:
+        passed, error = False, type(e).__name__
+    except Exception:
+        return None, None, None
+
+    return passed, error, _chain_expiry(chain, now)
+
+
+def _validate_chains(batch):
+    """Validates a batch of (server, chain) in a worker process"""
+
+    return [_validate_chain(server, chain) for server, chain in batch]
+
+
+def shutdown_tls_pool():
+    """Stops the cert chain validation processes, if validate_tls_chains() started any"""
+
+    global _tls_pool
+
+    if _tls_pool is not None:
+        _tls_pool.shutdown(cancel_futures=True)
+        _tls_pool = None
+
+
+def normalise_chain(certs):
+    """RIPE Atlas API escapes forward slashes, so they need to be stripped out of the cert string
+    and then converted to ByteStrings for consumption"""
+
+    return [bytes(x.replace('\\', ''), 'ascii') for x in certs]
+
+
+def chain_key(server, chain):
+    return server, hashlib.sha256(b"\0".join(chain)).digest()
+
+
+def validate_tls_chains(chains):
+    """Validates a dict of {chain_key(): (server, chain)}, returning {chain_key(): (passed, error class name)}.
+    passed is None if validation blew up in some unexpected way.
 
-    v6_https = {}
-    v4_https = {}
+    Most probes are presented the same handful of chains, so each result is cached against the hostname
+    and a hash of the normalised chain until the chain expires, or the cache needs the room.
+    Anything not already cached is fanned out to a process pool in batches, as validation is CPU bound."""
+
+    global _tls_pool
+
+    now = time.time()
+    outcomes = {}
+    misses = []
+
+    for key, (server, chain) in chains.items():
+        if cached := _tls_validation_cache.get(key):
+            passed, error, expiry = cached
+            if now < expiry:
+                _tls_validation_cache.move_to_end(key)
+                outcomes[key] = (passed, error)
+                continue
+            del _tls_validation_cache[key]
+        misses.append(key)
+
+    batches = [misses[i:i + config.tls_batch_size] for i in range(0, len(misses), config.tls_batch_size)]
+    jobs = [[chains[key] for key in batch] for batch in batches]
+
+    # Not worth the IPC for a single batch
+    if len(batches) > 1 and config.tls_workers != 1:
+        if _tls_pool is None:
+            # Spawned rather than forked, as the checks may be running in threads
+            _tls_pool = ProcessPoolExecutor(max_workers=config.tls_workers, mp_context=multiprocessing.get_context("spawn"))
+        results = _tls_pool.map(_validate_chains, jobs)
+    else:
+        results = map(_validate_chains, jobs)
+
+    for batch, batch_results in zip(batches, results):
+        for key, (passed, error, expiry) in zip(batch, batch_results):
+            outcomes[key] = (passed, error)
+            if passed is not None and expiry is not None:
+                _tls_validation_cache[key] = (passed, error, expiry)
+
+    while len(_tls_validation_cache) > config.tls_cache_size:
+        _tls_validation_cache.popitem(last=False)
+
+    return outcomes
+
+
+def fetch_tls_certs(measurements=None):
+    """ Gets x509 cert chains from RIPE Atlas probe's perspective, and does local validation.
+    Chains from every probe for every server, over both address families, are collected first
+    so the distinct ones can all be validated in one go """
+
+    if measurements is None:
+        measurements = fetch_atlas_measurements(atlas_measurement_ids(["tls"]))
+
+    https = {"v6": {}, "v4": {}}
+    chains = {}
+    probes = []
 
     for server in https_measurements:
-        if v6 := https_measurements[server].get("v6"):
-            url_v6 = base_url + str(v6) + "/latest/"
-            results_v6 = fetch_atlas_results(url_v6)
-        else:
-            results_v6 = None
+        for af, msm_id in https_measurements[server].items():
+            results = measurements.get(msm_id)
+            if not results:
+                continue
 
-        if results_v6:
-            v6_https[server] = {"failed": [], "passed": []}
-            for probe in results_v6:
+            https[af][server] = {"failed": [], "passed": []}
+            for probe in results:
                 certs = probe.get('cert')
 
                 if certs:
-                    # RIPE Atlas API escapes forward slashes, so they need to be stripped out of the cert string
-                    # and then converted to ByteStrings for consumption
-
-                    # end cert MUST always come first: rfc8446#section-4.4.2
-                    end_cert = bytes(certs[0].replace('\\', ''), 'ascii')
-
-                    # But sometimes we'll also have intermediate cert(s)
-                    if len(certs) > 1:
-                        intermediate_certs = [bytes(x.replace('\\', ''), 'ascii') for x in certs[1:]]
-                        validator = CertificateValidator(end_cert, intermediate_certs)
-                    else:
-                        validator = CertificateValidator(end_cert)
-
-                    try:
-                        validator.validate_tls(server)
-                        v6_https[server]['passed'].append(probe.get('prb_id'))
-                    except (errors.InvalidCertificateError,
-                            errors.PathValidationError,
-                            errors.PathBuildingError):
-                        v6_https[server]['failed'].append(probe.get('prb_id'))
-                        if config.debug:
-                            print(f"Probe {probe.get('prb_id')} received an invalid certificate for {server} over IPv6")
-                    except:
-                        print(f"Unknown TLS validation error: for {server} over IPv6. probe id: {probe.get('prb_id')}")
+                    chain = normalise_chain(certs)
+                    key = chain_key(server, chain)
+                    chains[key] = (server, chain)
+                    probes.append((af, server, probe.get('prb_id'), key))
                 else:
-                    v6_https[server]['failed'].append(probe.get('prb_id'))
+                    https[af][server]['failed'].append(probe.get('prb_id'))
                     #if config.debug:
-                    #    print(f"Probe {probe.get('prb_id')} received no certs from {server} over IPv6")
+                    #    print(f"Probe {probe.get('prb_id')} received no certs from {server} over IP{af}")
+
+    outcomes = validate_tls_chains(chains)
 
-        if v4 := https_measurements[server].get("v4"):
-            url_v4 = base_url + str(v4) + "/latest/"
-            results_v4 = fetch_atlas_results(url_v4)
+    for af, server, prb_id, key in probes:
+        passed, error = outcomes[key]
+        if passed:
+            https[af][server]['passed'].append(prb_id)
+        elif error:
+            https[af][server]['failed'].append(prb_id)
+            if config.debug:
+                print(f"Probe {prb_id} received an invalid certificate for {server} over IP{af}: {error}")
         else:
-            results_v4 = None
+            print(f"Unknown TLS validation error: for {server} over IP{af}. probe id: {prb_id}")
 
-        if results_v4:
-            v4_https[server] = {"failed": [], "passed": []}
-            for probe in results_v4:
-                certs = probe.get('cert')
+    return https["v6"], https["v4"]
 
-                if certs:
-                    # end cert MUST always be first: rfc8446#section-4.4.2
-                    end_cert = bytes(certs[0].replace('\\', ''), 'ascii')
 
-                    # But sometimes we'll also have intermediate cert(s)
-                    if len(certs) > 1:
-                        intermediate_certs = [bytes(x.replace('\\', ''), 'ascii') for x in certs[1:]]
-                        validator = CertificateValidator(end_cert, intermediate_certs)
-                    else:
-                        validator = CertificateValidator(end_cert)
-
-                    try:
-                        validator.validate_tls(server)
-                        v4_https[server]['passed'].append(probe.get('prb_id'))
-                    except (errors.InvalidCertificateError,
-                            errors.PathValidationError,
-                            errors.PathBuildingError):
-                        v4_https[server]['failed'].append(probe.get('prb_id'))
-                        if config.debug:
-                            print(f"Probe {probe.get('prb_id')} received an invalid certificate for {server} over IPv4")
-                    except:
-                        print(f"Unknown TLS validation error: for {server} over IPv4. probe id: {probe.get('prb_id')}")
-                else:
-                    v4_https[server]['failed'].append(probe.get('prb_id'))
-                    #if config.debug:
-                    #    print(f"Probe {probe.get('prb_id')} received no certs from {server} over IPv4")
-
-    return v6_https, v4_https
-
-
-def fetch_public_dns_status():
-    # RIPE Atlas Measurement IDs for Public DNS server measurements.
-    dns_servers = {
-        "8.8.8.8": 43869257,
-        "8.8.4.4": None,
-        "1.1.1.1": 12001626,
-        "1.0.0.1": 62471673,
-        "208.67.222.123": 56955213,
-        "208.67.220.123": 56955214,
-        "2001:4860:4860::8888": 62469965,
-        "2001:4860:4860::8844": 62470008,
-        "2606:4700:4700::1111": 62469962,
-        "2606:4700:4700::1001": 62469963,
-        "2620:119:35::35": 62469959,
-        "2620:119:53::53": 62469961
-    }
+def fetch_public_dns_status(measurements=None):
+    if measurements is None:
+        measurements = fetch_atlas_measurements(atlas_measurement_ids(["public_dns"]))
 
     dns_results = {}
 
     for server in dns_servers:
         if dns_servers[server] is not None:
-            dns_results[server] = {}
-            dns_results[server] = {"failed": [], "passed": []}
-            url = base_url + str(dns_servers[server]) + "/latest"
-
-            results = fetch_atlas_results(url)
+            results = measurements.get(dns_servers[server])
             if not results:
                 if config.debug:
-                    print(f"failed to fetch DNS measurement results from {url}")
-                return dns_results
+                    print(f"failed to fetch DNS measurement results for {server}")
+                continue
 
+            dns_results[server] = {"failed": [], "passed": []}
             for probe in results:
                 try:
                     if probe["result"].get("ANCOUNT") > 0:
@@ -175,38 +350,21 @@ def fetch_public_dns_status():
     return dns_results
 
 
-def fetch_ntp_pool_status():
-    # RIPE Atlas Measurement IDs for NTP.
-    # Apparently NTP Pool Project are still dragging their IPv6 heels
-    ntp_pools = {
-        "africa.pool.ntp.org": {"v4": 58750160},
-        "asia.pool.ntp.org": {"v4": 58750162},
-        "europe.pool.ntp.org": {"v4": 58750164},
-        "north-america.pool.ntp.org": {"v4": 58750166},
-        "oceania.pool.ntp.org": {"v4": 58750168},
-        "south-america.pool.ntp.org": {"v4": 58750170},
-        "2.africa.pool.ntp.org": {"v6": 58749906},
-        "2.asia.pool.ntp.org": {"v6": 58749908},
-        "2.europe.pool.ntp.org": {"v6": 58749909},
-        "2.north-america.pool.ntp.org": {"v6": 58749919},
-        "2.oceania.pool.ntp.org": {"v6": 58749922},
-        "2.south-america.pool.ntp.org": {"v6": 58749923},
-    }
+def fetch_ntp_pool_status(measurements=None):
+    if measurements is None:
+        measurements = fetch_atlas_measurements(atlas_measurement_ids(["ntp"]))
 
     ntp_results = {}
 
     for pool in ntp_pools:
-        ntp_results[pool] = {}
         for af in ntp_pools[pool]:
-            ntp_results[pool][af] = {"failed": [], "passed": []}
-            url = base_url + str(ntp_pools[pool].get(af)) + "/latest"
-
-            results = fetch_atlas_results(url)
+            results = measurements.get(ntp_pools[pool].get(af))
             if not results:
                 if config.debug:
-                    print(f"failed to fetch NTP over IP{af} measurement results from {url}")
-                return ntp_results
+                    print(f"failed to fetch NTP over IP{af} measurement results for {pool}")
+                continue
 
+            ntp_results.setdefault(pool, {})[af] = {"failed": [], "passed": []}
             for probe in results:
                 if len(probe.get("result")[0]) == 6:
                     ntp_results[pool][af]["passed"].append(probe.get("prb_id"))
@@ -216,17 +374,18 @@ def fetch_ntp_pool_status():
     return ntp_results
 
 
-def fetch_ripe_atlas_status():
+def fetch_ripe_atlas_status(measurements=None):
     """Uses the RIPE Atlas built-in connection measurement id 7000 to get last seen status for probes"""
 
-    probe_status = {"connected": [], "disconnected": []}
+    if measurements is None:
+        measurements = fetch_atlas_measurements([probe_status_measurement])
 
-    url = base_url + "7000/latest"
+    probe_status = {"connected": [], "disconnected": []}
 
-    results = fetch_atlas_results(url)
+    results = measurements.get(probe_status_measurement)
     if not results:
         if config.debug:
-            print(f"failed to fetch RIPE Atlas probe connected status measurements from {url}")
+            print("failed to fetch RIPE Atlas probe connected status measurements")
         return probe_status
 
     for probe in results:
@@ -238,48 +397,31 @@ def fetch_ripe_atlas_status():
     return probe_status
 
 
-def fetch_root_dns():
-    # RIPE Atlas measurement IDs for root server DNSoUDP checks. QueryType SOA
-    dns_roots = {
-        "a.root-servers.net": {"v6": 10509, "v4": 10009},
-        "b.root-servers.net": {"v6": 10510, "v4": 10010},
-        "c.root-servers.net": {"v6": 10511, "v4": 10011},
-        "d.root-servers.net": {"v6": 10512, "v4": 10012},
-        "e.root-servers.net": {"v6": 10513, "v4": 10013},
-        "f.root-servers.net": {"v6": 10504, "v4": 10004},
-        "g.root-servers.net": {"v6": 10514, "v4": 10014},
-        "h.root-servers.net": {"v6": 10515, "v4": 10015},
-        "i.root-servers.net": {"v6": 10505, "v4": 10005},
-        "j.root-servers.net": {"v6": 10516, "v4": 10016},
-        "k.root-servers.net": {"v6": 10501, "v4": 10001},
-        "l.root-servers.net": {"v6": 10510, "v4": 10008},
-        "m.root-servers.net": {"v6": 10506, "v4": 10009},
-    }
+def fetch_root_dns(measurements=None):
+    if measurements is None:
+        measurements = fetch_atlas_measurements(atlas_measurement_ids(["dns_root"]))
 
     v6_roots_failed = {}
     v4_roots_failed = {}
 
     for server in dns_roots:
-        url_v6 = base_url + str(dns_roots[server].get("v6")) + "/latest/"
-        url_v4 = base_url + str(dns_roots[server].get("v4")) + "/latest/"
-
-        results_v6 = fetch_atlas_results(url_v6)
+        results_v6 = measurements.get(dns_roots[server].get("v6"))
         if results_v6:
             v6_roots_failed[server] = {"total": len(results_v6), "failed": []}
             for probe in results_v6:
                 if probe.get("error"):
                     v6_roots_failed[server]["failed"].append(probe.get("prb_id"))
         elif config.debug:
-            print(f"failed to fetch IPv6 DNS Root Server measurements from {url_v6}")
+            print(f"failed to fetch IPv6 DNS Root Server measurements for {server}")
 
-        results_v4 = fetch_atlas_results(url_v4)
+        results_v4 = measurements.get(dns_roots[server].get("v4"))
         if results_v4:
             v4_roots_failed[server] = {"total": len(results_v4), "failed": []}
             for probe in results_v4:
                 if probe.get("error"):
                     v4_roots_failed[server]["failed"].append(probe.get("prb_id"))
         elif config.debug:
-            print(f"failed to fetch IPv4 DNS Root Server measurements from {url_v4}")
+            print(f"failed to fetch IPv4 DNS Root Server measurements for {server}")
 
     return v6_roots_failed, v4_roots_failed
 
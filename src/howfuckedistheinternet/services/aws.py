@@ -2,34 +2,155 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 import config
-import requests
+import breaker
+import httpclient
+import asyncio
+import httpx
+import math
+import random
+import time
 import ujson
+from array import array
+from bisect import bisect_left
+
+# Upper bounds of the latency histogram buckets in ms, four per doubling from 1ms to ~65s
+latency_buckets = tuple(2 ** (i / 4) for i in range(65))
+
+
+class LatencyHistogram:
+    """Counts of latencies in fixed log scale buckets, with one more bucket for anything slower.
+    Small enough to keep one per region per address family every cycle"""
+
+    __slots__ = ("counts",)
+
+    def __init__(self):
+        self.counts = array("I", bytes(4 * (len(latency_buckets) + 1)))
+
+    def add(self, ms):
+        self.counts[bisect_left(latency_buckets, ms)] += 1
+
+    def __len__(self):
+        return sum(self.counts)
+
+    def quantile(self, q):
+        """Upper bound in ms of the bucket holding the q quantile, or None if there are no samples"""
+
+        total = len(self)
+        if not total:
+            return None
+        rank = max(1, q * total)
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return latency_buckets[min(i, len(latency_buckets) - 1)]
+
+
+async def _probe(client, semaphore, url, latency):
+    connect_started = []
+
+    async def trace(event, info):
+        # Only fires when a new connection is made, not when one is reused
+        if event == "connection.connect_tcp.started":
+            connect_started.append(time.perf_counter())
+        elif event == "connection.connect_tcp.complete":
+            latency["connect"].add((time.perf_counter() - connect_started.pop()) * 1000)
+
+    try:
+        async with semaphore:
+            started = time.perf_counter()
+            # Only the status matters, so don't bother with the body
+            r = await client.head(url, extensions={"trace": trace})
+            elapsed = (time.perf_counter() - started) * 1000
+    except httpx.HTTPError:
+        return False
+    except breaker.SourceUnavailable:
+        # Not waited on as it's been failing, but it still counts as a failure
+        return False
+
+    if r.is_success:
+        latency["total"].add(elapsed)
+    return r.is_success
+
+
+def wilson_interval(failed, total, z=1.96):
+    """Wilson score interval for the failure rate, given failed out of total checks, as fractions"""
+
+    if not total:
+        return 0.0, 1.0
+    p = failed / total
+    centre = p + z * z / (2 * total)
+    spread = z * math.sqrt(p * (1 - p) / total + z * z / (4 * total * total))
+    denominator = 1 + z * z / total
+    return max(0.0, (centre - spread) / denominator), min(1.0, (centre + spread) / denominator)
+
+
+def clean_sample_size(threshold, z=1.96):
+    """Fewest checks that, if none of them fail, put the whole Wilson interval under threshold %"""
+
+    # With no failures the upper bound is z^2 / (n + z^2)
+    return math.floor(z * z * (100 / threshold - 1)) + 1
+
+
+async def _probe_region(client, semaphore, urls, stats):
+    """Probes a random sample of a region's checkpoints, and only the rest of them if the sample isn't conclusive.
+    It's conclusive when the confidence interval of its failure rate is entirely under or over the threshold,
+    however many of its checks failed. The sample is at least big enough for a clean one to be conclusive"""
+
+    async def probe(urls):
+        return list(await asyncio.gather(*(_probe(client, semaphore, url, stats) for url in urls)))
+
+    stats["checkpoints"] = len(urls)
+    threshold = config.metrics["aws"].get("threshold")
+    sample_size = config.aws_sample_size and max(config.aws_sample_size, clean_sample_size(threshold, config.aws_sample_z))
+    if sample_size and len(urls) > sample_size:
+        urls = random.sample(urls, len(urls))
+        results = await probe(urls[:sample_size])
+
+        lower, upper = wilson_interval(results.count(False), len(results), config.aws_sample_z)
+        if lower * 100 <= threshold <= upper * 100:
+            results += await probe(urls[sample_size:])
+    else:
+        results = await probe(urls)
+
+    stats["sampled"] = len(results) < len(urls)
+    stats["ci"] = wilson_interval(results.count(False), len(results), config.aws_sample_z)
+    return results
+
+
+async def _probe_aws(aws_check_urls):
+    semaphore = asyncio.Semaphore(config.aws_concurrency)
+
+    aws_stats = {region: {"connect": LatencyHistogram(), "total": LatencyHistogram()} for region in aws_check_urls}
+
+    async with httpclient.async_client(
+        max_connections=config.aws_concurrency, timeout=config.aws_read_timeout, connect_timeout=config.aws_connect_timeout
+    ) as client:
+        results = await asyncio.gather(*(
+            _probe_region(client, semaphore, urls, aws_stats[region]) for region, urls in aws_check_urls.items()
+        ))
+
+    aws_results = dict(zip(aws_check_urls, results))
+    return aws_results, aws_stats
 
 
 def fetch_aws(aws_urls_file):
     """Attempts to fetch the green-icon.gif hosted in all regions for the specific purpose of connectivity checks
     see http://ec2-reachability.amazonaws.com
-    Timeouts or HTTP errors are marked as failures"""
+    All the checkpoints are probed concurrently, up to config.aws_concurrency at a time.
+    With config.aws_sample_size set, only a random sample of each region's checkpoints are probed
+    unless the sample says the region may be fucked.
+    Timeouts or HTTP errors are marked as failures.
+
+    Also returns stats for each region: connect and total latency histograms (total only counting successful checks),
+    the number of checkpoints, whether only a sample was probed and the confidence interval of the failure rate"""
 
-    aws_results = {}
     with open(aws_urls_file, "r") as f:
         aws_check_urls = ujson.loads(f.read())
 
-    for region, urls in aws_check_urls.items():
-        aws_results[region] = []
-        for url in urls:
-            try:
-                r = requests.get(url, headers=config.headers, timeout=60)
-                if r.ok:
-                    aws_results[region].append(True)
-                else:
-                    aws_results[region].append(False)
-            except:
-                aws_results[region].append(False)
+    return asyncio.run(_probe_aws(aws_check_urls))
 
-    return aws_results
-
-def check_aws(aws_results, af):
+def check_aws(aws_results, af, aws_stats=None):
     fucked_reasons = []
     for region, results in aws_results.items():
         total = len(results)
@@ -40,8 +161,49 @@ def check_aws(aws_results, af):
             pct_failed = 0
 
         if pct_failed > config.metrics["aws"].get("threshold"):
-            fucked_reasons.append(
-                f"[AWS] {region} {pct_failed}% of connectivity checks over IPv{af} failed"
-            )
+            reason = f"[AWS] {region} {pct_failed}% of connectivity checks over IPv{af} failed"
+            stats = (aws_stats or {}).get(region)
+            if stats and stats.get("sampled"):
+                lower, upper = stats["ci"]
+                reason += (
+                    f" (sampled {total} of {stats['checkpoints']}, "
+                    f"{round(lower * 100, 1)}-{round(upper * 100, 1)}% confidence interval)"
+                )
+            fucked_reasons.append(reason)
+
+    return fucked_reasons
+
+def check_aws_latency(v6_stats, v4_stats, aws_latency_history):
+    """Keep track of the median latency of the connectivity checks in each region
+    Alert when it increases by aws_latency threshold % over the historic average
+    """
+
+    fucked_reasons = []
+    present = set()
+
+    for af, aws_stats in (("6", v6_stats), ("4", v4_stats)):
+        for region, stats in aws_stats.items():
+            median = stats["total"].quantile(0.5)
+            if median is None:
+                continue
+
+            key = f"{region} IPv{af}"
+            present.add(key)
+            aws_latency_history.append(key, round(median))
+            avg = aws_latency_history.mean(key)
+            try:
+                pc = round(((median / avg) * 100), 1)
+            except ZeroDivisionError:
+                pc = 100
+
+            if pc - 100 > config.metrics["aws_latency"].get("threshold"):
+                fucked_reasons.append(
+                    f"[AWS] {region} median latency over IPv{af} has increased by {round(pc - 100, 2)}% from the "
+                    f"{((config.max_history * config.update_frequency) / 60) / 60}hrs average {int(avg)}ms "
+                    f"to {round(median)}ms"
+                )
+
+    aws_latency_history.retire_missing(present)
+    aws_latency_history.end_cycle()
 
-    return fucked_reasons
\ No newline at end of file
+    return fucked_reasons, aws_latency_history
\ No newline at end of file
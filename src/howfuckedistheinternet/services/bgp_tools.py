@@ -4,215 +4,421 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 import config
-import requests
+import httpcache
+import httpx
 import ujson
 import math
+from array import array
+from bisect import bisect_right
+from itertools import compress
+
+
+# Origin ASNs that shouldn't be seen in the DFZ, as a sorted interval table of (first, last, kind, label)
+asn_intervals = (
+    (0, 0, "bogon", "RFC 7607"),
+    (23456, 23456, "bogon", "RFC 4893 AS_TRANS"),
+    (64496, 64511, "bogon", "RFC 5398 documentation"),
+    (64512, 65534, "private", "RFC 6996 private"),
+    (65535, 65535, "bogon", "RFC 7300 last 16 bit"),
+    (65536, 65551, "bogon", "RFC 5398 documentation"),
+    (65552, 131071, "bogon", "IANA reserved"),
+    (4200000000, 4294967294, "private", "RFC 6996 private"),
+    (4294967295, 4294967295, "bogon", "RFC 7300 last 32 bit"),
+)
+_asn_interval_starts = [x[0] for x in asn_intervals]
+
+_FINGERPRINT_MASK = 0xFFFFFFFFFFFFFFFF
+
+
+def _fingerprint(x):
+    """splitmix64 hash of x, summed over a prefix's routes for an order independent fingerprint.
+    Non-linear, so no route (not even AS0) hashes to 0 and different sets of routes don't cancel out"""
+
+    x = (x + 0x9E3779B97F4A7C15) & _FINGERPRINT_MASK
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _FINGERPRINT_MASK
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _FINGERPRINT_MASK
+    return x ^ (x >> 31)
+
+
+def classify_asns(asns):
+    """Classifies a batch of ASNs against the interval table with one bisect per ASN,
+    rather than testing each against every range.
+    Returns a dict of {asn: (kind, label)} for just the bogon and private ASNs"""
+
+    classified = {}
+    for asn in asns:
+        i = bisect_right(_asn_interval_starts, asn) - 1
+        if i >= 0 and asn <= asn_intervals[i][1]:
+            classified[asn] = asn_intervals[i][2:]
+
+    return classified
+
+
+class BGPTable:
+    """Compact columnar snapshot of the bgp.tools table.
+    Each route is a row across three typed arrays (prefix id, origin ASN, Hits) rather than a dict,
+    and every prefix string is interned once.
+
+    Everything the BGP checks need is aggregated in the same single pass that adds the routes:
+    origins per prefix, prefixes per ASN and v4/v6 DFZ sizes. finish() then classifies the
+    distinct origin ASNs in one batch to find the routes originated by bogon ASNs.
+
+    Each prefix also gets a fingerprint of its set of origin ASNs, and of its (ASN, Hits) pairs,
+    so diff_bgp_tables() can spot what changed since the previous table without comparing routes.
+
+    CSR style offset indexes, built on demand, give the routes for a given prefix or ASN
+    without storing the route twice:
+        routes for prefix id p are pfx_routes[pfx_offsets[p]:pfx_offsets[p + 1]]
+        routes for ASN id a are asn_routes[asn_offsets[a]:asn_offsets[a + 1]]"""
+
+    def __init__(self):
+        self.prefixes = []                  # prefix id -> interned CIDR string
+        self.prefix_ids = {}                # CIDR string -> prefix id
+        self.route_pfx = array("I")
+        self.route_asn = array("I")
+        self.route_hits = array("I")
+
+        # Aggregates
+        self.origin_counts = array("I")     # prefix id -> number of origin ASNs
+        self.asn_prefix_counts = {}         # ASN -> number of prefixes originated
+        self.v4_dfz_count = 0
+        self.v6_dfz_count = 0
+        self.bogon_asns = {}                # ASN -> (kind, label), see classify_asns()
+        self.bogon_routes = []              # route indexes originated by bogon_asns
+        self.origin_fingerprints = array("Q")
+        self.hits_fingerprints = array("Q")
+        self.diff = None                    # BGPDiff against the previous table, if there was one
+
+        # Indexes
+        self.asns = None
+        self.pfx_offsets = None
+        self.pfx_routes = None
+        self.asn_offsets = None
+        self.asn_routes = None
+
+    def __len__(self):
+        return len(self.route_pfx)
+
+    def add_route(self, pfx, asn, hits):
+        try:
+            pfx_id = self.prefix_ids[pfx]
+        except KeyError:
+            pfx_id = len(self.prefixes)
+            pfx = sys.intern(pfx)
+            self.prefixes.append(pfx)
+            self.prefix_ids[pfx] = pfx_id
+            self.origin_counts.append(0)
+            self.origin_fingerprints.append(0)
+            self.hits_fingerprints.append(0)
+            if ":" in pfx:
+                self.v6_dfz_count += 1
+            else:
+                self.v4_dfz_count += 1
+
+        self.origin_counts[pfx_id] += 1
+        self.origin_fingerprints[pfx_id] = (self.origin_fingerprints[pfx_id] + _fingerprint(asn)) & _FINGERPRINT_MASK
+        self.hits_fingerprints[pfx_id] = (
+            self.hits_fingerprints[pfx_id] + _fingerprint((hits << 32) | asn)
+        ) & _FINGERPRINT_MASK
+
+        try:
+            self.asn_prefix_counts[asn] += 1
+        except KeyError:
+            self.asn_prefix_counts[asn] = 1
+
+        self.route_pfx.append(pfx_id)
+        self.route_asn.append(asn)
+        self.route_hits.append(hits)
+
+    def finish(self):
+        """Classifies every origin ASN in one batch once all routes have been added,
+        then picks out the routes they originate without leaving C"""
+
+        self.bogon_asns = classify_asns(self.asn_prefix_counts)
+        self.bogon_routes = list(
+            compress(range(len(self.route_asn)), map(self.bogon_asns.__contains__, self.route_asn))
+        )
+
+    def build_indexes(self):
+        """Builds the by-prefix and by-ASN offset indexes, once all routes have been added"""
+
+        self.asns = array("I", sorted(self.asn_prefix_counts))
+        asn_ids = {asn: asn_id for asn_id, asn in enumerate(self.asns)}
+        route_asn_ids = array("I", (asn_ids[asn] for asn in self.route_asn))
+
+        self.pfx_offsets, self.pfx_routes = self._csr(self.route_pfx, len(self.prefixes))
+        self.asn_offsets, self.asn_routes = self._csr(route_asn_ids, len(self.asns))
+
+    @staticmethod
+    def _csr(keys, num_keys):
+        """Counting sort of route indexes by key id, returning (offsets, routes)"""
+
+        offsets = array("I", bytes(4 * (num_keys + 1)))
+        for key in keys:
+            offsets[key + 1] += 1
+        for i in range(num_keys):
+            offsets[i + 1] += offsets[i]
+
+        routes = array("I", bytes(4 * len(keys)))
+        fill = offsets[:-1]
+        for route, key in enumerate(keys):
+            routes[fill[key]] = route
+            fill[key] += 1
+
+        return offsets, routes
+
+    def routes_for_prefix(self, pfx_id):
+        if self.pfx_offsets is None:
+            self.build_indexes()
+        return self.pfx_routes[self.pfx_offsets[pfx_id]:self.pfx_offsets[pfx_id + 1]]
+
+    def routes_for_asn(self, asn_id):
+        if self.asn_offsets is None:
+            self.build_indexes()
+        return self.asn_routes[self.asn_offsets[asn_id]:self.asn_offsets[asn_id + 1]]
+
+
+class BGPDiff:
+    """What changed between two consecutive BGPTables"""
+
+    def __init__(self):
+        self.added = []                     # prefixes
+        self.removed = []                   # prefixes
+        self.origins_changed = []           # prefixes whose set of origin ASNs changed
+        self.hits_changed = []              # prefixes whose origins' Hits changed
+        self.asns_changed = []              # ASNs that appeared or whose number of prefixes changed
+        self.asns_removed = []              # ASNs that no longer originate anything
+
+    def __len__(self):
+        return len(self.added) + len(self.removed) + len(self.origins_changed) + len(self.hits_changed)
+
+    def __str__(self):
+        return (
+            f"{len(self.added)} prefixes added, {len(self.removed)} removed, "
+            f"{len(self.origins_changed)} with changed origins, {len(self.hits_changed)} with changed Hits, "
+            f"{len(self.asns_changed)} ASNs changed, {len(self.asns_removed)} removed"
+        )
+
+
+def diff_bgp_tables(previous, table):
+    """Compares each prefix's origin count and fingerprints against the previous table's, and each ASN's prefix count"""
+
+    diff = BGPDiff()
+
+    previous_ids = previous.prefix_ids
+    for pfx_id, pfx in enumerate(table.prefixes):
+        try:
+            previous_id = previous_ids[pfx]
+        except KeyError:
+            diff.added.append(pfx)
+            continue
+        if (
+            table.origin_counts[pfx_id] != previous.origin_counts[previous_id]
+            or table.origin_fingerprints[pfx_id] != previous.origin_fingerprints[previous_id]
+        ):
+            diff.origins_changed.append(pfx)
+        elif table.hits_fingerprints[pfx_id] != previous.hits_fingerprints[previous_id]:
+            diff.hits_changed.append(pfx)
 
+    if len(previous_ids) + len(diff.added) != len(table.prefixes):
+        diff.removed = [pfx for pfx in previous.prefixes if pfx not in table.prefix_ids]
 
-def fetch_bgp_table():
+    previous_counts = previous.asn_prefix_counts
+    diff.asns_changed = [asn for asn, count in table.asn_prefix_counts.items() if previous_counts.get(asn) != count]
+    diff.asns_removed = [asn for asn in previous_counts if asn not in table.asn_prefix_counts]
+
+    return diff
+
+
+def build_bgp_table(routes):
+    """Packs an iterable of bgp.tools route dicts into a BGPTable, aggregating as it goes"""
+
+    table = BGPTable()
+    for x in routes:
+        table.add_route(x["CIDR"], x["ASN"], x.get("Hits", 0))
+    table.finish()
+
+    return table
+
+
+def fetch_bgp_table(previous=None):
     """Fetches BGP/DFZ info as json from bgp.tools
-    Builds two dicts, keyed on ASN and Prefix"""
+    Packs it into a columnar BGPTable as the table streams in.
+    Given the previous table, also works out what's changed since, in table.diff"""
 
     url = "https://bgp.tools/table.jsonl"
 
-    table_asn_key = {}
-    table_pfx_key = {}
     try:
-        results = requests.get(url, headers=config.headers, timeout=60)
-    except:
+        # The body is read in chunks and each route packed as its line arrives,
+        # so memory use stays flat regardless of the size of the table
+        fresh, lines = httpcache.stream_lines(url)
+        if not fresh and previous is not None and len(previous):
+            # Nothing's changed since last time
+            previous.diff = BGPDiff()
+            return previous
+        table = build_bgp_table(ujson.loads(line) for line in lines if line)
+    except (httpx.HTTPError, ujson.JSONDecodeError, KeyError, OSError):
+        # A partial table would look like a massive DFZ collapse, so throw it all away
         if config.debug:
             print(f"failed to fetch {url}")
-        return table_asn_key, table_pfx_key
+        return build_bgp_table([])
+
+    if previous is not None and len(previous):
+        table.diff = diff_bgp_tables(previous, table)
+        if config.debug:
+            print(f"[BGP] {table.diff}")
 
-    table_list = results.text.split("\n")
+    return table
 
-    for x in table_list:
-        # Build a dict keyed on ASN
-        try:
-            x = ujson.loads(x)
-        except ujson.JSONDecodeError:
-            break
-        try:
-            asn = x.get("ASN")
-            if asn in table_asn_key:
-                table_asn_key[asn].append(x)
-            else:
-                table_asn_key[asn] = [x]
-        except KeyError:
-            break
 
-        # Build a dict keyed on prefix
-        try:
-            pfx = x.get("CIDR")
-            if pfx in table_pfx_key:
-                table_pfx_key[pfx].append(x)
-            else:
-                table_pfx_key[pfx] = [x]
-        except KeyError:
-            break
+def update_history(history, diff_changed, diff_removed, latest):
+    """Brings a history store up to date with only the keys that have changed since the last table,
+    plus those whose history hasn't settled yet. Settled keys would just be given the same value again.
+    Returns the keys that were touched, which are the only ones whose checks could have changed"""
 
-    return table_asn_key, table_pfx_key
+    touched = set(diff_changed)
+    for key in touched:
+        history.append(key, latest(key))
+    for key in history.unsettled - touched:
+        history.append(key, history.latest(key))
+        touched.add(key)
+    for key in diff_removed:
+        history.retire(key)
+    history.end_cycle()
 
+    return touched
 
-def check_bogon_asns(table_pfx_key):
+
+def check_bogon_asns(table):
     """ Check origin ASN(s) for every prefix and complain about bad ones """
 
     fucked_reasons = []
 
-    bogon_asns = (
-        range(0, 0 + 1),                    # RFC 7607
-        range(23456, 23456 + 1),            # RFC 4893 AS_TRANS
-        range(64496, 64511 + 1),            # RFC 5398 and documentation/example ASNs
-        range(65535, 65535 + 1),            # RFC 7300 Last 16 bit ASN
-        range(65536, 65551 + 1),            # RFC 5398 and documentation/example ASNs
-        range(65552, 131071 + 1),           # IANA reserved ASNs
-        range(4294967295, 4294967295 + 1)   # RFC 7300 Last 32 bit ASN
-    )
-
-    private_asns = (
-        range(64512, 65534 + 1),  # RFC 6996 Private ASNs
-        range(4200000000, 4294967294 + 1),  # RFC 6996 Private ASNs
-    )
-
-    for pfx in table_pfx_key:
-        for path in table_pfx_key.get(pfx):
-            asn = path.get("ASN")
-
-            # It feels uglier but it's much quicker to iterate over a tuple of ranges
-            # than checking a fully expanded tuple with 95M entries.
-            for bogon in bogon_asns:
-                if asn in bogon and path.get("Hits") >= config.metrics["bogonASNs"].get("threshold"):
-                    reason = (
-                        f"[BogonASN] <a href='https://bgp.tools/prefix/{pfx}#connectivity'>{pfx}</a> "
-                        f"is originated by bogon AS{asn}, "
-                        f"visible from {path.get('Hits')} BGP.tools contributors"
-                    )
-                    fucked_reasons.append(reason)
-                    if config.debug:
-                        print(f"[BogonASN] {pfx} is originated by a bogon AS{asn}, visible from {path.get('Hits')}")
-            for private in private_asns:
-                if asn in private and path.get("Hits") >= config.metrics["bogonASNs"].get("threshold"):
-                    reason = (
-                        f"[BogonASN] <a href='https://bgp.tools/prefix/{pfx}#connectivity'>{pfx}</a> "
-                        f"is originated by private AS{asn}, "
-                        f"visible from {path.get('Hits')} BGP.tools contributors"
-                    )
-                    fucked_reasons.append(reason)
-                    if config.debug:
-                        print(f"[BogonASN] {pfx} is originated by a private AS{asn}, visible from {path.get('Hits')}")
+    threshold = config.metrics["bogonASNs"].get("threshold")
+
+    for route in table.bogon_routes:
+        hits = table.route_hits[route]
+        if hits < threshold:
+            continue
+        asn = table.route_asn[route]
+        kind, label = table.bogon_asns[asn]
+        pfx = table.prefixes[table.route_pfx[route]]
+
+        reason = (
+            f"[BogonASN] <a href='https://bgp.tools/prefix/{pfx}#connectivity'>{pfx}</a> "
+            f"is originated by {kind} AS{asn} ({label}), "
+            f"visible from {hits} BGP.tools contributors"
+        )
+        fucked_reasons.append(reason)
+        if config.debug:
+            print(f"[BogonASN] {pfx} is originated by a {kind} AS{asn} ({label}), visible from {hits}")
 
     return fucked_reasons
 
 
-def check_bgp_origins(table_pfx_key, num_origins_history):
+def check_bgp_origins(table, num_origins_history):
     """Store the latest num of origin AS per prefix
-    Check the history to see if any prefixes have an increased number of origin AS"""
+    Check the history to see if any prefixes have an increased number of origin AS
+    If the table has a diff, only prefixes that changed or haven't settled need looking at"""
 
     fucked_reasons = []
 
-    for pfx in table_pfx_key:
-        num_origins = len(table_pfx_key.get(pfx))
-        if pfx in num_origins_history:
-            num_origins_history[pfx].insert(0, num_origins)
-            if len(num_origins_history.get(pfx)) > config.max_history:
-                zz = num_origins_history[pfx].pop()
-        else:
-            num_origins_history[pfx] = [num_origins]
+    if table.diff is not None:
+        touched = update_history(
+            num_origins_history,
+            table.diff.added + table.diff.origins_changed,
+            table.diff.removed,
+            lambda pfx: table.origin_counts[table.prefix_ids[pfx]],
+        )
+        changed = ((pfx, num_origins_history.latest(pfx), num_origins_history.mean(pfx)) for pfx in touched)
+    else:
+        for pfx, num_origins in zip(table.prefixes, table.origin_counts):
+            num_origins_history.append(pfx, num_origins)
+        num_origins_history.retire_missing(table.prefix_ids)
+        num_origins_history.end_cycle()
+        changed = num_origins_history.items()
 
     # Check for an increase in origins, could signify hijacking
-    for pfx, origins in num_origins_history.items():
-        avg = sum(origins) / len(origins)
-
+    for pfx, latest, avg in changed:
         # Exclude any multi-origin anycast prefixes
-        if origins[0] > avg and avg < 2:
+        if latest > avg and avg < 2:
             reason = (
-                f"[Origins] {pfx} is being originated by <a href='https://bgp.tools/prefix/{pfx}#connectivity'>{origins[0]} ASNs</a>, above the "
+                f"[Origins] {pfx} is being originated by <a href='https://bgp.tools/prefix/{pfx}#connectivity'>{latest} ASNs</a>, above the "
                 f"{((config.max_history * config.update_frequency) / 60 ) / 60}hrs average of {math.floor(avg)}"
             )
             fucked_reasons.append(reason)
             if config.debug:
-                print(f"[Origins] {pfx} is being originated by {origins[0]} ASNs, above the "
+                print(f"[Origins] {pfx} is being originated by {latest} ASNs, above the "
                       f"{((config.max_history * config.update_frequency) / 60 ) / 60}hrs average of {math.floor(avg)}")
 
         # Catch a sudden decrease in origins of anycast prefixes that usually have a lot
-        if origins[0] < 2 and avg > 5:
+        if latest < 2 and avg > 5:
             reason = (
-                f"[Origins] {pfx} is being originated by <a href='https://bgp.tools/prefix/{pfx}#connectivity'>{origins[0]} ASNs</a>, below the "
+                f"[Origins] {pfx} is being originated by <a href='https://bgp.tools/prefix/{pfx}#connectivity'>{latest} ASNs</a>, below the "
                 f"{((config.max_history * config.update_frequency) / 60 ) / 60}hrs average of {math.floor(avg)}"
             )
             fucked_reasons.append(reason)
             if config.debug:
-                print(f"[Origins] {pfx} is being originated by {origins[0]} ASNs, below the "
+                print(f"[Origins] {pfx} is being originated by {latest} ASNs, below the "
                       f"{((config.max_history * config.update_frequency) / 60 ) / 60}hrs average of {math.floor(avg)}")
 
     return fucked_reasons, num_origins_history
 
 
-def check_bgp_prefixes(table_asn_key, num_prefixes_history):
+def check_bgp_prefixes(table, num_prefixes_history):
     """Store the latest number of prefixes advertised per ASN
     Check the history to see if any ASNs have a drastically reduced number of prefixes
+    If the table has a diff, only ASNs that changed or haven't settled need looking at
     """
 
     fucked_reasons = []
 
     # Add latest result to the history
-    for asn in table_asn_key:
-        num_prefixes = len(table_asn_key.get(asn))
-        if asn in num_prefixes_history:
-            num_prefixes_history[asn].insert(0, num_prefixes)
-            if len(num_prefixes_history.get(asn)) > config.max_history:
-                zz = num_prefixes_history[asn].pop()
-        else:
-            num_prefixes_history[asn] = [num_prefixes]
+    if table.diff is not None:
+        touched = update_history(
+            num_prefixes_history, table.diff.asns_changed, table.diff.asns_removed, table.asn_prefix_counts.get
+        )
+        changed = ((asn, num_prefixes_history.latest(asn), num_prefixes_history.mean(asn)) for asn in touched)
+    else:
+        for asn, num_prefixes in table.asn_prefix_counts.items():
+            num_prefixes_history.append(asn, num_prefixes)
+        num_prefixes_history.retire_missing(table.asn_prefix_counts)
+        num_prefixes_history.end_cycle()
+        changed = num_prefixes_history.items()
 
     # Check for a drastic decrease in prefixes being advertised by an ASN
-    for asn, prefixes in num_prefixes_history.items():
-        avg = sum(prefixes) / len(prefixes)
-        percentage = 100 - int(round((prefixes[0] / avg) * 100, 0))
+    for asn, latest, avg in changed:
+        percentage = 100 - int(round((latest / avg) * 100, 0))
         if percentage > config.metrics["prefixes"].get("threshold"):
             reason = (
                 f"[Prefixes] <a href='https://bgp.tools/as/{asn}#prefixes'>AS{asn}</a> "
-                f"is originating only {prefixes[0]} prefixes, {percentage}% "
+                f"is originating only {latest} prefixes, {percentage}% "
                 f"fewer than the {((config.max_history * config.update_frequency) / 60 ) / 60}hrs "
                 f"average of {math.ceil(avg)}"
             )
             fucked_reasons.append(reason)
             if config.debug:
-                print(f"[Prefixes] AS{asn} is originating only {prefixes[0]} prefixes, {percentage}% "
+                print(f"[Prefixes] AS{asn} is originating only {latest} prefixes, {percentage}% "
                       f"fewer than the {((config.max_history * config.update_frequency) / 60 ) / 60}hrs "
                       f"average of {math.ceil(avg)}")
 
     return fucked_reasons, num_prefixes_history
 
 
-def check_dfz(table_pfx_key, num_dfz_routes_history):
+def check_dfz(table, num_dfz_routes_history):
     """Keep track of the number of routes present in both the IPv4 and IPv6 DFZ
     Alert when DFZ size increases by dfz_threshold %
-    Iterating this dict to parse v4 or v6 seems silly, but oh well.
     """
 
     fucked_reasons = []
 
-    v6_dfz_count = 0
-    v4_dfz_count = 0
-
-    for pfx in table_pfx_key:
-        if pfx.find("::/") > 0:
-            v6_dfz_count += 1
-        else:
-            v4_dfz_count += 1
-
-    num_dfz_routes_history["v6"].insert(0, v6_dfz_count)
-    if len(num_dfz_routes_history["v6"]) > config.max_history:
-        num_dfz_routes_history["v6"].pop()
-
-    num_dfz_routes_history["v4"].insert(0, v4_dfz_count)
-    if len(num_dfz_routes_history["v4"]) > config.max_history:
-        num_dfz_routes_history["v4"].pop()
+    num_dfz_routes_history.append("v6", table.v6_dfz_count)
+    num_dfz_routes_history.append("v4", table.v4_dfz_count)
+    num_dfz_routes_history.end_cycle()
 
-    avg_v6 = sum(num_dfz_routes_history["v6"]) / len(num_dfz_routes_history["v6"])
+    avg_v6 = num_dfz_routes_history.mean("v6")
     try:
-        v6_pc = round(((num_dfz_routes_history["v6"][0] / avg_v6) * 100), 1)
+        v6_pc = round(((table.v6_dfz_count / avg_v6) * 100), 1)
     except ZeroDivisionError:
         v6_pc = 100
 
@@ -220,13 +426,13 @@ def check_dfz(table_pfx_key, num_dfz_routes_history):
         reason = (
             f"[DFZ] IPv6 DFZ has increased by {round(v6_pc - 100, 2)}% from the "
             f"{((config.max_history * config.update_frequency) / 60 ) / 60}hrs average {int(avg_v6)} "
-            f"to {num_dfz_routes_history['v6'][0]} routes"
+            f"to {table.v6_dfz_count} routes"
         )
     elif 100 - v6_pc > config.metrics["dfz"].get("threshold"):
         reason = (
             f"[DFZ] IPv6 DFZ has decreased by {round(100 - v6_pc, 2)}% from the "
             f"{((config.max_history * config.update_frequency) / 60) / 60}hrs average {int(avg_v6)} "
-            f"to {num_dfz_routes_history['v6'][0]} routes"
+            f"to {table.v6_dfz_count} routes"
         )
     else:
         reason = None
@@ -237,9 +443,9 @@ def check_dfz(table_pfx_key, num_dfz_routes_history):
             print(reason)
         del reason
 
-    avg_v4 = sum(num_dfz_routes_history["v4"]) / len(num_dfz_routes_history["v4"])
+    avg_v4 = num_dfz_routes_history.mean("v4")
     try:
-        v4_pc = round(((num_dfz_routes_history["v4"][0] / avg_v4) * 100), 1)
+        v4_pc = round(((table.v4_dfz_count / avg_v4) * 100), 1)
     except ZeroDivisionError:
         v4_pc = 100
 
@@ -247,13 +453,13 @@ def check_dfz(table_pfx_key, num_dfz_routes_history):
         reason = (
             f"[DFZ] IPv4 DFZ has increased by {round(v4_pc - 100, 2)}% from the "
             f"{((config.max_history * config.update_frequency) / 60 ) / 60}hrs average {int(avg_v4)} "
-            f"to {num_dfz_routes_history['v4'][0]} routes"
+            f"to {table.v4_dfz_count} routes"
         )
     elif 100 - v4_pc > config.metrics["dfz"].get("threshold"):
         reason = (
             f"[DFZ] IPv4 DFZ has decreased by {round(100 - v4_pc, 2)}% from the "
             f"{((config.max_history * config.update_frequency) / 60) / 60}hrs average {int(avg_v4)} "
-            f"to {num_dfz_routes_history['v4'][0]} routes"
+            f"to {table.v4_dfz_count} routes"
         )
     else:
         reason = None
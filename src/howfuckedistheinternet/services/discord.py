@@ -2,7 +2,8 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 import config
-import requests
+import httpcache
+import httpx
 import ujson
 
 
@@ -10,10 +11,8 @@ def fetch_discord():
     url = 'https://discordstatus.com/api/v2/incidents/unresolved.json'
 
     try:
-        response = ujson.loads(
-            requests.get(url, headers=config.headers,timeout=60).text
-        )
-    except requests.exceptions.RequestException as e:
+        response = httpcache.get_json(url)
+    except httpx.HTTPError as e:
         if config.debug:
             print(e)
         return None
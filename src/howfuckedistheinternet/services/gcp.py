@@ -2,26 +2,29 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 import config
-import requests
-import ujson
+import breaker
+import httpcache
 
 
 def fetch_gcp():
     """Grabs the latest published incidents for GCP
     Filters for high severity service impacting incidents and for currently impacted regions
     If the regions list returns empty, then all listed incidents have been resolved so ignore it
-    build a results dict keyed on service name containing a list of regions"""
+    build a results dict keyed on service name containing a list of regions
+    Returns None if the incidents couldn't be fetched"""
 
     url = "https://status.cloud.google.com/incidents.json"
 
     gcp_results = {}
 
     try:
-        results = ujson.loads(requests.get(url, headers=config.headers, timeout=60).text)
+        results = httpcache.get_json(url)
+    except breaker.SourceUnavailable:
+        raise
     except:
         if config.debug:
             print(f"failed to fetch GCP Incidents from {url}")
-        return gcp_results
+        return None
 
     for inc in results:
         if (
@@ -2,8 +2,8 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 import config
-import requests
-import ujson
+import breaker
+import httpcache
 import math
 
 
@@ -15,7 +15,9 @@ def fetch_rpki_roa():
     total_roa = {}
 
     try:
-        results = ujson.loads(requests.get(url, headers=config.headers, timeout=60).text)
+        results = httpcache.get_json(url)
+    except breaker.SourceUnavailable:
+        raise
     except:
         if config.debug:
             print(f"failed to fetch {url}")
@@ -38,23 +40,20 @@ def check_rpki_totals(total_roa, rpki_total_roa_history):
 
     fucked_reasons = []
 
-    for repo in total_roa:
-        if repo in rpki_total_roa_history:
-            rpki_total_roa_history[repo].insert(0, total_roa.get(repo))
-            if len(rpki_total_roa_history) > config.max_history:
-                zz = rpki_total_roa_history[repo].pop()
-        else:
-            rpki_total_roa_history[repo] = [total_roa.get(repo)]
+    for repo, total in total_roa.items():
+        rpki_total_roa_history.append(repo, total)
+    rpki_total_roa_history.retire_missing(total_roa)
+    rpki_total_roa_history.end_cycle()
 
-    for repo, totals in rpki_total_roa_history.items():
-        avg = int(sum(totals) / len(totals))
+    for repo, latest, avg in rpki_total_roa_history.items():
+        avg = int(avg)
         try:
-            percentage = (totals[0] / avg) * 100
+            percentage = (latest / avg) * 100
         except ZeroDivisionError:
             percentage = 100
         if (100 - percentage) > config.metrics["total_roa"].get("threshold"):
             reason = f"[RPKI] {repo} has decreased published ROAs by {percentage}, " \
-                     f"from an average of {avg} to {totals[0]}"
+                     f"from an average of {avg} to {latest}"
             fucked_reasons.append(reason)
             if config.debug:
                 print(reason)
@@ -69,19 +68,15 @@ def check_rpki_invalids(invalid_roa, rpki_invalids_history):
 
     fucked_reasons = []
 
-    for repo in invalid_roa:
-        if repo in rpki_invalids_history:
-            rpki_invalids_history[repo].insert(0, invalid_roa.get(repo))
-            if len(rpki_invalids_history) > config.max_history:
-                zz = rpki_invalids_history[repo].pop()
-        else:
-            rpki_invalids_history[repo] = [invalid_roa.get(repo)]
-
-    for repo, invalids in rpki_invalids_history.items():
-        avg = sum(invalids) / len(invalids)
-        if invalids[0] > avg:
+    for repo, invalids in invalid_roa.items():
+        rpki_invalids_history.append(repo, invalids)
+    rpki_invalids_history.retire_missing(invalid_roa)
+    rpki_invalids_history.end_cycle()
+
+    for repo, latest, avg in rpki_invalids_history.items():
+        if latest > avg:
             reason = (
-                f"[RPKI] {invalids[0]} ROAs from {repo} have invalid routes being advertised to the DFZ, more than "
+                f"[RPKI] {latest} ROAs from {repo} have invalid routes being advertised to the DFZ, more than "
                 f"the {((config.max_history * config.update_frequency) / 60 ) / 60}hrs average of {math.floor(avg)}"
             )
             fucked_reasons.append(reason)
@@ -0,0 +1,126 @@
+import gzip
+
+import pytest
+import ujson
+
+from howfuckedistheinternet import api, db
+
+
+@pytest.fixture
+def connection(tmp_path):
+    connection = db.connect(str(tmp_path / "howfucked.db"))
+    db.init_metrics(connection, [("slack", "Slack incidents", 1, 60, None), ("dfz", "DFZ size", 3, 1800, None)])
+    db.publish(
+        connection,
+        ("The Internet is just a little bit fucked", "2026-10-17 12:00:00Z", "5", 1300, 4),
+        [
+            (
+                "[Slack] <a href=\"https://status.slack.com/1\">Messages &amp; files</a> - degraded (stale, from 3 mins ago)",
+                "slack",
+                1,
+            ),
+            ("[DFZ] IPv4 DFZ has decreased by 2.0%", "dfz", 3),
+        ],
+        [("ok", "dfz"), ("stale", "slack")],
+        [(1000 + i * 60, "score.weighted", float(i)) for i in range(10)],
+    )
+    yield connection
+    connection.close()
+
+
+def get(app, path, query="", **environ):
+    response = {}
+
+    def start_response(status, headers):
+        response["status"] = status
+        response["headers"] = dict(headers)
+
+    environ.update(PATH_INFO=path, QUERY_STRING=query)
+    body = b"".join(app(environ, start_response))
+    return response["status"], response["headers"], body
+
+
+def test_parse_reason():
+    reason = api.parse_reason(
+        "[Prefixes] <a href='https://bgp.tools/as/64500#prefixes'>AS64500</a> has withdrawn 90% of its prefixes",
+        "prefixes",
+        0.2,
+    )
+    assert reason["tag"] == "Prefixes"
+    assert reason["text"] == "AS64500 has withdrawn 90% of its prefixes"
+    assert reason["links"] == [{"text": "AS64500", "url": "https://bgp.tools/as/64500#prefixes"}]
+    assert reason["stale_mins"] is None
+
+
+def test_status(connection, tmp_path):
+    app = api.API(str(tmp_path / "howfucked.db"), clock=lambda: 1000)
+    status, headers, body = get(app, "/status")
+    assert status == "200 OK"
+    assert headers["Cache-Control"] == "public, max-age=300"
+
+    document = ujson.loads(body)
+    assert (document["status"], document["score"], document["next"]) == ("The Internet is just a little bit fucked", 4, 1300)
+    dfz, slack = document["metrics"]
+    assert (dfz["metric"], dfz["last"], dfz["reasons"][0]["tag"]) == ("dfz", "ok", "DFZ")
+    assert slack["reasons"][0]["text"] == "Messages & files - degraded"
+    assert slack["reasons"][0]["links"] == [{"text": "Messages & files", "url": "https://status.slack.com/1"}]
+    assert slack["reasons"][0]["stale_mins"] == 3
+
+
+def test_snapshots_gzip_and_etags(connection, tmp_path, monkeypatch):
+    app = api.API(str(tmp_path / "howfucked.db"), clock=lambda: 1000)
+    _, headers, body = get(app, "/status")
+    _, gzip_headers, gzip_body = get(app, "/status", HTTP_ACCEPT_ENCODING="br, gzip;q=0.8")
+    assert gzip_headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(gzip_body) == body
+    assert headers["ETag"] != gzip_headers["ETag"]
+    assert "Content-Encoding" not in get(app, "/status", HTTP_ACCEPT_ENCODING="gzip;q=0")[1]
+
+    # Served from the snapshot until the status changes
+    monkeypatch.setattr(api, "status_document", None)
+    status, _, body = get(app, "/status", HTTP_IF_NONE_MATCH=headers["ETag"])
+    assert (status, body) == ("304 Not Modified", b"")
+    monkeypatch.undo()
+
+    db.publish(connection, ("The Internet is fucked no more than usual", "2026-10-17 12:01:00Z", "1", None, 0), [], [])
+    status, headers, body = get(app, "/status", HTTP_IF_NONE_MATCH=headers["ETag"])
+    assert status == "200 OK"
+    assert ujson.loads(body)["score"] == 0
+
+
+def test_publishes_in_the_same_second(connection, tmp_path):
+    app = api.API(str(tmp_path / "howfucked.db"), clock=lambda: 2000)
+    _, headers, _ = get(app, "/status")
+    _, history_headers, _ = get(app, "/history", "series=score.weighted&start=0&end=5000")
+
+    db.publish(
+        connection,
+        ("The Internet is totally fucked", "2026-10-17 12:00:00Z", "5", 1300, 55),
+        [],
+        [],
+        [(1900, "score.weighted", 55.0)],
+    )
+    status, _, body = get(app, "/status", HTTP_IF_NONE_MATCH=headers["ETag"])
+    assert status == "200 OK"
+    assert ujson.loads(body)["score"] == 55
+    status, _, body = get(app, "/history", "series=score.weighted&start=0&end=5000", HTTP_IF_NONE_MATCH=history_headers["ETag"])
+    assert status == "200 OK"
+    assert ujson.loads(body)["points"][-1] == [1900, 55, 55, 55]
+
+
+def test_history(connection, tmp_path):
+    app = api.API(str(tmp_path / "howfucked.db"), clock=lambda: 2000)
+    status, _, body = get(app, "/history", "series=score.weighted&start=1060&end=1240")
+    assert status == "200 OK"
+    assert ujson.loads(body)["points"] == [[1060, 1, 1, 1], [1120, 2, 2, 2], [1180, 3, 3, 3]]
+
+    document = ujson.loads(get(app, "/history", "series=score.weighted")[2])
+    assert (document["end"], len(document["points"])) == (None, 10)
+
+    assert get(app, "/history", "series=score.weighted&resolution=weekly")[0] == "400 Bad Request"
+    assert get(app, "/history", "start=1")[0] == "400 Bad Request"
+    assert get(app, "/nope")[0] == "404 Not Found"
+
+
+def test_unreadable_db(tmp_path):
+    assert get(api.API(str(tmp_path / "missing.db")), "/status")[0] == "503 Service Unavailable"
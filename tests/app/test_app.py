@@ -0,0 +1,74 @@
+import importlib.util
+import os
+import shutil
+
+import pytest
+
+from howfuckedistheinternet import db
+
+html = os.path.join(os.path.dirname(__file__), "../../html")
+spec = importlib.util.spec_from_file_location("app", os.path.join(html, "app.py"))
+assert spec is not None and spec.loader is not None
+app = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(app)
+
+
+@pytest.fixture
+def connection(tmp_path):
+    shutil.copy(os.path.join(html, "index.j2"), tmp_path / "index.j2")
+    connection = db.connect(str(tmp_path / "howfucked.db"))
+    db.init_metrics(connection, [("dfz", "DFZ size", 3, 1800, None)])
+    db.publish(connection, ("The Internet is rather fucked", "2026-10-17 12:00:00Z", "5", 1300, None), [("[DFZ] x", "dfz", 3)], [])
+    yield connection
+    connection.close()
+
+
+def get(page, **environ):
+    response = {}
+
+    def start_response(status, headers):
+        response["status"] = status
+        response["headers"] = dict(headers)
+
+    body = b"".join(page(environ, start_response))
+    return response["status"], response["headers"], body
+
+
+def test_caches_until_the_status_changes(connection, tmp_path, monkeypatch):
+    page = app.StatusPage(str(tmp_path) + "/", clock=lambda: 1000)
+    status, headers, body = get(page)
+    assert status == "200 OK"
+    assert b"<h1>The Internet is rather fucked</h1>" in body
+    assert headers["Cache-Control"] == "public, max-age=300"
+    etag = headers["ETag"]
+
+    # Same status, nothing rendered
+    monkeypatch.setattr(page.environment, "get_template", None)
+    assert get(page)[2] == body
+    status, headers, body = get(page, HTTP_IF_NONE_MATCH=f'"other", W/{etag}')
+    assert (status, headers["ETag"], body) == ("304 Not Modified", etag, b"")
+    monkeypatch.undo()
+
+    db.publish(connection, ("The Internet is fucked no more than usual", "2026-10-17 12:01:00Z", "1", None, None), [], [])
+    status, headers, body = get(page, HTTP_IF_NONE_MATCH=etag)
+    assert status == "200 OK"
+    assert headers["ETag"] != etag
+    assert headers["Cache-Control"] == f"public, max-age={app.default_max_age}"
+    assert b"fucked no more than usual" in body
+
+
+def test_publishes_in_the_same_second(connection, tmp_path):
+    page = app.StatusPage(str(tmp_path) + "/", clock=lambda: 1000)
+    _, headers, body = get(page)
+    assert b"rather fucked" in body
+
+    db.publish(connection, ("The Internet is totally fucked", "2026-10-17 12:00:00Z", "5", 1300, None), [], [])
+    status, new_headers, body = get(page, HTTP_IF_NONE_MATCH=headers["ETag"])
+    assert status == "200 OK"
+    assert new_headers["ETag"] != headers["ETag"]
+    assert b"<h1>The Internet is totally fucked</h1>" in body
+
+
+def test_unreadable_db(tmp_path):
+    page = app.StatusPage(str(tmp_path) + "/")
+    assert get(page)[0] == "503 Service Unavailable"
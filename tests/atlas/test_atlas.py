@@ -0,0 +1,154 @@
+import http.server
+import os
+import re
+import subprocess
+import sys
+import time
+
+import pytest
+import ujson
+
+from howfuckedistheinternet.services import atlas
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        msm_id = int(re.match(r"/(\d+)/latest/", self.path).group(1))
+        if msm_id == 404:
+            body = b'{"error": "not found"}'
+            self.send_response(404)
+        else:
+            # Each measurement takes a while, so doing them one after another would be slow
+            time.sleep(0.2)
+            body = ujson.dumps([{"prb_id": 1, "error": "timeout"}, {"prb_id": msm_id}]).encode()
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server(serve, tmp_path, monkeypatch):
+    monkeypatch.setattr(atlas.config, "http_cache_dir", str(tmp_path))
+    monkeypatch.setattr(atlas, "base_url", serve(Handler) + "/")
+
+
+def test_fetch_atlas_measurements(server):
+    msm_ids = atlas.atlas_measurement_ids(["dns_root"])
+    assert len(msm_ids) == 24
+
+    before = time.monotonic()
+    measurements = atlas.fetch_atlas_measurements(msm_ids + [404])
+    assert time.monotonic() - before < 0.2 * len(msm_ids) / 2
+
+    assert measurements[404] is None
+    assert measurements[10509] == [{"prb_id": 1, "error": "timeout"}, {"prb_id": 10509}]
+
+    v6_roots_failed, v4_roots_failed = atlas.fetch_root_dns(measurements)
+    assert v6_roots_failed["a.root-servers.net"] == {"total": 2, "failed": [1]}
+    assert len(v4_roots_failed) == 13
+
+
+def test_validate_tls_chains_is_cached(monkeypatch):
+    validated = []
+
+    class Validator:
+        def __init__(self, end_cert, intermediate_certs=None):
+            self.end_cert = end_cert
+
+        def validate_tls(self, hostname):
+            validated.append((hostname, self.end_cert))
+            if self.end_cert == b"bad":
+                raise atlas.errors.PathValidationError("nope")
+
+    monkeypatch.setattr(atlas, "CertificateValidator", Validator)
+    monkeypatch.setattr(atlas, "_tls_validation_cache", atlas.OrderedDict())
+    monkeypatch.setattr(atlas, "_chain_expiry", lambda chain, now: now + 60)
+    monkeypatch.setattr(atlas.config, "tls_cache_size", 2)
+
+    def validate(server, certs):
+        chain = atlas.normalise_chain(certs)
+        key = atlas.chain_key(server, chain)
+        return atlas.validate_tls_chains({key: (server, chain)})[key]
+
+    for _ in range(3):
+        assert validate("www.example.com", ["good", "inter\\/mediate"]) == (True, None)
+        assert validate("www.example.com", ["bad"]) == (False, "PathValidationError")
+    assert validated == [("www.example.com", b"good"), ("www.example.com", b"bad")]
+
+    # The same chain for a different hostname is validated separately, pushing out the oldest result
+    validate("www.example.net", ["good"])
+    validate("www.example.com", ["good", "inter\\/mediate"])
+    assert len(validated) == 4
+
+    # Results expire along with the chain
+    monkeypatch.setattr(atlas, "_chain_expiry", lambda chain, now: now - 1)
+    atlas._tls_validation_cache.clear()
+    validate("www.example.com", ["bad"])
+    validate("www.example.com", ["bad"])
+    assert len(validated) == 6
+
+
+POOL_SCRIPT = """
+import sys
+sys.path.insert(0, {package!r})
+import config
+import services
+import ujson
+
+config.tls_workers = 2
+config.tls_batch_size = 1
+
+with open({cert!r}, "rb") as f:
+    cert = f.read()
+chains = {{
+    i: (server, chain)
+    for i, (server, chain) in enumerate([("www.example.com", [cert]), ("www.example.com", [b"garbage"])])
+}}
+
+if __name__ == "__main__":
+    outcomes = services.validate_tls_chains(chains)
+    pool = services.atlas._tls_pool
+    workers = list(pool._processes.values())
+    services.shutdown_tls_pool()
+    print(ujson.dumps({{
+        "outcomes": [outcomes[i] for i in range(len(chains))],
+        "workers": len(workers),
+        "alive": [worker.is_alive() for worker in workers],
+        "shut down": services.atlas._tls_pool is None,
+    }}))
+"""
+
+
+def test_validate_tls_chains_in_process_pool(tmp_path):
+    """Validates through spawned processes, importing the services the way main does"""
+
+    package = os.path.join(os.path.dirname(__file__), "../../src/howfuckedistheinternet")
+    script = tmp_path / "validate.py"
+    cert = os.path.join(os.path.dirname(__file__), "self_signed.pem")
+    script.write_text(POOL_SCRIPT.format(package=os.path.abspath(package), cert=cert))
+
+    run = subprocess.run([sys.executable, str(script)], cwd=tmp_path, capture_output=True, text=True, timeout=120)
+    assert run.returncode == 0, run.stderr
+    result = ujson.loads(run.stdout.splitlines()[-1])
+
+    # Self signed, so untrusted, and the garbage can't be validated at all
+    assert result["outcomes"] == [[False, "InvalidCertificateError"], [None, None]]
+    assert result["workers"] >= 1
+    assert not any(result["alive"])
+    assert result["shut down"]
+
+
+def test_fetch_tls_certs(monkeypatch):
+    monkeypatch.setattr(atlas, "_tls_validation_cache", atlas.OrderedDict())
+    monkeypatch.setattr(atlas.config, "tls_workers", 1)
+    monkeypatch.setattr(
+        atlas, "_validate_chain", lambda server, chain: (chain[0] == b"good", None if chain[0] == b"good" else "Err", 2e9)
+    )
+    measurements = {
+        62517823: [{"prb_id": 1, "cert": ["good"]}, {"prb_id": 2, "cert": ["bad"]}, {"prb_id": 3}],
+        62517825: [{"prb_id": 4, "cert": ["good"]}],
+    }
+    v6_https, v4_https = atlas.fetch_tls_certs(measurements)
+    assert v6_https == {"www.youtube.com": {"passed": [1], "failed": [3, 2]}}
+    assert v4_https == {"www.youtube.com": {"passed": [4], "failed": []}}
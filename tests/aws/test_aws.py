@@ -0,0 +1,166 @@
+import http.server
+import socket
+import time
+
+import pytest
+import ujson
+
+from howfuckedistheinternet import history
+from howfuckedistheinternet.services import aws
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    requests: list[str] = []
+
+    def do_HEAD(self):
+        self.requests.append(self.path)
+        time.sleep(0.2)
+        self.send_response(404 if self.path.startswith("/missing") else 200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+@pytest.fixture
+def base_url(serve):
+    return serve(Handler)
+
+
+def test_fetch_aws(base_url, tmp_path, monkeypatch):
+    monkeypatch.setattr(aws.config, "aws_connect_timeout", 1)
+    monkeypatch.setattr(aws.config, "aws_read_timeout", 1)
+    monkeypatch.setattr(aws.config, "aws_sample_size", None)
+
+    # Nothing listening here
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        dead_url = f"http://127.0.0.1:{s.getsockname()[1]}/green-icon.gif"
+
+    urls = {
+        "us-east-1": [f"{base_url}/{i}/green-icon.gif" for i in range(20)],
+        "eu-west-1": [f"{base_url}/green-icon.gif", f"{base_url}/missing/green-icon.gif", dead_url],
+        "empty-1": [],
+    }
+    urls_file = tmp_path / "checkpoints.json"
+    urls_file.write_text(ujson.dumps(urls))
+
+    before = time.monotonic()
+    results, latency = aws.fetch_aws(str(urls_file))
+    assert time.monotonic() - before < 0.2 * 23 / 2
+
+    assert results == {"us-east-1": [True] * 20, "eu-west-1": [True, False, False], "empty-1": []}
+    assert aws.check_aws(results, 4) == ["[AWS] eu-west-1 66.7% of connectivity checks over IPv4 failed"]
+
+    # Every check has to wait at least 200ms for a response, and only successful ones count
+    assert len(latency["us-east-1"]["total"]) == 20
+    assert len(latency["eu-west-1"]["total"]) == 1
+    assert 200 <= latency["us-east-1"]["total"].quantile(0.5) < 1000
+    assert 1 <= len(latency["us-east-1"]["connect"]) <= 20
+    assert latency["empty-1"]["total"].quantile(0.5) is None
+
+
+def test_fetch_aws_sampled(base_url, tmp_path, monkeypatch):
+    monkeypatch.setattr(aws.config, "aws_sample_size", 2)
+    # Loose enough that two clean checks are conclusive
+    monkeypatch.setattr(aws.config, "aws_sample_z", 1.0)
+    monkeypatch.setitem(aws.config.metrics["aws"], "threshold", 40)
+    monkeypatch.setattr(aws.random, "sample", lambda urls, k: list(urls))
+    monkeypatch.setattr(Handler, "requests", [])
+
+    urls = {
+        "healthy-1": [f"{base_url}/{i}/green-icon.gif" for i in range(20)],
+        "flaky-1": [f"{base_url}/green-icon.gif", f"{base_url}/missing/green-icon.gif"]
+        + [f"{base_url}/{i}/green-icon.gif" for i in range(18)],
+        "down-1": [f"{base_url}/missing/{i}/green-icon.gif" for i in range(20)],
+        "small-1": [f"{base_url}/green-icon.gif", f"{base_url}/missing/green-icon.gif"],
+    }
+    urls_file = tmp_path / "checkpoints.json"
+    urls_file.write_text(ujson.dumps(urls))
+
+    results, stats = aws.fetch_aws(str(urls_file))
+    assert len(Handler.requests) == 2 + 20 + 2 + 2
+
+    # A clean sample is under the threshold, but one failure out of two could be either side of it
+    assert results["healthy-1"] == [True, True]
+    assert stats["healthy-1"]["sampled"] and stats["healthy-1"]["checkpoints"] == 20
+    assert results["flaky-1"].count(False) == 1 and len(results["flaky-1"]) == 20
+    assert not stats["flaky-1"]["sampled"]
+
+    # Two failures are definitely over it
+    assert results["down-1"] == [False, False]
+    assert stats["down-1"]["sampled"]
+    lower, upper = stats["down-1"]["ci"]
+    assert 0.4 < lower < upper == 1
+
+    assert aws.check_aws(results, 4, stats) == [
+        f"[AWS] down-1 100.0% of connectivity checks over IPv4 failed (sampled 2 of 20, "
+        f"{round(lower * 100, 1)}-100.0% confidence interval)",
+        "[AWS] small-1 50.0% of connectivity checks over IPv4 failed",
+    ]
+
+
+@pytest.mark.parametrize("failing, size, sampled", [
+    # At 10% and 95% it takes 35 clean checks to settle it, so smaller regions are probed in full
+    (False, 35, False),
+    (True, 35, False),
+    (False, 50, True),
+    (True, 50, True),
+])
+def test_fetch_aws_sample_size(base_url, tmp_path, monkeypatch, failing, size, sampled):
+    monkeypatch.setattr(aws.config, "aws_sample_size", 2)
+    monkeypatch.setattr(aws.random, "sample", lambda urls, k: list(urls))
+
+    prefix = "missing/" if failing else ""
+    urls_file = tmp_path / "checkpoints.json"
+    urls_file.write_text(ujson.dumps({"region-1": [f"{base_url}/{prefix}{i}/green-icon.gif" for i in range(size)]}))
+
+    results, stats = aws.fetch_aws(str(urls_file))
+    assert stats["region-1"]["sampled"] == sampled
+    assert len(results["region-1"]) == (35 if sampled else size)
+
+
+@pytest.mark.parametrize("threshold, z", [(10, 1.96), (25, 1.96), (5, 2.58), (40, 1.0)])
+def test_clean_sample_size(threshold, z):
+    n = aws.clean_sample_size(threshold, z)
+    assert aws.wilson_interval(0, n, z)[1] * 100 < threshold <= aws.wilson_interval(0, n - 1, z)[1] * 100
+
+
+def test_wilson_interval():
+    assert aws.wilson_interval(0, 0) == (0, 1)
+    lower, upper = aws.wilson_interval(0, 2)
+    assert lower == 0 and 0.6 < upper < 0.7
+    lower, upper = aws.wilson_interval(50, 100)
+    assert 0.4 < lower < 0.5 < upper < 0.6
+
+
+def test_latency_histogram():
+    latency = aws.LatencyHistogram()
+    assert len(latency) == 0
+    for ms in (0.1, 10, 11, 12, 500, 10 ** 6):
+        latency.add(ms)
+    assert len(latency) == 6
+    assert latency.quantile(0) == 1
+    assert 11 <= latency.quantile(0.5) < 11 * 2 ** 0.25
+    assert latency.quantile(1) == aws.latency_buckets[-1]
+
+
+def test_check_aws_latency(monkeypatch):
+    monkeypatch.setattr(aws.config, "max_history", 4)
+    hist = history.HistoryStore(4, 2)
+
+    def latency(**regions):
+        result = {}
+        for region, ms in regions.items():
+            result[region] = {"connect": aws.LatencyHistogram(), "total": aws.LatencyHistogram()}
+            for _ in range(3):
+                result[region]["total"].add(ms)
+        return result
+
+    for _ in range(3):
+        reasons, hist = aws.check_aws_latency(latency(**{"us-east-1": 100}), latency(**{"us-east-1": 50}), hist)
+        assert reasons == []
+
+    reasons, hist = aws.check_aws_latency(latency(**{"us-east-1": 400}), {}, hist)
+    assert len(reasons) == 1
+    assert reasons[0].startswith("[AWS] us-east-1 median latency over IPv6 has increased by")
+    assert "us-east-1 IPv4" in hist
+    assert list(key for key, _, _ in hist.items()) == ["us-east-1 IPv6"]
@@ -0,0 +1,191 @@
+import httpx
+import pytest
+import ujson
+
+from howfuckedistheinternet import history
+from howfuckedistheinternet.services import bgp_tools
+
+ROUTES = [
+    {"CIDR": "192.0.2.0/24", "ASN": 64500, "Hits": 900},
+    {"CIDR": "2001:db8::/32", "ASN": 65001, "Hits": 1000},
+    {"CIDR": "198.51.100.0/24", "ASN": 13335, "Hits": 1200},
+    {"CIDR": "192.0.2.0/24", "ASN": 13335, "Hits": 5},
+    {"CIDR": "203.0.113.0/24", "ASN": 13335, "Hits": 1100},
+]
+
+
+@pytest.fixture
+def bgp_table():
+    return bgp_tools.build_bgp_table(ROUTES)
+
+
+def test_table_aggregates(bgp_table):
+    assert len(bgp_table) == 5
+    assert bgp_table.prefixes == ["192.0.2.0/24", "2001:db8::/32", "198.51.100.0/24", "203.0.113.0/24"]
+    assert list(bgp_table.origin_counts) == [2, 1, 1, 1]
+    assert bgp_table.asn_prefix_counts == {64500: 1, 65001: 1, 13335: 3}
+    assert (bgp_table.v4_dfz_count, bgp_table.v6_dfz_count) == (3, 1)
+    assert bgp_table.bogon_asns == {64500: ("bogon", "RFC 5398 documentation"), 65001: ("private", "RFC 6996 private")}
+    assert bgp_table.bogon_routes == [0, 1]
+
+
+def test_table_indexes(bgp_table):
+    pfx_id = bgp_table.prefix_ids["192.0.2.0/24"]
+    assert sorted(bgp_table.route_asn[r] for r in bgp_table.routes_for_prefix(pfx_id)) == [13335, 64500]
+
+    assert list(bgp_table.asns) == [13335, 64500, 65001]
+    assert sorted(bgp_table.route_pfx[r] for r in bgp_table.routes_for_asn(0)) == [0, 2, 3]
+
+
+def test_empty_table():
+    bgp_table = bgp_tools.build_bgp_table([])
+    assert len(bgp_table) == 0
+    assert bgp_tools.check_bogon_asns(bgp_table) == []
+
+
+def stream(fresh, error=None):
+    """A stand-in for httpcache.stream_lines serving ROUTES as table.jsonl, then raising error if given"""
+
+    def stream_lines(url, **kwargs):
+        def lines():
+            for route in ROUTES:
+                yield ujson.dumps(route).encode()
+            yield b""
+            if error:
+                raise error
+        return fresh, lines()
+    return stream_lines
+
+
+def test_fetch_bgp_table(monkeypatch, bgp_table):
+    monkeypatch.setattr(bgp_tools.httpcache, "stream_lines", stream(True))
+    table = bgp_tools.fetch_bgp_table()
+    assert len(table) == 5
+    assert table.prefixes == bgp_table.prefixes
+    assert table.asn_prefix_counts == bgp_table.asn_prefix_counts
+
+    # Nothing new since last time hands back the previous table with nothing changed
+    monkeypatch.setattr(bgp_tools.httpcache, "stream_lines", stream(False))
+    assert bgp_tools.fetch_bgp_table(table) is table
+    assert len(table.diff) == 0
+
+
+def test_fetch_bgp_table_truncated(monkeypatch):
+    # A download that fails part way through is thrown away rather than looking like a DFZ collapse
+    monkeypatch.setattr(bgp_tools.httpcache, "stream_lines", stream(True, httpx.ReadError("connection reset")))
+    assert len(bgp_tools.fetch_bgp_table()) == 0
+
+
+def test_classify_asns():
+    asns = [0, 1, 13335, 23456, 64511, 64512, 65535, 65551, 131071, 131072, 4199999999, 4200000000, 4294967295]
+    assert bgp_tools.classify_asns(asns) == {
+        0: ("bogon", "RFC 7607"),
+        23456: ("bogon", "RFC 4893 AS_TRANS"),
+        64511: ("bogon", "RFC 5398 documentation"),
+        64512: ("private", "RFC 6996 private"),
+        65535: ("bogon", "RFC 7300 last 16 bit"),
+        65551: ("bogon", "RFC 5398 documentation"),
+        131071: ("bogon", "IANA reserved"),
+        4200000000: ("private", "RFC 6996 private"),
+        4294967295: ("bogon", "RFC 7300 last 32 bit"),
+    }
+
+
+def test_check_bogon_asns(bgp_table):
+    reasons = bgp_tools.check_bogon_asns(bgp_table)
+    assert len(reasons) == 2
+    assert "bogon AS64500" in reasons[0]
+    assert "private AS65001" in reasons[1]
+
+
+def test_check_bgp_prefixes(bgp_table):
+    num_prefixes_history = history.HistoryStore(4, 48)
+    for _ in range(3):
+        num_prefixes_history.append(13335, 30)
+    num_prefixes_history.append(1, 10)
+    reasons, num_prefixes_history = bgp_tools.check_bgp_prefixes(bgp_table, num_prefixes_history)
+    assert num_prefixes_history.samples(13335) == [3, 30, 30, 30]
+    assert len(reasons) == 1
+    assert "AS13335" in reasons[0]
+    # AS1 has disappeared from the table, so it's retired rather than checked
+    assert 1 not in [asn for asn, _, _ in num_prefixes_history.items()]
+
+
+def test_check_dfz(bgp_table):
+    num_dfz_routes_history = history.HistoryStore(4, 48)
+    reasons, num_dfz_routes_history = bgp_tools.check_dfz(bgp_table, num_dfz_routes_history)
+    assert reasons == []
+    assert num_dfz_routes_history.samples("v6") == [1]
+    assert num_dfz_routes_history.samples("v4") == [3]
+
+
+def test_diff_bgp_tables(bgp_table):
+    routes = [
+        {"CIDR": "192.0.2.0/24", "ASN": 64500, "Hits": 900},
+        {"CIDR": "2001:db8::/32", "ASN": 65001, "Hits": 1001},
+        {"CIDR": "198.51.100.0/24", "ASN": 13335, "Hits": 1200},
+        {"CIDR": "198.51.100.0/24", "ASN": 64501, "Hits": 20},
+        {"CIDR": "192.0.2.0/24", "ASN": 13335, "Hits": 5},
+        {"CIDR": "100.64.0.0/10", "ASN": 13335, "Hits": 1100},
+    ]
+    diff = bgp_tools.diff_bgp_tables(bgp_table, bgp_tools.build_bgp_table(routes))
+    assert diff.added == ["100.64.0.0/10"]
+    assert diff.removed == ["203.0.113.0/24"]
+    assert diff.origins_changed == ["198.51.100.0/24"]
+    assert diff.hits_changed == ["2001:db8::/32"]
+    assert sorted(diff.asns_changed) == [64501]
+    assert diff.asns_removed == []
+    assert len(diff) == 4
+
+
+def test_incremental_checks_match_full(bgp_table):
+    """Checking only what changed should end up with the same history and reasons as checking everything"""
+
+    tables = [bgp_table]
+    for i in range(6):
+        routes = ROUTES[: 3 + i % 3] + [{"CIDR": f"10.{n}.0.0/16", "ASN": 64496 + n, "Hits": 200} for n in range(i)]
+        tables.append(bgp_tools.build_bgp_table(routes))
+
+    full_origins, full_prefixes = history.HistoryStore(4, 48), history.HistoryStore(4, 48)
+    incremental_origins, incremental_prefixes = history.HistoryStore(4, 48), history.HistoryStore(4, 48)
+    previous = None
+    for table in tables:
+        full_reasons, _ = bgp_tools.check_bgp_origins(table, full_origins)
+        full_reasons += bgp_tools.check_bgp_prefixes(table, full_prefixes)[0]
+
+        if previous is not None:
+            table.diff = bgp_tools.diff_bgp_tables(previous, table)
+        incremental_reasons, _ = bgp_tools.check_bgp_origins(table, incremental_origins)
+        incremental_reasons += bgp_tools.check_bgp_prefixes(table, incremental_prefixes)[0]
+        previous = table
+
+        assert sorted(full_reasons) == sorted(incremental_reasons)
+        assert sorted(full_origins.items()) == sorted(incremental_origins.items())
+        assert sorted(full_prefixes.items()) == sorted(incremental_prefixes.items())
+
+
+def origins(*asns):
+    return [{"CIDR": "198.51.100.0/24", "ASN": asn, "Hits": 100} for asn in asns]
+
+
+@pytest.mark.parametrize("before, after", [
+    # AS0 hashed to nothing with a linear fingerprint
+    (origins(13335), origins(13335, 0)),
+    # As did different origins whose sums cancel out
+    (origins(100, 200), origins(101, 199)),
+])
+def test_origin_changes_are_never_missed(before, after):
+    tables = [bgp_tools.build_bgp_table(before) for _ in range(4)] + [bgp_tools.build_bgp_table(after)]
+
+    full, incremental = history.HistoryStore(4, 48), history.HistoryStore(4, 48)
+    previous = None
+    for table in tables:
+        full_reasons, _ = bgp_tools.check_bgp_origins(table, full)
+        if previous is not None:
+            table.diff = bgp_tools.diff_bgp_tables(previous, table)
+        incremental_reasons, _ = bgp_tools.check_bgp_origins(table, incremental)
+        previous = table
+
+    assert table.diff.origins_changed == ["198.51.100.0/24"]
+    assert sorted(incremental_reasons) == sorted(full_reasons)
+    assert sorted(incremental.items()) == sorted(full.items())
@@ -0,0 +1,156 @@
+import asyncio
+import email.utils
+import http.server
+import time
+
+import pytest
+import httpx
+
+from howfuckedistheinternet import breaker, httpcache, httpclient
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    monkeypatch.setattr(breaker.config, "breaker_failures", 3)
+    monkeypatch.setattr(breaker.config, "breaker_backoff", 60)
+    monkeypatch.setattr(breaker.config, "breaker_max_backoff", 200)
+
+
+def test_opens_after_consecutive_failures_and_backs_off(limits):
+    clock = Clock()
+    b = breaker.Breaker("bgp.tools", clock)
+
+    b.failure()
+    b.success()
+    b.failure()
+    b.failure()
+    assert b.state == breaker.CLOSED and b.allow()
+    b.failure()
+    assert b.state == breaker.OPEN and not b.allow()
+
+    # Only one trial request is let through once the backoff is up
+    clock.now += 60
+    assert b.state == breaker.HALF_OPEN and b.available()
+    assert b.allow()
+    assert not b.allow()
+
+    # A failed trial reopens it for twice as long, up to the max
+    b.failure()
+    clock.now += 119
+    assert b.state == breaker.OPEN
+    clock.now += 1
+    assert b.allow()
+    b.failure()
+    assert b.retry_at == clock.now + 200
+
+    clock.now += 200
+    assert b.allow()
+    b.success()
+    assert b.state == breaker.CLOSED and b.allow() and b.allow()
+
+
+def test_failures_in_flight_when_it_opens(limits):
+    clock = Clock()
+    b = breaker.Breaker("atlas.ripe.net", clock)
+
+    # A burst of concurrent requests that all fail only opens it once
+    for _ in range(16):
+        b.failure()
+    assert b.state == breaker.OPEN
+    assert b.failures == 16
+    assert (b.trips, b.retry_at) == (1, clock.now + 60)
+
+    # And a failed trial backs off as if the rest never happened
+    clock.now += 60
+    assert b.allow()
+    b.failure()
+    assert (b.trips, b.retry_at) == (2, clock.now + 120)
+
+
+def test_opens_on_any_429(limits):
+    url = "http://rate-limited.example/api"
+    breaker.record(url, 429)
+    b = breaker.for_url(url)
+    assert b.state == breaker.OPEN
+    assert 59 < b.retry_at - time.time() <= 60
+
+    # Stragglers asking to retry later still get their way, without tripping it again
+    breaker.record(url, 429, "600")
+    assert b.trips == 1
+    assert 599 < b.retry_at - time.time() <= 600
+
+
+def test_retry_after(limits):
+    clock = Clock()
+    b = breaker.Breaker("atlas.ripe.net", clock)
+    b.failure(retry_after=600)
+    assert b.state == breaker.OPEN
+    assert b.retry_at == clock.now + 600
+
+    assert breaker.parse_retry_after("120") == 120
+    assert breaker.parse_retry_after("soon") is None
+    assert breaker.parse_retry_after(None) is None
+    later = email.utils.formatdate(time.time() + 300, usegmt=True)
+    assert 290 < breaker.parse_retry_after(later) <= 300
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    requests = 0
+
+    def do_GET(self):
+        Handler.requests += 1
+        self.send_response(503)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def test_get_json_fails_fast_once_open(limits, serve, tmp_path, monkeypatch):
+    monkeypatch.setattr(httpcache.config, "http_cache_dir", str(tmp_path))
+    base_url = serve(Handler)
+    url = f"{base_url}/status.json"
+    for _ in range(3):
+        with pytest.raises(httpx.HTTPStatusError):
+            httpcache.get_json(url)
+    with pytest.raises(breaker.SourceUnavailable) as e:
+        httpcache.get_json(url)
+    assert e.value.outcome == "source unavailable"
+    assert Handler.requests == 3
+    assert breaker.states()[base_url.removeprefix("http://")] == breaker.OPEN
+
+
+class SlowHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(1)
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def test_cancelled_trial_reopens(limits, serve):
+    url = f"{serve(SlowHandler)}/slow"
+    b = breaker.for_url(url)
+    for _ in range(3):
+        b.failure()
+    b.retry_at = time.time() - 1
+    assert b.state == breaker.HALF_OPEN
+
+    async def fetch():
+        async with httpclient.async_client() as client:
+            await asyncio.wait_for(client.get(url), 0.1)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(fetch())
+
+    # The trial failed, rather than being left in flight with the breaker open for good
+    assert b.state == breaker.OPEN
+    assert b.retry_at > time.time()
+    b.retry_at = time.time() - 1
+    assert b.state == breaker.HALF_OPEN
@@ -0,0 +1,40 @@
+import http.server
+import importlib
+import sys
+import threading
+
+import pytest
+
+# The checker imports its modules as top level ones from the package directory (see main.py). Make those the
+# same modules the tests import, rather than copies with their own breakers, clients and caches
+for name in ("config", "breaker", "httpclient", "httpcache", "resultcache"):
+    sys.modules.setdefault(name, importlib.import_module(f"howfuckedistheinternet.{name}"))
+
+
+class _Server(http.server.ThreadingHTTPServer):
+    # Tests often fetch everything at once
+    request_queue_size = 128
+
+
+@pytest.fixture
+def serve():
+    """Starts a local HTTP/1.1 server for the test with serve(handler), returning its base URL without a trailing /"""
+
+    servers = []
+
+    def serve(handler):
+        class Handler(handler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+        httpd = _Server(("127.0.0.1", 0), Handler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        servers.append(httpd)
+        return f"http://127.0.0.1:{httpd.server_port}"
+
+    yield serve
+    for httpd in servers:
+        httpd.shutdown()
+        httpd.server_close()
@@ -0,0 +1,151 @@
+import sqlite3
+
+import pytest
+
+from howfuckedistheinternet import db
+
+
+@pytest.fixture
+def connection(tmp_path):
+    connection = db.connect(str(tmp_path / "howfucked.db"))
+    db.init_metrics(connection, [("dfz", "DFZ size", 3, 1800, None), ("aws", "AWS", 4, 1800, None)])
+    yield connection
+    connection.close()
+
+
+def test_wal_mode(connection):
+    assert connection.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+
+
+def test_publish_replaces_everything_at_once(connection, tmp_path):
+    db.publish(
+        connection,
+        ("The Internet is rather fucked", "2026-10-17 12:00:00Z", "5", None, None),
+        [("[DFZ] IPv4 DFZ has decreased", "dfz", 3), ("[AWS] us-east-1 failed", "aws", 4)],
+        [("ok", "dfz"), ("timed out", "aws")],
+    )
+
+    # A reader mid-snapshot isn't disturbed by the next publish
+    reader = sqlite3.connect(str(tmp_path / "howfucked.db"))
+    reader.execute("BEGIN")
+    assert reader.execute("SELECT count(*) FROM reasons").fetchone() == (2,)
+
+    db.publish(
+        connection, ("The Internet is fucked no more than usual", "2026-10-17 12:01:00Z", "1", None, None), [], [("ok", "aws")]
+    )
+
+    assert reader.execute("SELECT status FROM status").fetchall() == [("The Internet is rather fucked",)]
+    assert reader.execute("SELECT count(*) FROM reasons").fetchone() == (2,)
+    reader.rollback()
+    assert reader.execute("SELECT status FROM status").fetchall() == [("The Internet is fucked no more than usual",)]
+    assert reader.execute("SELECT count(*) FROM reasons").fetchone() == (0,)
+    assert dict(reader.execute("SELECT metric, last FROM metrics")) == {"dfz": "ok", "aws": "ok"}
+    reader.close()
+
+
+def test_failed_publish_leaves_the_previous_one(connection):
+    db.publish(connection, ("The Internet is rather fucked", "2026-10-17 12:00:00Z", "5", None, None), [("[DFZ] x", "dfz", 3)], [])
+
+    with pytest.raises(sqlite3.Error):
+        db.publish(
+            connection, ("The Internet is fucked no more than usual", "2026-10-17 12:01:00Z", "1", None, None), [("bad",)], []
+        )
+
+    assert connection.execute("SELECT status FROM status").fetchall() == [("The Internet is rather fucked",)]
+    assert connection.execute("SELECT reason FROM reasons").fetchall() == [("[DFZ] x",)]
+
+
+def test_samples_are_appended_with_each_publish(connection):
+    samples = db.Samples(clock=lambda: 1000)
+    samples.add("dfz.v4", 950000)
+    samples.add("score.weighted", 12.5)
+    db.publish(connection, ("", "", "0", None, None), [], [], samples.drain())
+    assert samples.drain() == []
+
+    samples.add("dfz.v4", 950100)
+    db.publish(connection, ("", "", "0", None, None), [], [], samples.drain())
+
+    assert db.query(connection, "dfz.v4", 0, 2000) == [(1000, 950000, 950000, 950000), (1000, 950100, 950100, 950100)]
+    assert db.query(connection, "score.weighted", 0, 2000) == [(1000, 12.5, 12.5, 12.5)]
+
+
+def test_roll_up(connection):
+    hour, day = 3600, 86400
+    start = 100 * day
+    # Every 30 mins over three days
+    samples = [(start + i * 1800, "dfz.v4", float(i)) for i in range(144)]
+    db.publish(connection, ("", "", "0", None, None), [], [], samples)
+    now = start + 3 * day
+
+    # Raw samples older than a day become hourly, hours older than two days become daily
+    db.roll_up(connection, now, day, 2 * day, 30 * day)
+
+    raw = db.query(connection, "dfz.v4", 0, now)
+    hourly = db.query(connection, "dfz.v4", 0, now, "hourly")
+    daily = db.query(connection, "dfz.v4", 0, now, "daily")
+    assert [ts for ts, *_ in raw] == [ts for ts, _, _ in samples if ts >= start + 2 * day]
+    assert [ts for ts, *_ in hourly] == [start + day + i * hour for i in range(24)]
+    assert hourly[0] == (start + day, 48.5, 48, 49)
+    assert daily == [(start, 23.5, 0, 47)]
+
+    # Rolling up again changes nothing, and later samples for the same hour are merged in
+    db.roll_up(connection, now, day, 2 * day, 30 * day)
+    assert db.query(connection, "dfz.v4", 0, now, "hourly") == hourly
+    db.publish(connection, ("", "", "0", None, None), [], [], [(start + day + 60, "dfz.v4", 100.0)])
+    db.roll_up(connection, now, day, 2 * day, 30 * day)
+    assert db.query(connection, "dfz.v4", 0, now, "hourly")[0] == (start + day, 197 / 3, 48, 100)
+
+    # Daily aggregates past their retention are dropped
+    db.roll_up(connection, start + 40 * day, day, 2 * day, 30 * day)
+    assert db.query(connection, "dfz.v4", 0, now, "daily") == []
+    assert connection.execute("SELECT count(*) FROM samples").fetchone() == (0,)
+
+
+def test_migrates_status_from_before_next(tmp_path):
+    path = str(tmp_path / "old.db")
+    old = sqlite3.connect(path)
+    with old:
+        old.execute("CREATE TABLE status (status TEXT, timestamp TEXT, duration TEXT)")
+        old.execute("INSERT INTO status VALUES ('The Internet is fucked no more than usual', '2026-10-17 12:00:00Z', '1')")
+    old.close()
+
+    connection = db.connect(path)
+    assert connection.execute("SELECT * FROM status").fetchall() == [
+        ("The Internet is fucked no more than usual", "2026-10-17 12:00:00Z", "1", None, None, None)
+    ]
+    db.publish(connection, ("The Internet is rather fucked", "2026-10-17 12:01:00Z", "5", 1792238460, 30.5), [], [])
+    assert connection.execute("SELECT next, score, generation FROM status").fetchall() == [(1792238460, 30.5, 1)]
+    connection.close()
+
+
+def test_sparklines(connection):
+    sparklines = db.Sparklines(("score.weighted",), {"1h": (600, 6), "2h": (1800, 4)})
+    start = 1000 * 3600
+
+    def publish(ts, value):
+        db.publish(connection, ("", "", "0", None, value), [], [], [(ts, "score.weighted", value), (ts, "dfz.v4", 1.0)], sparklines)
+
+    # Every 5 mins for 3 hours
+    for i in range(36):
+        publish(start + i * 300, float(i))
+    now = start + 35 * 300
+
+    charts = db.sparklines(connection, now)
+    assert list(charts) == ["score.weighted"]
+    assert charts["score.weighted"]["1h"] == [24.5, 26.5, 28.5, 30.5, 32.5, 34.5]
+    assert charts["score.weighted"]["2h"] == [8.5, 14.5, 20.5, 26.5, 32.5][-4:]
+
+    # The rings don't grow, however long it runs
+    assert connection.execute("SELECT count(*) FROM sparklines").fetchone() == (10,)
+
+    # Points older than the window drop off, even if nothing has overwritten them
+    assert db.sparklines(connection, now + 3000)["score.weighted"]["1h"] == [34.5]
+
+
+def test_sparkline_window_order(connection):
+    sparklines = db.Sparklines(("score.weighted",), {"24h": (1800, 48), "7d": (4 * 3600, 42), "30d": (12 * 3600, 60)})
+    db.publish(connection, ("", "", "0", None, 1.0), [], [], [(1000, "score.weighted", 1.0)], sparklines)
+
+    # Not alphabetical, which would put 30d before 7d
+    assert list(db.sparklines(connection, 1000)["score.weighted"]) == ["24h", "7d", "30d"]
+    assert list(db.sparklines(connection, 1000, ["30d", "24h"])["score.weighted"]) == ["30d", "24h"]
@@ -0,0 +1,73 @@
+import pytest
+
+from howfuckedistheinternet import history
+
+
+def test_ring_buffer():
+    store = history.HistoryStore(3, 2)
+    for value in (1, 2, 3, 4, 5):
+        store.append("v4", value)
+    assert store.samples("v4") == [5, 4, 3]
+    assert store.latest("v4") == 5
+    assert store.mean("v4") == 4
+    assert list(store.items()) == [("v4", 5, 4)]
+
+
+def test_retire_and_evict():
+    store = history.HistoryStore(3, 2)
+    store.append("192.0.2.0/24", 1)
+    store.append("198.51.100.0/24", 2)
+    store.retire_missing({"198.51.100.0/24"})
+    assert store.end_cycle() == 0
+    assert [key for key, _, _ in store.items()] == ["198.51.100.0/24"]
+
+    # Coming back within evict_after cycles keeps the history
+    store.append("192.0.2.0/24", 3)
+    assert store.samples("192.0.2.0/24") == [3, 1]
+
+    store.retire("192.0.2.0/24")
+    store.end_cycle()
+    assert store.end_cycle() == 1
+    assert "192.0.2.0/24" not in store
+    assert len(store) == 1
+
+    # Evicted slots are reused, starting from an empty history
+    store.append(64496, 7)
+    assert store.samples(64496) == [7]
+    assert store.mean(64496) == 7
+
+
+def test_persistence(tmp_path):
+    path = str(tmp_path / "prefixes.hist")
+    store = history.HistoryStore(4, 2, path)
+    for asn in range(2000):
+        store.append(asn, asn * 2)
+    store.append(1335, 10)
+    store.append("2001:db8::/32", 3)
+    store.retire(1)
+    store.end_cycle()
+    store.close()
+
+    store = history.HistoryStore(4, 2, path)
+    assert len(store) == 2001
+    assert store.cycle == 1
+    assert store.samples(1335) == [10, 2670]
+    assert store.samples("2001:db8::/32") == [3]
+    items = list(store.items())
+    assert 1 not in [key for key, _, _ in items]
+    assert items == [(key, store.latest(key), store.mean(key)) for key, _, _ in items]
+    assert store.unsettled == {key for key, _, _ in items}
+    store.append(1335, 12)
+    assert store.end_cycle() == 1
+    store.close()
+
+    # A different width can't reuse the file, so starts afresh
+    store = history.HistoryStore(6, 2, path)
+    assert len(store) == 0
+    store.close()
+
+
+def test_key_too_long():
+    store = history.HistoryStore(4, 2, key_size=16)
+    with pytest.raises(ValueError):
+        store.append("rsync://rpki.example.net/repository/", 1)
@@ -0,0 +1,56 @@
+import http.server
+
+import pytest
+
+from howfuckedistheinternet import httpcache
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    body = b'{"incidents": []}\n'
+    etag = '"v1"'
+    requests: list[dict[str, str]] = []
+
+    def do_GET(self):
+        Handler.requests.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+
+@pytest.fixture
+def server(serve, tmp_path, monkeypatch):
+    monkeypatch.setattr(httpcache.config, "http_cache_dir", str(tmp_path))
+    monkeypatch.setattr(httpcache, "_parsed", {})
+    Handler.requests = []
+    return serve(Handler) + "/"
+
+
+def test_get_json_revalidates(server):
+    first = httpcache.get_json(server)
+    assert first == {"incidents": []}
+    assert "If-None-Match" not in Handler.requests[0]
+
+    # A 304 hands back the very same parsed object
+    assert httpcache.get_json(server) is first
+    assert Handler.requests[1]["If-None-Match"] == '"v1"'
+
+    # And after a restart, the cached body is parsed from disk
+    httpcache._parsed.clear()
+    assert httpcache.get_json(server) == first
+
+
+def test_stream_lines(server):
+    Handler.body = b'{"CIDR": "192.0.2.0/24"}\n{"CIDR": "2001:db8::/32"}\n'
+    fresh, lines = httpcache.stream_lines(server)
+    assert fresh
+    assert list(lines) == [b'{"CIDR": "192.0.2.0/24"}', b'{"CIDR": "2001:db8::/32"}']
+
+    fresh, lines = httpcache.stream_lines(server)
+    assert not fresh
+    assert list(lines) == [b'{"CIDR": "192.0.2.0/24"}', b'{"CIDR": "2001:db8::/32"}']
@@ -0,0 +1,46 @@
+import http.server
+
+import brotli
+import pytest
+
+from howfuckedistheinternet import httpclient
+
+body = b'{"route": 1}\n{"route": 2}\n{"route": 3}'
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        content = body
+        self.send_response(200)
+        if "br" in self.headers.get("Accept-Encoding", ""):
+            content = brotli.compress(body)
+            self.send_header("Content-Encoding", "br")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+@pytest.fixture
+def server(serve):
+    return serve(Handler).removeprefix("http://")
+
+
+def test_connections_are_reused_and_counted(server):
+    for _ in range(3):
+        response = httpclient.get(f"http://{server}/table.jsonl")
+        assert response.headers["Content-Encoding"] == "br"
+        assert response.content == body
+
+    stats = httpclient.stats()[server]
+    assert stats["requests"] == 3
+    assert stats["connections"] == 1
+    assert stats["errors"] == 0
+    assert 0 < stats["mean_ms"] <= stats["max_ms"]
+
+
+def test_stream_lines(server):
+    response = httpclient.stream(f"http://{server}/table.jsonl")
+    try:
+        assert list(httpclient.iter_lines(response, chunk_size=5)) == body.split(b"\n")
+    finally:
+        response.close()
@@ -0,0 +1,57 @@
+import os
+import shutil
+
+import pytest
+import ujson
+
+from howfuckedistheinternet import render
+
+template = os.path.join(os.path.dirname(__file__), "../../html/index.j2")
+
+
+@pytest.fixture
+def renderer(tmp_path):
+    shutil.copy(template, tmp_path / "index.j2")
+    return render.Renderer(str(tmp_path))
+
+
+def test_render(renderer, tmp_path):
+    renderer.render(
+        "The Internet is rather fucked",
+        "2026-10-17 12:00:00Z",
+        "5",
+        [("[DFZ] IPv4 DFZ has decreased", "dfz", 3), ("[DNS] m.root-servers.net is down", "dns_root", 10)],
+        [
+            {"metric": "dfz", "description": "DFZ size", "weight": 3, "frequency": 1800, "last": "ok"},
+            {"metric": "dns_root", "description": "DNS roots", "weight": 10, "frequency": 1800, "last": "timed out"},
+        ],
+        sparklines={"dfz.v4": {"24h": [950000.0, 950100.0, 949900.0]}},
+    )
+
+    html = (tmp_path / "index.html").read_text()
+    assert "<h1>The Internet is rather fucked</h1>" in html
+    # Heaviest first
+    assert html.index("m.root-servers.net") < html.index("IPv4 DFZ has decreased")
+    assert html.index("DNS roots") < html.index("DFZ size")
+    assert 'points="0.0,10.0 50.0,0.5 100.0,19.5 "' in html
+
+    document = ujson.loads((tmp_path / "index.json").read_text())
+    assert document["status"] == "The Internet is rather fucked"
+    assert [metric["last"] for metric in document["metrics"]] == ["timed out", "ok"]
+    assert document["metrics"][0]["reasons"][0]["text"] == "m.root-servers.net is down"
+    assert oct(os.stat(tmp_path / "index.html").st_mode & 0o777) == "0o644"
+
+
+def test_write_atomic_leaves_the_old_file_on_failure(tmp_path, monkeypatch):
+    path = str(tmp_path / "index.html")
+    render.write_atomic(path, "old")
+
+    def fail(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(render.os, "replace", fail)
+    with pytest.raises(OSError):
+        render.write_atomic(path, "new")
+
+    assert open(path).read() == "old"
+    assert os.listdir(tmp_path) == ["index.html"]
@@ -0,0 +1,88 @@
+import pytest
+
+from howfuckedistheinternet import resultcache
+from howfuckedistheinternet.breaker import SourceUnavailable
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_serves_last_good_result_while_failing():
+    clock = Clock()
+    results = resultcache.ResultCache(3600, clock)
+
+    # A failed fetch with nothing to fall back on is reported as a failure, rather than a clean result
+    with pytest.raises(resultcache.FetchFailed) as e:
+        results.fetch("cloudflare", lambda: None)
+    assert e.value.outcome == "failed"
+    assert results.age("cloudflare") is None
+
+    assert results.fetch("cloudflare", lambda: {"major": ["DNS"]}) == {"major": ["DNS"]}
+    assert results.age("cloudflare") is None
+
+    clock.now += 600
+    assert results.fetch("cloudflare", lambda: None) == {"major": ["DNS"]}
+    assert results.age("cloudflare") == 600
+
+    # A quiet but successful fetch isn't a failure
+    assert results.fetch("cloudflare", lambda: {}) == {}
+    assert results.age("cloudflare") is None
+
+    # Results too old to be of use aren't served
+    clock.now += 3601
+    with pytest.raises(resultcache.FetchFailed):
+        results.fetch("cloudflare", lambda: None)
+    assert results.age("cloudflare") is None
+
+
+def test_serves_last_good_result_while_unavailable():
+    clock = Clock()
+    results = resultcache.ResultCache(3600, clock)
+
+    def unavailable():
+        raise SourceUnavailable("bgp.tools", clock.now + 60)
+
+    with pytest.raises(SourceUnavailable):
+        results.fetch("bgp", unavailable)
+
+    assert results.fetch("rpki", lambda: ({"repo": 1}, {"repo": 10}), good=any) == ({"repo": 1}, {"repo": 10})
+    assert results.fetch("rpki", lambda: ({}, {}), good=any) == ({"repo": 1}, {"repo": 10})
+    clock.now += 60
+    assert results.fetch("rpki", unavailable, good=any) == ({"repo": 1}, {"repo": 10})
+    assert results.age("rpki") == 60
+
+
+def test_stale_results_are_not_checked_again():
+    from howfuckedistheinternet import history
+    from howfuckedistheinternet.services import rpki
+
+    clock = Clock()
+    results = resultcache.ResultCache(3600, clock)
+    totals = history.HistoryStore(4, 48)
+
+    def check(total_roa):
+        return rpki.check_rpki_totals(total_roa, totals)[0]
+
+    fresh = results.fetch("rpki", lambda: {"rrdp.ripe.net": 100})
+    assert results.check("rpki", check, fresh) == []
+    assert totals.cycle == 1
+
+    # Retrying while the source fails serves the same result, which mustn't be added to the history again
+    for _ in range(5):
+        clock.now += 120
+        stale = results.fetch("rpki", lambda: None)
+        assert results.age("rpki") is not None
+        assert results.check("rpki", check, stale) == []
+    assert totals.cycle == 1
+    assert list(totals.items()) == [("rrdp.ripe.net", 100, 100)]
+
+    clock.now += 120
+    fresh = results.fetch("rpki", lambda: {"rrdp.ripe.net": 10})
+    results.check("rpki", check, fresh)
+    assert totals.cycle == 2
+    assert list(totals.items()) == [("rrdp.ripe.net", 10, 55)]
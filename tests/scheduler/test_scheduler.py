@@ -0,0 +1,192 @@
+import threading
+import time
+
+from howfuckedistheinternet import scheduler
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_jobs_run_at_their_own_frequency():
+    clock = Clock()
+    schedule = scheduler.Scheduler(clock, clock.sleep)
+    slow = scheduler.Job("bgp", ["dfz"], lambda: {}, 1800)
+    fast = scheduler.Job("slack", ["slack"], lambda: {}, 60)
+    schedule.add(slow)
+    schedule.add(fast)
+
+    runs = []
+    while clock.now < 1000 + 3600:
+        schedule.wait()
+        for job in schedule.pop_due():
+            runs.append((clock.now - 1000, job.name))
+            schedule.reschedule(job)
+
+    assert runs[:3] == [(0, "bgp"), (0, "slack"), (60, "slack")]
+    assert [t for t, name in runs if name == "bgp"] == [0, 1800, 3600]
+    assert len([name for _, name in runs if name == "slack"]) == 61
+
+
+def test_overrunning_job_is_not_run_back_to_back():
+    clock = Clock()
+    schedule = scheduler.Scheduler(clock, clock.sleep)
+    job = scheduler.Job("atlas", ["ntp"], lambda: {}, 60)
+    schedule.add(job)
+
+    assert schedule.pop_due() == [job]
+    clock.now += 200
+    schedule.reschedule(job)
+    assert schedule.next_due() == clock.now
+
+    assert schedule.pop_due() == [job]
+    clock.now += 10
+    schedule.reschedule(job)
+    assert schedule.next_due() == clock.now + 50
+    assert schedule.pop_due() == []
+    assert len(schedule) == 1
+
+
+def test_runner_runs_jobs_concurrently_with_deadlines():
+    release = threading.Event()
+
+    def slow():
+        time.sleep(0.3)
+        return {"dfz": ["[DFZ] slow"]}
+
+    def hung():
+        release.wait()
+        return {"ntp": ["[NTP] too late"]}
+
+    def broken():
+        raise ValueError("nope")
+
+    schedule = scheduler.Scheduler()
+    jobs = {
+        "bgp": scheduler.Job("bgp", ["dfz"], slow, 60, timeout=5),
+        "aws": scheduler.Job("aws", ["aws"], lambda: {"aws": []}, 60, timeout=5),
+        "atlas": scheduler.Job("atlas", ["ntp"], hung, 0.5, timeout=0.4),
+        "gcp": scheduler.Job("gcp", ["gcp"], broken, 60),
+    }
+    for job in jobs.values():
+        schedule.add(job)
+
+    completed = []
+    runner = scheduler.Runner(schedule, 4, lambda job, outcome, reasons, duration: completed.append(
+        (job.name, outcome, reasons, duration)
+    ))
+    before = time.monotonic()
+    try:
+        while len(completed) < 4:
+            runner.step()
+        elapsed = time.monotonic() - before
+
+        outcomes = {name: (outcome, reasons) for name, outcome, reasons, _ in completed}
+        assert outcomes == {
+            "bgp": (scheduler.OK, {"dfz": ["[DFZ] slow"]}),
+            "aws": (scheduler.OK, {"aws": []}),
+            "atlas": (scheduler.TIMED_OUT, {}),
+            "gcp": (scheduler.FAILED, {}),
+        }
+        # Run side by side, so the whole lot only takes as long as the slowest
+        assert elapsed < 0.6
+        assert max(duration for *_, duration in completed) < 0.6
+
+        # The hung job is due again, but isn't started a second time while it's still running
+        while time.monotonic() - before < 0.8:
+            runner.step()
+        assert runner.busy(jobs["atlas"])
+        assert [name for name, *_ in completed].count("atlas") == 1
+
+        # Once it's finished, its late result is thrown away
+        release.set()
+        while runner.busy(jobs["atlas"]):
+            runner.step()
+        assert [name for name, *_ in completed].count("atlas") == 1
+    finally:
+        release.set()
+        runner.shutdown()
+
+
+def test_runner_durations_while_jobs_overlap():
+    def slow():
+        time.sleep(0.6)
+        return {}
+
+    schedule = scheduler.Scheduler()
+    schedule.add(scheduler.Job("bgp", ["dfz"], slow, 60))
+    schedule.add(scheduler.Job("aws", ["aws"], lambda: {}, 0.1))
+    completed = []
+    runner = scheduler.Runner(schedule, 2, lambda job, outcome, reasons, duration: completed.append((job.name, duration)))
+    try:
+        while "bgp" not in [name for name, _ in completed]:
+            runner.step()
+    finally:
+        runner.shutdown()
+
+    # Each job's own run time, not the time since the first of the overlapping jobs started
+    durations = dict(completed)
+    assert [name for name, _ in completed].count("aws") > 2
+    assert max(duration for name, duration in completed if name == "aws") < 0.3
+    assert durations["bgp"] >= 0.6
+
+
+def test_runner_without_jobs():
+    runner = scheduler.Runner(scheduler.Scheduler(), 1, lambda *args: None)
+    try:
+        assert not runner.step()
+    finally:
+        runner.shutdown()
+
+
+def test_runner_outcome_from_exception():
+    class Unavailable(Exception):
+        outcome = "source unavailable"
+
+    def unavailable():
+        raise Unavailable("bgp.tools is unavailable for another 60s")
+
+    schedule = scheduler.Scheduler()
+    schedule.add(scheduler.Job("bgp", ["dfz"], unavailable, 60))
+    completed = []
+    runner = scheduler.Runner(schedule, 1, lambda job, outcome, reasons, duration: completed.append((outcome, reasons)))
+    try:
+        while not completed:
+            runner.step()
+    finally:
+        runner.shutdown()
+    assert completed == [("source unavailable", {})]
+
+
+def test_retry_brings_a_job_forward():
+    clock = Clock()
+    schedule = scheduler.Scheduler(clock, clock.sleep)
+    job = scheduler.Job("cloudflare", ["cloudflare"], lambda: {}, 1800)
+    other = scheduler.Job("bgp", ["dfz"], lambda: {}, 1800)
+    schedule.add(job)
+    schedule.add(other, clock.now + 300)
+
+    assert schedule.pop_due() == [job]
+    schedule.reschedule(job)
+    schedule.retry(job, 120)
+    assert len(schedule) == 2
+    assert schedule.next_due() == clock.now + 120
+
+    # Doesn't push it back if it's already due sooner
+    schedule.retry(job, 600)
+    assert schedule.next_due() == clock.now + 120
+
+    clock.now += 120
+    assert schedule.pop_due() == [job]
+    schedule.reschedule(job)
+    clock.now += 180
+    assert schedule.pop_due() == [other]
+    assert len(schedule) == 1
+    assert schedule.next_due() == job.due == 1000 + 120 + 1800